@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Compare the concat backends of livestream_saver.concat on synthetic segments.
+
+Usage: python benchmarks/bench_concat.py [--dir DIR] [--count N] [--size BYTES]
+
+Use --dir to benchmark a particular filesystem (btrfs or XFS for reflinks).
+Caches are not dropped between runs, so results mostly reflect the cost of
+moving data through user space versus kernel space.
+"""
+import argparse
+import json
+import os
+import sys
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from livestream_saver.concat import concat_files, available_backends
+
+
+def make_segments(directory: Path, count: int, size: int):
+    segments = []
+    # Vary sizes a little, like real segments, in multiples of TS packets
+    for i in range(count):
+        path = directory / f"{i:0{10}}_video.ts"
+        path.write_bytes(os.urandom(size + (i % 7) * 188))
+        segments.append(path)
+    return segments
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dir", type=Path, default=None,
+        help="Directory where to write temporary files. (Default: system temp)")
+    parser.add_argument("--count", type=int, default=500,
+        help="Number of segments. (Default: 500)")
+    parser.add_argument("--size", type=int, default=1024 * 1024,
+        help="Approximate size of each segment in bytes. (Default: 1MiB)")
+    parser.add_argument("--repeat", type=int, default=3,
+        help="Number of runs per backend, the best one is kept. (Default: 3)")
+    parser.add_argument("--json", action="store_true",
+        help="Print results as JSON.")
+    args = parser.parse_args()
+
+    results = {}
+    with TemporaryDirectory(dir=args.dir) as tmp:
+        tmp = Path(tmp)
+        segments = make_segments(tmp, args.count, args.size)
+        total = sum(p.stat().st_size for p in segments)
+        expected = None
+        for backend in available_backends():
+            best = None
+            used = {}
+            for _ in range(args.repeat):
+                dest = tmp / f"concat_{backend}.ts"
+                start = perf_counter()
+                used = concat_files(segments, dest, backend=backend)
+                elapsed = perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            data = dest.read_bytes()
+            if expected is None:
+                expected = data
+            results[backend] = {
+                "seconds": round(best, 4),
+                "MiB/s": round(total / (1024 * 1024) / best, 1),
+                "files_per_backend": used,
+                "identical": data == expected,
+            }
+            dest.unlink()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{args.count} segments, {total / (1024 * 1024):.1f} MiB total")
+    for backend, res in results.items():
+        print(f"{backend:>16}: {res['seconds']:8.4f}s {res['MiB/s']:9.1f} MiB/s"
+              f"  used: {res['files_per_backend']}"
+              f"{'' if res['identical'] else '  OUTPUT DIFFERS!'}")
+
+
+if __name__ == "__main__":
+    main()
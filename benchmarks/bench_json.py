@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Compare the JSON backends of livestream_saver.util on YouTube responses.
+
+Usage: python benchmarks/bench_json.py [--size KB] [--repeat N] [FILE ...]
+
+By default, the JSON fixtures of test/data are repeated until they weigh
+about --size KB, which is how large API responses for a channel tab or a
+video player usually are. Pass saved responses as FILE to use those instead.
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from livestream_saver.util import JSON_BACKENDS
+
+DATA_DIR = Path(__file__).resolve().parent.parent / "test" / "data"
+
+
+def load_samples(files, size: int):
+    samples = {}
+    if files:
+        for path in files:
+            samples[path.name] = path.read_text(encoding="utf-8")
+        return samples
+    for path in sorted(DATA_DIR.glob("*.json")):
+        fixture = json.loads(path.read_text(encoding="utf-8"))
+        one = len(json.dumps(fixture))
+        copies = max(1, size * 1024 // one)
+        samples[path.stem] = json.dumps({"contents": [fixture] * copies})
+    return samples
+
+
+def bench(loads, data, repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        start = perf_counter()
+        loads(data)
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="*", type=Path, metavar="FILE",
+        help="JSON documents to parse instead of the test fixtures.")
+    parser.add_argument("--size", type=int, default=500,
+        help="Approximate size of the documents made from the fixtures, "
+             "in KB. (Default: 500)")
+    parser.add_argument("--repeat", type=int, default=20,
+        help="Number of runs per backend, the best one is kept. (Default: 20)")
+    parser.add_argument("--json", action="store_true",
+        help="Print results as JSON.")
+    args = parser.parse_args()
+
+    results = {}
+    for name, text in load_samples(args.files, args.size).items():
+        data = text.encode("utf-8")
+        results[name] = {"KB": round(len(data) / 1024, 1)}
+        expected = None
+        for backend, loads in JSON_BACKENDS.items():
+            parsed = loads(text)
+            if expected is None:
+                expected = parsed
+            results[name][backend] = {
+                "str_seconds": round(bench(loads, text, args.repeat), 5),
+                "bytes_seconds": round(bench(loads, data, args.repeat), 5),
+                "identical": parsed == expected,
+            }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for name, res in results.items():
+        print(f"{name} ({res['KB']} KB)")
+        for backend in JSON_BACKENDS:
+            r = res[backend]
+            print(f"{backend:>10}: {r['str_seconds'] * 1000:8.2f}ms from str "
+                  f"{r['bytes_seconds'] * 1000:8.2f}ms from bytes"
+                  f"{'' if r['identical'] else '  OUTPUT DIFFERS!'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Time the stages of the merge pipeline on synthetic MPEG-TS segments.
+
+Usage: python benchmarks/bench_merge.py [--count N] [--output FILE]
+                                        [--baseline FILE]
+
+Video and audio segments are generated locally with ffmpeg's lavfi sources
+(testsrc2 and sine), then some are removed (--gap-rate) or have packets cut
+out of them (--corrupt-rate), which ffmpeg reports as corrupt packets.
+The stages timed are: collect, parity (comparison of both tracks),
+get_corrupt, native_concat and the final mux.
+
+Results are written as JSON. With --baseline, stage timings are compared to
+a previous result file and the exit code is 1 if any stage got slower than
+the tolerance allows, or if injected gaps were not detected.
+"""
+import argparse
+import json
+import logging
+import platform
+import random
+import subprocess
+import sys
+from datetime import datetime
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from livestream_saver.merge import (
+    NativeConcatFile, collect_index, compare_tracks, get_corrupt, mux_tracks
+)
+from livestream_saver.mpegts import TS_PACKET_SIZE
+
+
+def ffmpeg_version() -> str:
+    cproc = subprocess.run(
+        ["ffmpeg", "-version"], capture_output=True, text=True, check=True)
+    return cproc.stdout.splitlines()[0]
+
+
+def generate_track(args, source: str, codec_args, pattern: Path) -> None:
+    pattern.parent.mkdir(parents=True, exist_ok=True)
+    duration = args.count * args.segment_duration
+    subprocess.run(
+        ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+         "-f", "lavfi", "-i", source,
+         "-t", str(duration),
+         *codec_args,
+         "-f", "segment",
+         "-segment_time", str(args.segment_duration),
+         "-segment_format", "mpegts",
+         str(pattern)],
+        check=True)
+
+
+def generate(args, data_dir: Path) -> None:
+    """Write count video and audio segments in data_dir/vid and data_dir/aud."""
+    fps = 30
+    generate_track(
+        args,
+        f"testsrc2=size={args.resolution}:rate={fps}",
+        ["-c:v", "libx264", "-preset", "ultrafast", "-b:v", args.bitrate,
+         # One keyframe at the start of each segment, like Youtube does
+         "-force_key_frames", f"expr:gte(t,n_forced*{args.segment_duration})"],
+        data_dir / "vid" / "%010d_video.ts")
+    generate_track(
+        args,
+        "sine=frequency=1000:sample_rate=48000",
+        ["-c:a", "aac", "-b:a", "128k"],
+        data_dir / "aud" / "%010d_audio.ts")
+
+
+def cut_packets(path: Path, rng: random.Random) -> None:
+    """Remove a few packets from the middle of a segment, which breaks the
+    continuity counters so that the demuxer flags the packets as corrupt."""
+    data = path.read_bytes()
+    count = len(data) // TS_PACKET_SIZE
+    if count < 10:
+        return
+    start = rng.randrange(count // 4, count * 3 // 4)
+    end = start + rng.randint(2, 5)
+    path.write_bytes(
+        data[:start * TS_PACKET_SIZE] + data[end * TS_PACKET_SIZE:])
+
+
+def inject_problems(args, data_dir: Path) -> dict:
+    """Remove and corrupt random segments. Return what was done."""
+    rng = random.Random(args.seed)
+    injected = {"missing": [], "corrupt": []}
+    for path in sorted((data_dir / "vid").glob("*.ts")):
+        seg_num = int(path.stem[:-6])
+        # Never touch the first and last segments, which are used as
+        # references for durations.
+        if seg_num == 0 or seg_num == args.count - 1:
+            continue
+        track = rng.choice(("vid", "aud"))
+        target = data_dir / track / path.name.replace(
+            "_video", "_video" if track == "vid" else "_audio")
+        roll = rng.random()
+        if roll < args.gap_rate:
+            target.unlink(missing_ok=True)
+            injected["missing"].append(f"{track}/{target.name}")
+        elif roll < args.gap_rate + args.corrupt_rate:
+            cut_packets(target, rng)
+            injected["corrupt"].append(f"{track}/{target.name}")
+    return injected
+
+
+def timed(results: dict, name: str, func, repeat: int = 1):
+    """Run func repeat times, keep the best time in results and return the
+    value of the last call."""
+    best = None
+    value = None
+    for _ in range(repeat):
+        start = perf_counter()
+        value = func()
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    results[name] = {"seconds": round(best, 4)}
+    return value
+
+
+def run_stages(args, data_dir: Path, out_dir: Path) -> tuple[dict, dict]:
+    stages: dict = {}
+    detected: dict = {}
+
+    video_index, audio_index = timed(
+        stages, "collect",
+        lambda: (collect_index(data_dir / "vid"), collect_index(data_dir / "aud")),
+        repeat=args.repeat)
+    total_bytes = video_index.total_size + audio_index.total_size
+
+    affected, missing_video, missing_audio = timed(
+        stages, "parity",
+        lambda: compare_tracks(video_index, audio_index),
+        repeat=args.repeat)
+    detected["missing"] = sorted(
+        [f"vid/{i:0{10}}_video.ts" for i in missing_video]
+        + [f"aud/{i:0{10}}_audio.ts" for i in missing_audio])
+    # Like merge(), drop segments with no counterpart in the other track
+    affected = set(affected)
+    video_files = video_index.without(affected).paths()
+    audio_files = audio_index.without(affected).paths()
+
+    if not args.skip_corrupt_scan:
+        corrupt = timed(
+            stages, "get_corrupt",
+            lambda: get_corrupt(video_files) + get_corrupt(audio_files))
+        detected["corrupt"] = sorted(f"{f.parent.name}/{f.name}" for f in corrupt)
+
+    tracks = [
+        NativeConcatFile(video_files, "h264", "bench", out_dir),
+        NativeConcatFile(audio_files, "aac", "bench", out_dir),
+    ]
+    timed(
+        stages, "native_concat",
+        lambda: [track.native_concat(overwrite=True) for track in tracks],
+        repeat=args.repeat)
+    stages["native_concat"]["MiB/s"] = round(
+        total_bytes / 1048576 / max(stages["native_concat"]["seconds"], 1e-9), 1)
+
+    final_output_file = out_dir / "bench.mp4"
+    timed(
+        stages, "mux",
+        lambda: mux_tracks(
+            [track.temp_concat for track in tracks],
+            {"id": "bench"}, data_dir, final_output_file))
+    detected["output_bytes"] = final_output_file.stat().st_size \
+        if final_output_file.exists() else 0
+    return stages, detected
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Return a description of each stage slower than in baseline."""
+    regressions = []
+    for name, stage in results["stages"].items():
+        if (before := baseline.get("stages", {}).get(name)) is None:
+            continue
+        if stage["seconds"] > before["seconds"] * (1 + tolerance):
+            regressions.append(
+                f"{name}: {stage['seconds']}s instead of {before['seconds']}s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dir", type=Path, default=None,
+        help="Directory where to write temporary files. (Default: system temp)")
+    parser.add_argument("--data-dir", type=Path, default=None,
+        help="Reuse (or keep) the generated segments in this directory, "
+             "instead of generating them again in a temporary directory.")
+    parser.add_argument("--count", type=int, default=300,
+        help="Number of segments per track. (Default: 300)")
+    parser.add_argument("--segment-duration", type=float, default=1.0,
+        help="Duration of each segment in seconds. (Default: 1.0)")
+    parser.add_argument("--resolution", default="640x360",
+        help="Video resolution. (Default: 640x360)")
+    parser.add_argument("--bitrate", default="1M",
+        help="Video bitrate, which determines segment sizes. (Default: 1M)")
+    parser.add_argument("--gap-rate", type=float, default=0.01,
+        help="Proportion of segments removed from either track. (Default: 0.01)")
+    parser.add_argument("--corrupt-rate", type=float, default=0.01,
+        help="Proportion of segments corrupted in either track. (Default: 0.01)")
+    parser.add_argument("--seed", type=int, default=0,
+        help="Seed of the random generator choosing segments. (Default: 0)")
+    parser.add_argument("--repeat", type=int, default=3,
+        help="Number of runs of the cheap stages, the best one is kept. "
+             "(Default: 3)")
+    parser.add_argument("--skip-corrupt-scan", action="store_true",
+        help="Do not time get_corrupt(), which runs ffprobe on each segment.")
+    parser.add_argument("--output", type=Path, default=None,
+        help="Write results as JSON to this file. (Default: print them)")
+    parser.add_argument("--baseline", type=Path, default=None,
+        help="Previous results to compare against.")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+        help="Allowed slowdown relative to the baseline. (Default: 0.25)")
+    args = parser.parse_args()
+
+    # Merge functions log a lot at INFO level
+    logging.basicConfig(level=logging.WARNING)
+
+    with TemporaryDirectory(dir=args.dir) as tmp:
+        tmp = Path(tmp)
+        data_dir = args.data_dir or tmp / "stream_capture_bench"
+        injected = None
+        manifest = data_dir / "injected.json"
+        if manifest.exists():
+            injected = json.loads(manifest.read_text())
+        else:
+            start = perf_counter()
+            generate(args, data_dir)
+            injected = inject_problems(args, data_dir)
+            manifest.write_text(json.dumps(injected))
+            print(f"Generated segments in {perf_counter() - start:.1f}s.",
+                  file=sys.stderr)
+        stages, detected = run_stages(args, data_dir, tmp)
+
+    results = {
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "ffmpeg": ffmpeg_version(),
+        },
+        "params": {
+            key: str(value) if isinstance(value, Path) else value
+            for key, value in vars(args).items()
+        },
+        "stages": stages,
+        "injected": injected,
+        "detected": detected,
+    }
+    # Missing segments are always detected; corruption may go unnoticed if
+    # packets were cut in a way the demuxer does not notice.
+    undetected = sorted(set(injected["missing"]) - set(detected["missing"]))
+    results["undetected_missing"] = undetected
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        args.output.write_text(output)
+    else:
+        print(output)
+
+    failed = bool(undetected)
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text())
+        for regression in compare(results, baseline, args.tolerance):
+            print(f"Regression: {regression}", file=sys.stderr)
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
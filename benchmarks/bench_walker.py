@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Time the collection of video posts from channel tab JSON, with the former
+recursive walker and the current iterative one.
+
+Usage: python benchmarks/bench_walker.py [--copies N] [--repeat N] [--json]
+
+The JSON fixtures of test/data are tiny, so their items are copied N times
+with distinct video Ids, and decorated with the kind of menus, thumbnails and
+tracking parameters found in real responses, which the walker can skip.
+"""
+import argparse
+import json
+import sys
+from copy import deepcopy
+from pathlib import Path
+from time import perf_counter
+from typing import Any, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from livestream_saver.channel import (
+    VideoPost, DedupedVideoList, _get_content_from_any_renderer,
+    _video_post_from_lockup_view_model
+)
+
+DATA_DIR = Path(__file__).resolve().parent.parent / "test" / "data"
+
+
+class Channel:
+    """Stands in for YoutubeChannel, counting lookups of its name."""
+    def __init__(self) -> None:
+        self.lookups = 0
+
+    @property
+    def name(self) -> str:
+        self.lookups += 1
+        return "benchmark channel"
+
+
+def recursive_walk(content: Any, channel: Channel) -> List[VideoPost]:
+    """The walker as it was before, for reference."""
+    videos = DedupedVideoList()
+
+    def walk(node: Any) -> None:
+        if isinstance(node, list):
+            for item in node:
+                walk(item)
+            return
+        if not isinstance(node, dict):
+            return
+        if lockup := node.get("lockupViewModel"):
+            if vid := _video_post_from_lockup_view_model(lockup, channel.name):
+                videos.append(vid)
+            return
+        if node.get("videoId") and node.get("navigationEndpoint") \
+        and node.get("title"):
+            try:
+                videos.append(VideoPost.from_post(node, channel.name))
+            except Exception:
+                pass
+        for value in node.values():
+            if isinstance(value, (dict, list)):
+                walk(value)
+
+    walk(content)
+    return list(videos)
+
+
+def noise(i: int) -> dict:
+    return {
+        "trackingParams": "CAAQ" + "x" * 60,
+        "thumbnail": {"thumbnails": [
+            {"url": f"https://i.ytimg.com/vi/{i}/{size}.jpg",
+             "width": size, "height": size}
+            for size in (168, 196, 246, 336)
+        ]},
+        "menu": {"menuRenderer": {"items": [
+            {"menuServiceItemRenderer": {
+                "text": {"runs": [{"text": text}]},
+                "serviceEndpoint": {
+                    "clickTrackingParams": "CBQQ" + "y" * 40,
+                    "commandMetadata": {"webCommandMetadata": {
+                        "sendPost": True, "apiUrl": "/youtubei/v1/share"}},
+                },
+                "trackingParams": "CBQQ" + "z" * 40,
+            }}
+            for text in ("Add to queue", "Save", "Share", "Not interested")
+        ]}},
+        "accessibility": {"accessibilityData": {"label": "x" * 80}},
+    }
+
+
+def inflate(node: Any, copy: int) -> Any:
+    """
+    Give a distinct Id to every video of node, and add noise to every
+    renderer, like real responses have.
+    """
+    if isinstance(node, list):
+        return [inflate(item, copy) for item in node]
+    if not isinstance(node, dict):
+        return node
+    node = {key: inflate(value, copy) for key, value in node.items()}
+    for key, value in node.items():
+        if key.endswith("Renderer") and isinstance(value, dict):
+            value.update(noise(copy))
+    for key in ("videoId", "contentId"):
+        if key in node:
+            node[key] = f"{node[key]}_{copy}"
+    return node
+
+
+def make_tab(fixture: Any, copies: int) -> dict:
+    return {"contents": [inflate(deepcopy(fixture), i) for i in range(copies)]}
+
+
+def bench(walker, content, repeat: int):
+    best = None
+    for _ in range(repeat):
+        channel = Channel()
+        start = perf_counter()
+        videos = walker(content, channel)
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, videos, channel.lookups
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--copies", type=int, default=200,
+        help="Number of copies of each fixture in a tab. (Default: 200)")
+    parser.add_argument("--repeat", type=int, default=5,
+        help="Number of runs per walker, the best one is kept. (Default: 5)")
+    parser.add_argument("--json", action="store_true",
+        help="Print results as JSON.")
+    args = parser.parse_args()
+
+    walkers = {
+        "recursive": recursive_walk,
+        "iterative": lambda content, channel:
+            _get_content_from_any_renderer("Home", content, channel),
+    }
+    results = {}
+    for path in sorted(DATA_DIR.glob("*.json")):
+        with path.open("r", encoding="utf-8") as f:
+            tab = make_tab(json.load(f), args.copies)
+        results[path.stem] = {}
+        expected = None
+        for name, walker in walkers.items():
+            seconds, videos, lookups = bench(walker, tab, args.repeat)
+            ids = [v.videoId for v in videos]
+            if expected is None:
+                expected = ids
+            results[path.stem][name] = {
+                "seconds": round(seconds, 5),
+                "videos": len(videos),
+                "name_lookups": lookups,
+                "identical": ids == expected,
+            }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for fixture, res in results.items():
+        print(f"{fixture} x{args.copies}")
+        for name, r in res.items():
+            print(f"{name:>12}: {r['seconds'] * 1000:8.2f}ms "
+                  f"{r['videos']:5} videos {r['name_lookups']:5} name lookups"
+                  f"{'' if r['identical'] else '  OUTPUT DIFFERS!'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,23 @@
-from typing import Optional, Any, List, Dict
+from typing import Optional, Any, List, Dict, Callable, Iterator, Iterable
 from pathlib import Path
 import logging
+import threading
+from concurrent.futures import (
+    Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+)
 from dataclasses import dataclass, field
+from time import monotonic, time
+from xml.etree import ElementTree
 
 from livestream_saver.exceptions import TabNotFound, MissingVideoId
 from livestream_saver.hooks import HookCommand
 from livestream_saver.notifier import WebHookFactory, NotificationDispatcher
 from livestream_saver.request import YoutubeUrllibSession
-from livestream_saver.extract import get_browseId_from_json, initial_player_response
+from livestream_saver.state import StateStore
+from livestream_saver.enricher import MetadataEnricher
+from livestream_saver.extract import (
+    get_browseId_from_json, initial_player_response, initial_data
+)
 
 logger = logging.getLogger(__name__)
 
@@ -20,6 +30,38 @@ logger = logging.getLogger(__name__)
 # have been logged out.
 MISSING_THRESHOLD = 3
 
+# Tabs scanned for live videos, in the order their videos are processed
+SCAN_TABS = ("Home", "Community", "Membership", "Videos", "Live")
+# Seconds to wait for the tabs of one scan, which are fetched concurrently
+TAB_TIMEOUT = 30.0
+# Minutes between two full scans of the tabs when the RSS feed is unchanged
+FULL_SCAN_DELAY = 60.0
+# Upcoming videos which should have started more than that many seconds ago
+# are considered cancelled, and no longer force a full scan.
+STALE_UPCOMING = 6 * 3600
+
+# Keys of tab JSON trees which never lead to video posts, and are not worth
+# walking through.
+PRUNED_KEYS = frozenset((
+    "trackingParams",
+    "clickTrackingParams",
+    "loggingDirectives",
+    "loggingContext",
+    "menu",
+    "accessibility",
+    "accessibilityData",
+    "thumbnail",
+    "thumbnails",
+    "avatar",
+    "header",
+    "continuationItemRenderer",
+    "commandMetadata",
+    "webCommandMetadata",
+))
+
+ATOM_NS = "{http://www.w3.org/2005/Atom}"
+YT_NS = "{http://www.youtube.com/xml/schemas/2015}"
+
 
 @dataclass(slots=True)
 class VideoPost:
@@ -34,6 +76,12 @@ class VideoPost:
     startTime: Optional[str] = field(init=False, default=None)
     download_metadata: dict = field(init=False, default_factory=dict)
     channel_name: str = field(init=False)
+    # Fetched from the API for hooks, see YoutubeChannel.apply_metadata()
+    description: str = field(init=False, default="")
+    author: Optional[str] = field(init=False, default=None)
+    liveStatus: Optional[str] = field(init=False, default=None)
+    shortRemainingTime: Optional[str] = field(init=False, default=None)
+    localScheduledTime: Optional[str] = field(init=False, default=None)
 
     def __repr__(self) -> str:
         return self.videoId
@@ -42,7 +90,10 @@ class VideoPost:
         return hash(self.videoId)
 
     def get(self, value, default=None) -> Any:
-        return getattr(self, value, default)
+        # Fields not set yet are None, which callers expect to get as default
+        if (attr := getattr(self, value, None)) is None:
+            return default
+        return attr
 
     def __getitem__(self, value, default=None) -> Any:
         return self.get(value, default)
@@ -122,7 +173,10 @@ class YoutubeChannel:
         notifier: NotificationDispatcher,
         output_dir: Optional[Path] = None,
         hooks: Optional[Dict] = None,
-        name: Optional[str] = None
+        name: Optional[str] = None,
+        state: Optional[StateStore] = None,
+        rss_precheck: bool = False,
+        full_scan_delay: float = FULL_SCAN_DELAY
     ):
         self.session: YoutubeUrllibSession = session
         self.url = URL
@@ -142,6 +196,21 @@ class YoutubeChannel:
 
         # Keep only one json in memory at a time
         self._cached_json: Optional[Dict] = None
+        # Tabs may be fetched from several threads at once
+        self._cache_lock = threading.Lock()
+        self.tab_timeout = TAB_TIMEOUT
+        # Fetches the tabs of each scan, created on first use
+        self._tab_pool: Optional[ThreadPoolExecutor] = None
+        # Last request for each tab, which may still be running after a scan
+        # that timed out waiting for it
+        self._tab_futures: Dict[str, Future] = {}
+
+        # Check the RSS feed before each scan, and only scrape the tabs if it
+        # changed, or every full_scan_delay minutes.
+        self.rss_precheck = rss_precheck
+        self.full_scan_delay = full_scan_delay
+        self.feed: Optional[ChannelFeed] = None
+        self._last_full_scan: Optional[float] = None
 
         # Shows the last type of json (Home tab, Community tab, etc.)
         # TODO We could also check the "selected" field in the json to detect
@@ -154,7 +223,10 @@ class YoutubeChannel:
 
         self.notifier: NotificationDispatcher = notifier
         self.hooks = hooks if hooks is not None else {}
-        self._hooked_videos = []
+        # Fetches the metadata of videos for hooks
+        self.enricher = MetadataEnricher(self.fetch_video_metadata)
+        # Remembers the videos for which hooks have been triggered
+        self.state = state if state is not None else StateStore()
         if not output_dir:
             output_dir = Path().cwd()
         self.output_dir = output_dir
@@ -166,9 +238,11 @@ class YoutubeChannel:
         The current tab data as JSON currently kept in memory.
         Initially, this gets data from the "Home" tab json.
         """
-        if self._cached_json is None:
-            self._cached_json = self.get_home_json(update=True)
-        return self._cached_json
+        with self._cache_lock:
+            cached = self._cached_json
+        if cached is None:
+            cached = self.get_home_json(update=True)
+        return cached
 
     def load_endpoints(self, reset=False) -> Dict[str, Any]:
         """
@@ -178,7 +252,8 @@ class YoutubeChannel:
         if none other are in memory.
         """
         if reset:
-            self._cached_json = None
+            with self._cache_lock:
+                self._cached_json = None
         self._endpoints = get_endpoints_from_json(self.cached_json)
         return self._endpoints
 
@@ -265,18 +340,22 @@ class YoutubeChannel:
         """
         if update or self._cached_json_tab != "Home":
             try:
-                self._cached_json = initial_player_response(
-                    self.session.make_request(self.url))
+                _json = initial_data(self.session.make_request(self.url))
                 # Probably similar to doing:
                 # self.session.make_request(self.url + '/featured')
-                self._cached_json_tab = "Home"
                 # TODO we could check if we are logged in here
             except Exception as e:
                 self.log.warning(f"Failed to get Home json from initial html: {e}")
                 raise e
+            with self._cache_lock:
+                self._cached_json = _json
+                self._cached_json_tab = "Home"
+            return _json
         return self._cached_json
 
-    def get_json_and_cache(self, tab_name: str, update=False) -> Dict:
+    def get_json_and_cache(
+        self, tab_name: str, update=False, cache=True
+    ) -> Dict:
         """
         Return the parsed JSON response for a specified tab. The cache is
         overwritten on each request.
@@ -284,28 +363,36 @@ class YoutubeChannel:
             tab_name: either of "Videos", "Community", "Upcoming", etc.
             update: to force updating, otherwise will use the cached data
             unless it has been overwritten by a request for another tab prior.
+            cache: False to leave the cache alone, for requests made
+            concurrently.
         """
         if update or self._cached_json_tab != tab_name:
             # In the past we got it from the HTML page:
             # self._cached_json = initial_player_response(
             #     self.membership_videos_html)
-            self._cached_json = self.get_tab_json_from_api(tab_name)
-            self._cached_json_tab = tab_name
+            _json = self.get_tab_json_from_api(tab_name)
+            if cache:
+                with self._cache_lock:
+                    self._cached_json = _json
+                    self._cached_json_tab = tab_name
+            # Another thread may have replaced the cache in the meantime
+            return _json
         return self._cached_json
 
-    def get_home_videos(self) -> List[VideoPost]:
+    def get_home_videos(self, tab_json: Optional[Dict] = None) -> List[VideoPost]:
         """
-        Return the currently listed videos from the Home tab.
+        Return the currently listed videos from the Home tab, from tab_json
+        if it was already fetched.
         Note that Upcoming videos might both get listed in Home and the Live
         tab (for livestreams) and possibly the Videos tab (for premieres?).
         Note also that active Livestreams seem to be listed only in this tab,
         and not in the Live tab anymore.
         """
+        if tab_json is None:
+            tab_json = self.get_json_and_cache("Home", update=True)
         home_videos = self.get_videos_from_tab(
             tabtype="Home",
-            tabs=get_tabs_from_json(
-                self.get_json_and_cache("Home", update=True)
-            )
+            tabs=get_tabs_from_json(tab_json)
         )
         # Only after first request, print the full list of Ids retrieved
         if self._home_videos is None:
@@ -340,16 +427,17 @@ class YoutubeChannel:
         self._home_videos = home_videos
         return home_videos
 
-    def get_public_videos(self) -> List[VideoPost]:
+    def get_public_videos(self, tab_json: Optional[Dict] = None) -> List[VideoPost]:
         """
         Return the currently listed videos from the Videos tab (VOD).
         Not super useful right now, but could be in the future if we ever wanted
         to scrape VOD, or record premiering videos as they are streamed.
         """
+        if tab_json is None:
+            tab_json = self.get_json_and_cache("Videos", update=True)
         public_videos = self.get_videos_from_tab(
             tabtype="Videos",
-            tabs=get_tabs_from_json(
-                self.get_json_and_cache("Videos", update=True)),
+            tabs=get_tabs_from_json(tab_json),
         )
         # Only after first request, print the full list of Ids retrieved
         if self._public_videos is None:
@@ -376,14 +464,15 @@ class YoutubeChannel:
         self._public_videos = public_videos
         return public_videos
 
-    def get_public_streams(self) -> List[VideoPost]:
+    def get_public_streams(self, tab_json: Optional[Dict] = None) -> List[VideoPost]:
         """
         Return the currently listed videos from the Live tab.
         """
+        if tab_json is None:
+            tab_json = self.get_json_and_cache("Live", update=True)
         public_streams = self.get_videos_from_tab(
             tabtype="Live",
-            tabs=get_tabs_from_json(
-                self.get_json_and_cache("Live", update=True)),
+            tabs=get_tabs_from_json(tab_json),
         )
         # Only after first request, print the full list of Ids retrieved
         if self._public_streams is None:
@@ -410,11 +499,14 @@ class YoutubeChannel:
         self._public_streams = public_streams
         return public_streams
 
-    def get_community_videos(self) -> List[VideoPost]:
+    def get_community_videos(
+        self, tab_json: Optional[Dict] = None
+    ) -> List[VideoPost]:
+        if tab_json is None:
+            tab_json = self.get_json_and_cache("Community", update=True)
         community_videos = self.get_videos_from_tab(
             tabtype="Community",
-            tabs=get_tabs_from_json(
-                self.get_json_and_cache("Community", update=True)),
+            tabs=get_tabs_from_json(tab_json),
         )
         # Only after first request, print the full list of Ids retrieved
         if self._community_videos is None:
@@ -444,8 +536,11 @@ class YoutubeChannel:
         self._community_videos = community_videos
         return community_videos
 
-    def get_membership_videos(self) -> List[VideoPost]:
-        _json = self.get_json_and_cache("Membership", update=True)
+    def get_membership_videos(
+        self, tab_json: Optional[Dict] = None
+    ) -> List[VideoPost]:
+        _json = tab_json if tab_json is not None \
+            else self.get_json_and_cache("Membership", update=True)
         self.session.is_logged_out(_json)
         membership_videos = self.get_videos_from_tab(
             tabtype="Membership",
@@ -526,14 +621,29 @@ class YoutubeChannel:
             f"Newly added {name} video: {len(new_videos)}\n"
             f"{format_list_output(new_videos)}")
 
+        events = []
         for vid in new_videos:
             if vid.upcoming:
-                self.trigger_hook('on_upcoming_detected', vid)
+                events.append(('on_upcoming_detected', vid))
             if vid.isLiveNow or vid.isLive:
                 continue
             # This should only trigger for VOD (non-live) videos
-            self.trigger_hook('on_video_detected', vid)
+            events.append(('on_video_detected', vid))
+        self.trigger_hooks(events)
 
+    def has_hook(self, hook_name: str) -> bool:
+        return self.hooks.get(hook_name) is not None \
+            or self.notifier.get_webhook(hook_name) is not None
+
+    def trigger_hooks(self, events: List[tuple[str, VideoPost]]) -> None:
+        """
+        Trigger each (hook name, video) pair, once the metadata of all the
+        videos which have a hook to trigger has been fetched concurrently.
+        """
+        self.update_metadata_many(
+            [vid for hook_name, vid in events if self.has_hook(hook_name)])
+        for hook_name, vid in events:
+            self.trigger_hook(hook_name, vid)
 
     def trigger_hook(self, hook_name: str, vid: VideoPost):
         hook_cmd: Optional[HookCommand] = self.hooks.get(hook_name, None)
@@ -554,65 +664,77 @@ class YoutubeChannel:
         """
         Update a VideoPost object with various matadata fetched from the API.
         """
-        url = vid.get("url")
-        vid.download_metadata.update(
-            {
-                "url": f"https://www.youtube.com{url}" if url is not None else None,
-                "cookiefile_path": self.session.cookiefile_path,
-                "logger": self.log,
-                "output_dir": self.output_dir
-            }
-        )
-        description = vid.get("description", "")
-        if not description:
-            json_d = self.fetch_video_metadata(vid)
-            if not json_d:
-                return
+        self.update_metadata_many([vid])
 
-            self.log.debug(
-                f"Got metadata JSON for videoId \"{vid.get('videoId', '')}\".")
-            # if self.logger.isEnabledFor(logging.DEBUG):
-            #     import pprint
-            #     pprint.pprint(json_d, indent=4)
-
-            vid["description"] = json_d.get('videoDetails', {})\
-                                        .get("shortDescription", "")
-            vid["author"] = json_d.get('videoDetails', {})\
-                                    .get("author", "Author?")
-            if isLive := json_d.get('videoDetails', {})\
-                                    .get('isLiveContent', False):
-                # This should overwrite the same value.
-                vid["isLive"] = isLive
-            # "This live event will begin in 3 hours."
-            vid["liveStatus"] = json_d.get('playabilityStatus', {})\
-                                        .get('reason')
-            if liveStreamOfflineSlateRenderer := json_d\
-                .get('playabilityStatus', {})\
-                .get('liveStreamability', {})\
-                .get('liveStreamabilityRenderer', {})\
-                .get('offlineSlate', {})\
-                .get('liveStreamOfflineSlateRenderer', {}):
-                if mainTextruns := liveStreamOfflineSlateRenderer\
-                    .get('mainText', {})\
-                    .get('runs', []):
-                    shortRemainingTime = ""
-                    for text in mainTextruns:
-                        # "Live in " + "3 hours"
-                        shortRemainingTime += text.get('text', "")
-                    vid["shortRemainingTime"] = shortRemainingTime
-
-                if subtitleTextRuns := liveStreamOfflineSlateRenderer\
-                    .get('subtitleText', {})\
-                    .get('runs', []):
-                    if localScheduledTime := subtitleTextRuns[0].get('text'):
-                        # December 22, 11:00 AM GMT+9
-                        vid["localScheduledTime"] = localScheduledTime
-
-                if scheduledStartTime := liveStreamOfflineSlateRenderer\
-                    .get('scheduledStartTime'):
-                    # Timestamp, will overwrite
-                    vid["startTime"] = scheduledStartTime
-            # logger.debug(f"JSON fetched for video {vid}:\n{json_d}")
+    def update_metadata_many(self, videos: List[VideoPost]) -> None:
+        """
+        Update VideoPost objects with metadata fetched from the API, through
+        the enricher, which fetches them concurrently and caches them.
+        """
+        for vid in videos:
+            url = vid.get("url")
+            vid.download_metadata.update(
+                {
+                    "url": f"https://www.youtube.com{url}" if url is not None else None,
+                    "cookiefile_path": self.session.cookiefile_path,
+                    "logger": self.log,
+                    "output_dir": self.output_dir
+                }
+            )
+        missing = [vid for vid in videos if not vid.get("description", "")]
+        if not missing:
+            return
+        fetched = self.enricher.get_many(missing)
+        for vid in missing:
+            if json_d := fetched.get(vid.videoId):
+                self.apply_metadata(vid, json_d)
+
+    def apply_metadata(self, vid: VideoPost, json_d: Dict) -> None:
+        """Update a VideoPost object from its player API response."""
+        self.log.debug(
+            f"Got metadata JSON for videoId \"{vid.get('videoId', '')}\".")
+        # if self.logger.isEnabledFor(logging.DEBUG):
+        #     import pprint
+        #     pprint.pprint(json_d, indent=4)
+
+        vid["description"] = json_d.get('videoDetails', {})\
+                                    .get("shortDescription", "")
+        vid["author"] = json_d.get('videoDetails', {})\
+                                .get("author", "Author?")
+        if isLive := json_d.get('videoDetails', {})\
+                                .get('isLiveContent', False):
+            # This should overwrite the same value.
+            vid["isLive"] = isLive
+        # "This live event will begin in 3 hours."
+        vid["liveStatus"] = json_d.get('playabilityStatus', {})\
+                                    .get('reason')
+        if liveStreamOfflineSlateRenderer := json_d\
+            .get('playabilityStatus', {})\
+            .get('liveStreamability', {})\
+            .get('liveStreamabilityRenderer', {})\
+            .get('offlineSlate', {})\
+            .get('liveStreamOfflineSlateRenderer', {}):
+            if mainTextruns := liveStreamOfflineSlateRenderer\
+                .get('mainText', {})\
+                .get('runs', []):
+                shortRemainingTime = ""
+                for text in mainTextruns:
+                    # "Live in " + "3 hours"
+                    shortRemainingTime += text.get('text', "")
+                vid["shortRemainingTime"] = shortRemainingTime
+
+            if subtitleTextRuns := liveStreamOfflineSlateRenderer\
+                .get('subtitleText', {})\
+                .get('runs', []):
+                if localScheduledTime := subtitleTextRuns[0].get('text'):
+                    # December 22, 11:00 AM GMT+9
+                    vid["localScheduledTime"] = localScheduledTime
+
+            if scheduledStartTime := liveStreamOfflineSlateRenderer\
+                .get('scheduledStartTime'):
+                # Timestamp, will overwrite
+                vid["startTime"] = scheduledStartTime
+        # logger.debug(f"JSON fetched for video {vid}:\n{json_d}")
 
     def fetch_video_metadata(self, vid: Optional[VideoPost]) -> Optional[Dict]:
         """
@@ -647,77 +769,89 @@ class YoutubeChannel:
             except Exception as e:
                 logger.error(f"Error fetching metadata for video {videoId}: {e}")
 
-    def is_hooked_video(self, videoId: Optional[str]):
-        """Keep track of the last few videos for which we have triggered a hook
-        command already, in a circular buffer to avoid growing infinitely and
-        triggering again for the same video."""
+    def is_hooked_video(self, videoId: Optional[str]) -> bool:
+        """Whether a hook command has been triggered for that video already,
+        in which case it should not be triggered again. Record that it has
+        otherwise."""
         if not videoId:
             # ignore if missing entry, avoid calling hook
             return True
-        if videoId in self._hooked_videos:
-            return True
-        self._hooked_videos.append(videoId)
-        # Limit the buffer conserve memory
-        if len(self._hooked_videos) >= 40:
-            self._hooked_videos.pop(0)
+        return not self.state.mark_hooked(videoId)
 
     def filter_videos(
         self,
-        filter_type: str = 'isLiveNow'
+        filter_type: str = 'isLiveNow',
+        on_found: Optional[Callable[[VideoPost], None]] = None
     ) -> List[VideoPost]:
         """
         Return a list of videos that are live, from all channel tabs combined.
         There may be more than one active broadcast.
+        Tabs are fetched concurrently, then processed in the order of
+        SCAN_TABS as soon as they arrive, so that on_found can be called with
+        a video found in the Home tab before slower tabs have been fetched.
+        Tabs not fetched within tab_timeout seconds are skipped, and their
+        request is awaited again by the next scan instead of being repeated.
+        The last tab processed is cached, like when fetched one by one.
+        If the RSS precheck is enabled and a full scan is not needed, the tabs
+        are not fetched at all and an empty list is returned.
         """
+        if not self.needs_full_scan():
+            self.log.debug("RSS feed unchanged, skipping the scan of the tabs.")
+            return []
+        self._last_full_scan = monotonic()
+
         # Only collect videos for which the field has a value
         filtered_videos = DedupedVideoList()
         missing_endpoints = []
-
-        # We should call this first since we probably have the Home tab in memory
-        # as the first cached json data
-        try:
-            for home_vid in self.get_home_videos():
-                if home_vid.get(filter_type):
-                    filtered_videos.append(home_vid)
-        except TabNotFound as e:
-            # Doubt this would ever happen
-            missing_endpoints.append("Home")
-
-        try:
-            for comm_vid in self.get_community_videos():
-                if comm_vid.get(filter_type):
-                    filtered_videos.append(comm_vid)
-        except TabNotFound:
-            # self.log.debug(f"No Community tab available for this channel: {e}")
-            missing_endpoints.append("Community")
-
-        try:
-            for memb_vid in self.get_membership_videos():
-                if memb_vid.get(filter_type):
-                    filtered_videos.append(memb_vid)
-        except TabNotFound:
-            # self.log.debug(f"No membership tab available for this channel: {e}")
-            # This tab might also be missing if logged in user is simply not a member
-            if self.session.was_logged_in:
+        getters = {
+            "Home": self.get_home_videos,
+            "Community": self.get_community_videos,
+            "Membership": self.get_membership_videos,
+            "Videos": self.get_public_videos,
+            "Live": self.get_public_streams,
+        }
+
+        # Load endpoints once, before threads need them
+        _ = self.endpoints
+        futures = self._fetch_tabs(SCAN_TABS)
+
+        last_tab: Optional[tuple[str, Dict]] = None
+        deadline = monotonic() + self.tab_timeout
+        for tab, future in futures.items():
+            try:
+                tab_json = future.result(timeout=max(0.0, deadline - monotonic()))
+                videos = getters[tab](tab_json)
+                last_tab = (tab, tab_json)
+            except TabNotFound:
+                if tab != "Membership":
+                    # Some channels do no have a Videos tab (only Live tab).
+                    missing_endpoints.append(tab)
+                elif self.session.was_logged_in:
+                    # This tab might also be missing if logged in user is
+                    # simply not a member
+                    self.log.warning(
+                        f"Missing expected Membership tab: We might be logged out!")
+                continue
+            except FutureTimeout:
                 self.log.warning(
-                    f"Missing expected Membership tab: We might be logged out!")
+                    f"Timed out after {self.tab_timeout} seconds while getting "
+                    f"the {tab} tab. Skipping it for this scan.")
+                continue
+            except Exception as e:
+                self.log.warning(f"Failed to get videos from the {tab} tab: {e}")
+                continue
 
-        # TODO this should be removed if filter is isLiveNow since Youtube does not
-        # list livestreams in the Videos tab anymore. Keep for now just in case.
-        public_videos = []
-        try:
-            public_videos = self.get_public_videos()
-        except TabNotFound as e:
-            # Some channels do no have a Videos tab (only Live tab).
-            # self.log.debug(f"No Videos tab available for this channel: {e}")
-            missing_endpoints.append("Videos")
+            for video in videos:
+                if not video.get(filter_type):
+                    continue
+                is_new = video.get("videoId") not in filtered_videos.seen_ids
+                filtered_videos.append(video)
+                if is_new and on_found is not None:
+                    on_found(video)
 
-        public_streams = []
-        try:
-            public_streams = self.get_public_streams()
-        except TabNotFound as e:
-            # self.log.debug(f"No Live tab available for this channel: {e}")
-            missing_endpoints.append("Live")
+        if last_tab is not None:
+            with self._cache_lock:
+                self._cached_json_tab, self._cached_json = last_tab
 
         if missing_endpoints:
             self.log.debug(
@@ -727,11 +861,136 @@ class YoutubeChannel:
 
         # No need to check for "upcoming_videos" because live videos should
         # appear in the public videos list.
-        for video in public_videos + public_streams:
-            if video.get(filter_type):
-                filtered_videos.append(video)
         return list(filtered_videos)
 
+    def _fetch_tabs(self, tabs: Iterable[str]) -> Dict[str, Future]:
+        """
+        Request each tab from the tab pool, unless its request from a
+        previous scan is still running, so that there is never more than one
+        request per tab, even when they keep timing out.
+        """
+        if self._tab_pool is None:
+            self._tab_pool = ThreadPoolExecutor(
+                max_workers=len(SCAN_TABS), thread_name_prefix="tab_fetch")
+        futures = {}
+        for tab in tabs:
+            future = self._tab_futures.get(tab)
+            if future is None or future.done():
+                future = self._tab_pool.submit(
+                    self.get_json_and_cache, tab, True, False)
+                self._tab_futures[tab] = future
+            futures[tab] = future
+        return futures
+
+    def close(self) -> None:
+        """Stop fetching tabs, without waiting for pending requests."""
+        if self._tab_pool is not None:
+            self._tab_pool.shutdown(wait=False, cancel_futures=True)
+            self._tab_pool = None
+        self._tab_futures.clear()
+
+    def needs_full_scan(self) -> bool:
+        """
+        Tell whether the tabs have to be scraped, or whether the RSS feed
+        shows that nothing changed since the last scan. Members-only videos
+        are missing from the feed, and a scheduled video going live may not
+        update it, hence a full scan every full_scan_delay minutes, and at
+        every scan while a known video is live or about to start.
+        """
+        if not self.rss_precheck:
+            return True
+        try:
+            if self.feed is None:
+                self.feed = ChannelFeed(rss_from_id(self.id), self.session)
+            changed = self.feed.changed_video_ids()
+        except Exception as e:
+            self.log.warning(f"Failed to check the RSS feed: {e}")
+            return True
+
+        if self._last_full_scan is None:
+            return True
+        if changed:
+            self.log.info(
+                f"New or updated videos in the RSS feed: {', '.join(changed)}")
+            return True
+        if monotonic() - self._last_full_scan >= self.full_scan_delay * 60:
+            return True
+        return self.has_imminent_videos()
+
+    def known_videos(self) -> Iterator[VideoPost]:
+        """Videos seen in the tabs during the last full scan."""
+        for videos in (
+            self._home_videos, self._community_videos,
+            self._membership_videos, self._public_videos,
+            self._public_streams
+        ):
+            yield from videos or ()
+
+    def has_imminent_videos(self) -> bool:
+        """
+        Whether a video seen in the last full scan is live now, or is
+        scheduled to start before the next full scan is due.
+        """
+        now = time()
+        horizon = now + self.full_scan_delay * 60
+        for vid in self.known_videos():
+            if vid.isLiveNow:
+                return True
+            if not vid.upcoming:
+                continue
+            try:
+                start = float(vid.startTime)
+            except (TypeError, ValueError):
+                # Unknown start time, better safe than sorry
+                return True
+            if now - STALE_UPCOMING <= start <= horizon:
+                return True
+        return False
+
+    def scheduled_videos(self) -> List[VideoPost]:
+        """
+        Upcoming videos seen in the last full scan with a known start time,
+        except those which should have started long ago.
+        """
+        scheduled = {}
+        oldest = time() - STALE_UPCOMING
+        for vid in self.known_videos():
+            if not vid.upcoming or vid.videoId in scheduled:
+                continue
+            try:
+                if float(vid.startTime) >= oldest:
+                    scheduled[vid.videoId] = vid
+            except (TypeError, ValueError):
+                continue
+        return list(scheduled.values())
+
+    def poll_live_status(self, vid: VideoPost) -> Optional[str]:
+        """
+        Fetch the status of a single video from the player API: "live",
+        "upcoming", or "gone" if it ended, was cancelled or removed. Return
+        None if it could not be fetched. The start time of upcoming videos is
+        updated in case they were rescheduled.
+        """
+        json_d = self.fetch_video_metadata(vid)
+        if not json_d:
+            return None
+        details = json_d.get("videoDetails", {})
+        playability = json_d.get("playabilityStatus", {})
+        if details.get("isLive"):
+            vid.isLiveNow = True
+            vid.upcoming = False
+            return "live"
+        if details.get("isUpcoming") \
+        or playability.get("status") == "LIVE_STREAM_OFFLINE":
+            if start := playability.get("liveStreamability", {})\
+                .get("liveStreamabilityRenderer", {})\
+                .get("offlineSlate", {})\
+                .get("liveStreamOfflineSlateRenderer", {})\
+                .get("scheduledStartTime"):
+                vid.startTime = start
+            return "upcoming"
+        return "gone"
+
     def get_tab_json_from_api(self, tab_name: str) -> Optional[Dict]:
         """
         Return the parsed JSON response (as dict) for a specific endpoint,
@@ -856,47 +1115,61 @@ def _get_content_from_any_renderer(
     tabtype: str,
     content: Any,
     channel: YoutubeChannel,
+    limit: Optional[int] = None,
+    pruned_keys: frozenset = PRUNED_KEYS,
 ) -> List[VideoPost]:
     """
-    Recursively collect video posts from a tab content tree.
+    Collect video posts from a tab content tree.
 
     YouTube has changed channel tab renderers multiple times over the years.
     Rather than hard-coding every renderer shape, we walk the tree and keep any
-    renderer that looks like a video post.
+    renderer that looks like a video post. The walk is iterative, in document
+    order, and does not descend into video posts nor into keys of pruned_keys.
+    It stops once limit video posts have been collected.
     """
     videos = DedupedVideoList()
+    channel_name: Optional[str] = None
+    stack = [content]
+    push = stack.append
 
-    def walk(node: Any) -> None:
+    while stack:
+        node = stack.pop()
         if isinstance(node, list):
-            for item in node:
-                walk(item)
-            return
+            for item in reversed(node):
+                if isinstance(item, (dict, list)):
+                    push(item)
+            continue
 
         if not isinstance(node, dict):
-            return
+            continue
 
         if lockup := node.get("lockupViewModel"):
+            if channel_name is None:
+                channel_name = channel.name
             vid_metadata = _video_post_from_lockup_view_model(
                 lockup,
-                channel.name
+                channel_name
             )
             if vid_metadata:
                 videos.append(vid_metadata)
-            return
-
-        if node.get("videoId") and node.get("navigationEndpoint") and node.get("title"):
+        elif node.get("videoId") and node.get("navigationEndpoint") \
+        and node.get("title"):
+            if channel_name is None:
+                channel_name = channel.name
             try:
-                vid_metadata = VideoPost.from_post(node, channel.name)
+                vid_metadata = VideoPost.from_post(node, channel_name)
             except Exception as e:
                 logger.debug(e)
             else:
                 videos.append(vid_metadata)
+        else:
+            for key, value in reversed(node.items()):
+                if isinstance(value, (dict, list)) and key not in pruned_keys:
+                    push(value)
+            continue
 
-        for value in node.values():
-            if isinstance(value, (dict, list)):
-                walk(value)
-
-    walk(content)
+        if limit is not None and len(videos) >= limit:
+            break
 
     if videos.duplicates:
         logger.debug(
@@ -1082,6 +1355,50 @@ def rss_from_name(channel_name):
     return 'https://www.youtube.com/feeds/videos.xml?user=' + channel_name
 
 
+def get_entries_from_feed(content: str) -> Dict[str, str]:
+    """
+    Map the video Ids listed in an RSS (Atom) feed to the time their entry was
+    last updated.
+    """
+    entries = {}
+    for entry in ElementTree.fromstring(content).iter(f"{ATOM_NS}entry"):
+        if videoId := entry.findtext(f"{YT_NS}videoId"):
+            entries[videoId] = entry.findtext(f"{ATOM_NS}updated", "")
+    return entries
+
+
+class ChannelFeed:
+    """
+    The RSS feed of a channel, fetched with conditional requests. This is far
+    cheaper than fetching all the tabs, both for us and for the server, which
+    answers with an empty 304 response if nothing changed.
+    """
+    def __init__(self, url: str, session: YoutubeUrllibSession) -> None:
+        self.url = url
+        self.session = session
+        self.etag: Optional[str] = None
+        self.last_modified: Optional[str] = None
+        self.entries: Optional[Dict[str, str]] = None
+
+    def changed_video_ids(self) -> List[str]:
+        """
+        Return the Ids of videos which were added to the feed, or updated,
+        since the last time it was fetched. All of them on the first fetch.
+        """
+        content, self.etag, self.last_modified = \
+            self.session.make_conditional_request(
+                self.url, self.etag, self.last_modified)
+        if content is None:
+            return []
+        entries = get_entries_from_feed(content)
+        previous = self.entries or {}
+        self.entries = entries
+        return [
+            videoId for videoId, updated in entries.items()
+            if previous.get(videoId) != updated
+        ]
+
+
 def format_list_output(vid_list: List[VideoPost]) -> str:
     return "\n".join(
         (
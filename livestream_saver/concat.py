@@ -0,0 +1,171 @@
+import os
+import errno
+import logging
+import struct
+import threading
+from sys import platform
+from pathlib import Path
+from shutil import COPY_BUFSIZE
+from typing import Optional, Dict, List, Iterable, Callable, Tuple, Set, BinaryIO
+
+logger = logging.getLogger(__name__)
+
+# From linux/fs.h: _IOW(0x94, 13, struct file_clone_range)
+FICLONERANGE = 0x4020940d
+
+# Errors meaning that a primitive is not supported between two files, as
+# opposed to actual I/O errors.
+UNSUPPORTED_ERRNOS = {
+    errno.EXDEV,
+    errno.EINVAL,
+    errno.ENOSYS,
+    errno.EOPNOTSUPP,
+    errno.ENOTTY,
+}
+
+# Primitives that failed, keyed by (source device, destination device)
+_unsupported: Dict[Tuple[int, int], Set[str]] = {}
+_lock = threading.Lock()
+
+
+class UnsupportedBackend(Exception):
+    pass
+
+
+def _reflink(src: BinaryIO, dst: BinaryIO) -> None:
+    """
+    Share the extents of src with dst instead of copying data (btrfs, XFS).
+    The destination offset has to be aligned to the filesystem block size,
+    so this only works until a segment of unaligned size has been appended.
+    """
+    import fcntl
+    offset = dst.tell()
+    if offset % os.fstat(dst.fileno()).st_blksize:
+        raise UnsupportedBackend("destination offset is not block aligned")
+    size = os.fstat(src.fileno()).st_size
+    # struct file_clone_range: src_fd, src_offset, src_length, dest_offset
+    # A length of 0 means up to the end of the source file.
+    fcntl.ioctl(
+        dst.fileno(), FICLONERANGE, struct.pack("qQQQ", src.fileno(), 0, 0, offset))
+    dst.seek(offset + size)
+
+
+def _copy_file_range(src: BinaryIO, dst: BinaryIO) -> None:
+    """Copy in kernel space, which also reflinks on some filesystems."""
+    size = os.fstat(src.fileno()).st_size
+    copied = 0
+    while copied < size:
+        sent = os.copy_file_range(src.fileno(), dst.fileno(), size - copied)
+        if sent == 0:
+            # Retried with another backend, rather than leaving a short copy
+            raise UnsupportedBackend(
+                f"copied only {copied} of {size} bytes")
+        copied += sent
+
+
+def _sendfile(src: BinaryIO, dst: BinaryIO) -> None:
+    """Copy in kernel space, file to file is supported since Linux 2.6.33."""
+    size = os.fstat(src.fileno()).st_size
+    copied = 0
+    while copied < size:
+        sent = os.sendfile(dst.fileno(), src.fileno(), copied, size - copied)
+        if sent == 0:
+            # Retried with another backend, rather than leaving a short copy
+            raise UnsupportedBackend(
+                f"copied only {copied} of {size} bytes")
+        copied += sent
+
+
+def _copy(src: BinaryIO, dst: BinaryIO) -> None:
+    """Copy through user space, like shutil.copyfileobj."""
+    while chunk := src.read(COPY_BUFSIZE):
+        # Unbuffered writes may be partial
+        view = memoryview(chunk)
+        while view:
+            view = view[dst.write(view):]
+
+
+# From cheapest to most expensive. The plain copy always works.
+BACKENDS: Dict[str, Callable[[BinaryIO, BinaryIO], None]] = {
+    "reflink": _reflink,
+    "copy_file_range": _copy_file_range,
+    "sendfile": _sendfile,
+    "copy": _copy,
+}
+
+
+def available_backends() -> List[str]:
+    """Backends the current platform provides, regardless of filesystems."""
+    available = []
+    for name in BACKENDS:
+        if name == "reflink" and not platform.startswith("linux"):
+            continue
+        if name == "copy_file_range" and not hasattr(os, "copy_file_range"):
+            continue
+        if name == "sendfile" and (
+            not hasattr(os, "sendfile") or
+            not platform.startswith("linux")
+        ):
+            continue
+        available.append(name)
+    return available
+
+
+def _append(src: BinaryIO, dst: BinaryIO, candidates: List[str]) -> str:
+    """Append src to dst with the first backend that works between them."""
+    devices = (os.fstat(src.fileno()).st_dev, os.fstat(dst.fileno()).st_dev)
+    start = dst.tell()
+    for name in candidates:
+        with _lock:
+            if name in _unsupported.get(devices, ()):
+                continue
+        try:
+            BACKENDS[name](src, dst)
+            return name
+        except UnsupportedBackend:
+            # Only unsupported for this particular segment
+            pass
+        except OSError as e:
+            if e.errno not in UNSUPPORTED_ERRNOS:
+                raise
+            logger.debug(
+                f"Concat backend {name} not supported from device {devices[0]}"
+                f" to device {devices[1]}: {e}")
+            with _lock:
+                _unsupported.setdefault(devices, set()).add(name)
+        # Start over from a clean state for the next backend
+        src.seek(0)
+        dst.seek(start)
+        dst.truncate()
+    raise Exception("No concat backend could be used!")
+
+
+def concat_files(
+    sources: Iterable[Path],
+    dest: Path,
+    backend: Optional[str] = None
+) -> Dict[str, int]:
+    """
+    Write the content of each source file back to back into dest, using the
+    cheapest available primitive. If backend is specified, only fall back to
+    a plain copy if it cannot be used.
+    Return how many files were appended by each backend.
+    """
+    if backend is None:
+        candidates = available_backends()
+    else:
+        if backend not in BACKENDS:
+            raise ValueError(
+                f"Unknown concat backend \"{backend}\". "
+                f"Valid values are: {', '.join(BACKENDS)}.")
+        candidates = [backend] if backend == "copy" else [backend, "copy"]
+
+    used: Dict[str, int] = {}
+    # Unbuffered, so that writes through the file object and through its
+    # file descriptor all happen at the same offset.
+    with open(dest, "wb", buffering=0) as dst:
+        for source in sources:
+            with open(source, "rb", buffering=0) as src:
+                name = _append(src, dst, candidates)  # type: ignore
+            used[name] = used.get(name, 0) + 1
+    return used
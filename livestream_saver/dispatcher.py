@@ -0,0 +1,135 @@
+"""
+Hand live videos over to download threads as soon as they are found, at most
+once per video, instead of going through a queue polled every few seconds.
+"""
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from time import monotonic
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class DownloadDispatcher:
+    """
+    Run task(*args) on up to max_workers threads for each video submitted.
+    A video is claimed by key from submission until its task returns, so
+    that scans finding it again in the meantime do not submit it twice.
+    Keys for which is_known(key) is true, such as videos already downloaded,
+    are not submitted either. Videos submitted while every worker is busy
+    wait for one in submission order; how many, and for how long, is
+    reported by stats().
+    """
+
+    def __init__(
+        self,
+        max_workers: int,
+        is_known: Optional[Callable[[str], bool]] = None,
+        clock: Callable[[], float] = monotonic
+    ) -> None:
+        self.max_workers = max_workers
+        self.is_known = is_known
+        self.clock = clock
+        # Key -> future of the task of each video claimed
+        self._claims: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._closed = False
+        self._running = 0
+        self._submitted = 0
+        self._duplicates = 0
+        self._finished = 0
+        self._failed = 0
+        self._cancelled = 0
+        self._max_waiting = 0
+        self._max_wait = 0.0
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="download")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._claims)
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return key in self._claims
+
+    def submit(self, key: str, task: Callable[..., Any], *args: Any) -> bool:
+        """
+        Claim key and run task(*args) as soon as a worker is free.
+        Return False if key is claimed or known already, or after shutdown().
+        """
+        with self._lock:
+            if self._closed:
+                return False
+            if key in self._claims \
+            or (self.is_known is not None and self.is_known(key)):
+                self._duplicates += 1
+                return False
+            self._submitted += 1
+            waiting = len(self._claims) - self._running + 1
+            if self._running >= self.max_workers:
+                self._max_waiting = max(self._max_waiting, waiting)
+                logger.warning(
+                    f"All {self.max_workers} download slots are busy, "
+                    f"{waiting} videos waiting for one.")
+            future = self._executor.submit(
+                self._run, key, self.clock(), task, *args)
+            self._claims[key] = future
+        future.add_done_callback(lambda f, key=key: self._release(key, f))
+        return True
+
+    def _run(
+        self, key: str, submitted: float, task: Callable[..., Any], *args: Any
+    ) -> Any:
+        with self._lock:
+            self._running += 1
+            self._max_wait = max(self._max_wait, self.clock() - submitted)
+        logger.debug(f"Dispatching {key}: {self.stats()}")
+        try:
+            return task(*args)
+        except Exception as e:
+            logger.exception(f"Error in download task of {key}: {e}")
+            raise
+        finally:
+            with self._lock:
+                self._running -= 1
+
+    def _release(self, key: str, future: Future) -> None:
+        with self._lock:
+            if self._claims.get(key) is future:
+                del self._claims[key]
+            if future.cancelled():
+                self._cancelled += 1
+            elif future.exception() is not None:
+                self._failed += 1
+            else:
+                self._finished += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters of videos dispatched since start."""
+        with self._lock:
+            return {
+                "running": self._running,
+                "waiting": len(self._claims) - self._running,
+                "submitted": self._submitted,
+                "duplicates": self._duplicates,
+                "finished": self._finished,
+                "failed": self._failed,
+                "cancelled": self._cancelled,
+                "max_waiting": self._max_waiting,
+                "max_wait_seconds": round(self._max_wait, 3),
+            }
+
+    def shutdown(self, wait: bool = True, cancel_waiting: bool = True) -> None:
+        """
+        Stop accepting videos, drop those still waiting for a worker unless
+        cancel_waiting is False, and wait for running tasks if wait is True.
+        """
+        with self._lock:
+            self._closed = True
+            running = self._running
+        if wait and running:
+            logger.info(f"Waiting for {running} downloads to finish...")
+        self._executor.shutdown(wait=wait, cancel_futures=cancel_waiting)
+        logger.info(f"Download dispatcher stopped: {self.stats()}")
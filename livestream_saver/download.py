@@ -7,7 +7,7 @@ from platform import system
 import logging
 from datetime import date, datetime, timezone
 from time import time, sleep
-from json import dumps, dump, loads
+from json import dumps, dump
 from contextlib import closing
 from enum import Flag, auto
 from pathlib import Path
@@ -27,8 +27,13 @@ from copy import deepcopy
 from livestream_saver.notifier import NotificationDispatcher
 from livestream_saver.request import YoutubeUrllibSession
 from livestream_saver.channel import VideoPost
-from livestream_saver.util import wait_block, create_output_dir, none_filtered_out
+from livestream_saver.util import (
+    wait_block, create_output_dir, none_filtered_out, json_loads
+)
 from livestream_saver.extract import publish_date
+from livestream_saver.merge import RollingMerger
+from livestream_saver.sidecar import SidecarWriter, SegmentRecord, SIDECAR_NAME
+from livestream_saver.live_playlist import LivePlaylist
 from livestream_saver.exceptions import (
     WaitingException,
     OfflineException,
@@ -252,7 +257,10 @@ class YoutubeLiveStream:
         log_level = logging.INFO,
         initial_metadata: Optional[VideoPost] = None,
         use_ytdl = False,
-        ytdl_opts: Optional[Dict] = None
+        ytdl_opts: Optional[Dict] = None,
+        rolling_merge_interval: float = 0.0,
+        delete_source: bool = False,
+        live_playlist: bool = False
     ) -> None:
         self.session = session
         self.video_id = video_id
@@ -313,6 +321,14 @@ class YoutubeLiveStream:
         self.use_ytdl = use_ytdl
         self.ytdl_opts = ytdl_opts
 
+        # Minutes between two rolling merges of the downloaded segments
+        self.rolling_merge_interval = rolling_merge_interval
+        self.delete_source = delete_source
+        self._rolling_merger: Optional[RollingMerger] = None
+        # Write HLS playlists over the segments as they are downloaded
+        self.live_playlist = live_playlist
+        self._live_playlist: Optional[LivePlaylist] = None
+
         if use_ytdl and output_dir is not None:
             if not output_dir.exists():
                 self.output_dir = create_output_dir(
@@ -336,6 +352,10 @@ class YoutubeLiveStream:
         self.output_dir = output_dir
         self.video_outpath = self.output_dir / 'vid'
         self.audio_outpath = self.output_dir / 'aud'
+        # Facts about each segment written, to speed up merging later
+        self.sidecar = SidecarWriter(self.output_dir / SIDECAR_NAME)
+        # EXTINF durations from the HLS playlist, by segment number
+        self._hls_durations: Dict[int, float] = {}
 
         self.allow_regex: Optional[re.Pattern] = filters.get("allow_regex")
         self.block_regex: Optional[re.Pattern] = filters.get("block_regex")
@@ -834,7 +854,7 @@ class YoutubeLiveStream:
             return self._player_response
 
         if isinstance(self.player_config_args["player_response"], str):
-            self._player_response = loads(
+            self._player_response = json_loads(
                 self.player_config_args["player_response"]
             )
         else:
@@ -1254,7 +1274,13 @@ class YoutubeLiveStream:
                 self.done = True
                 return
 
-            self.do_download_hls(wait_delay=wait_delay)
+            self.start_rolling_merge()
+            self.start_live_playlist()
+            try:
+                self.do_download_hls(wait_delay=wait_delay)
+            finally:
+                self.stop_rolling_merge()
+                self.stop_live_playlist()
             if self.done:
                 self.log.info(f"Finished downloading {self.video_id}.")
                 self.trigger_hooks("on_download_ended")
@@ -1330,6 +1356,8 @@ class YoutubeLiveStream:
                 sleep(wait_delay * 60)
                 continue
 
+            self.start_rolling_merge()
+            self.start_live_playlist(hls=False)
             while True:
                 try:
                     self.do_download()
@@ -1378,12 +1406,75 @@ class YoutubeLiveStream:
                     self.log.exception(f"Unhandled exception. Aborting.")
                     self.error = f"{e}"
                     break
+            self.stop_rolling_merge()
+            self.stop_live_playlist()
         if self.done:
             self.log.info(f"Finished downloading {self.video_id}.")
             self.trigger_hooks("on_download_ended")
         if self.error:
             self.log.critical(f"Some kind of error occured during download? {self.error}")
 
+    def start_rolling_merge(self) -> None:
+        """Periodically remux downloaded segments into chunks, if enabled."""
+        if self.rolling_merge_interval <= 0 or self._rolling_merger is not None:
+            return
+        self._rolling_merger = RollingMerger(
+            self.output_dir,
+            self.video_id,
+            interval=self.rolling_merge_interval,
+            delete_source=self.delete_source,
+            log=self.log
+        )
+        # Source segments might have been deleted after a previous rolling
+        # merge, so the resume point can't be deduced from the files alone.
+        self.seg = max(self.seg, self._rolling_merger.next_seq)
+        self._rolling_merger.committed = self.seg
+        self._rolling_merger.start()
+        self.log.info(
+            "Rolling merge enabled every %s minutes.",
+            self.rolling_merge_interval)
+
+    def stop_rolling_merge(self) -> None:
+        if self._rolling_merger is None:
+            return
+        self._rolling_merger.stop()
+        self._rolling_merger = None
+
+    def start_live_playlist(self, hls: bool = True) -> None:
+        """Keep HLS playlists of the downloaded segments up to date, if enabled."""
+        if not self.live_playlist or self._live_playlist is not None:
+            return
+        if not hls:
+            # DASH segments are fragmented MP4, which HLS players can only
+            # play with their initialization segment.
+            self.log.warning(
+                "Not writing live playlists: they are only supported for "
+                "HLS formats, whose segments are MPEG-TS.")
+            return
+        if self._rolling_merger is not None and self.delete_source:
+            self.log.warning(
+                "Not writing live playlists: the rolling merge deletes "
+                "segments they would refer to.")
+            return
+        self._live_playlist = LivePlaylist(
+            self.output_dir, muxed=self.is_muxed_hls)
+        self.log.info(
+            "Writing live playlist to %s.", self._live_playlist.path)
+
+    def stop_live_playlist(self) -> None:
+        if self._live_playlist is None:
+            return
+        if self.done:
+            self._live_playlist.finish()
+        self._live_playlist = None
+
+    def _commit_segment(self, seg: int) -> None:
+        """Mark segments up to seg as fully written to disk."""
+        if self._rolling_merger is not None:
+            self._rolling_merger.committed = seg + 1
+        if self._live_playlist is not None:
+            self._live_playlist.commit(seg)
+
     def prepare_hls_download(self, info: Optional[Dict[str, Any]]) -> bool:
         if not info:
             return False
@@ -1512,6 +1603,15 @@ class YoutubeLiveStream:
             if line == "#EXT-X-ENDLIST":
                 end_list = True
                 continue
+            if line.startswith("#EXTINF:"):
+                if seg_num is None:
+                    seg_num = media_sequence
+                try:
+                    self._hls_durations[seg_num] = float(
+                        line[len("#EXTINF:"):].split(",", 1)[0])
+                except ValueError:
+                    pass
+                continue
             if line.startswith("#"):
                 continue
 
@@ -1520,6 +1620,9 @@ class YoutubeLiveStream:
             segments.append((seg_num, urljoin(playlist_url, line)))
             seg_num += 1
 
+        # Forget durations of segments that went out of the playlist window
+        for old_seg in [k for k in self._hls_durations if k < media_sequence]:
+            del self._hls_durations[old_seg]
         return segments, end_list
 
     def download_hls_segment(
@@ -1540,11 +1643,14 @@ class YoutubeLiveStream:
                 self.log.debug(f"Seg status: {status}")
                 self.log.debug(f"Seg headers:\n{headers}")
 
-            if not self.write_to_file(in_stream, segment_filename):
+            if not (size := self.write_to_file(in_stream, segment_filename)):
                 if status == 204 and headers.get('X-Segment-Lmt', "0") == "0":
                     raise EmptySegmentException(
                         f"Segment {seg_num} ({stream_type}) is empty, stream might have ended...")
                 return False
+        self.record_segment(
+            seg_num, stream_type, size, status, headers,
+            duration=self._hls_durations.pop(seg_num, 0.0))
         return True
 
     @staticmethod
@@ -1641,6 +1747,7 @@ class YoutubeLiveStream:
                             self.seg = first_available_seq
                             break
                         raise
+                    self._commit_segment(seg_num)
                     self.seg = seg_num + 1
 
                 if end_list and self.seg > next_segments[-1][0]:
@@ -1687,13 +1794,44 @@ class YoutubeLiveStream:
                 self.log.debug(f"Seg status: {status}")
                 self.log.debug(f"Seg headers:\n{headers}")
 
-            if not self.write_to_file(in_stream, segment_filename):
+            if not (size := self.write_to_file(in_stream, segment_filename)):
                 if status == 204 and headers.get('X-Segment-Lmt', "0") == "0":
                     raise EmptySegmentException(\
                         f"Segment {self.seg} (video) is empty, stream might have ended...")
                 return False
+        self.record_segment(self.seg, type, size, status, headers)
         return True
 
+    def record_segment(
+        self,
+        seg: int,
+        track: str,
+        size: int,
+        status: int,
+        headers,
+        duration: float = 0.0
+    ) -> None:
+        """Append what we know about a segment just written to the sidecar."""
+        def int_header(name: str) -> int:
+            try:
+                return int(headers.get(name, 0))
+            except (TypeError, ValueError):
+                return 0
+        try:
+            self.sidecar.append(SegmentRecord(
+                seq=seg,
+                track=track,
+                status=status,
+                size=size,
+                duration=duration,
+                lmt=int_header('X-Segment-Lmt'),
+                walltime_ms=int_header('X-Walltime-Ms'),
+                written_at=time()
+            ))
+        except Exception as e:
+            # Merging can do without it
+            self.log.warning(f"Failed to record segment {seg} in sidecar: {e}")
+
     def do_download(self):
         if not self.video_base_url:
             raise Exception("Missing video url!")
@@ -1730,6 +1868,7 @@ class YoutubeLiveStream:
                 # Resetting error counter and moving on to next segment
                 attempts_left = max_attempts
                 self.seg_attempt = 0
+                self._commit_segment(self.seg)
                 self.seg += 1
 
             except urllib.error.URLError as e:
@@ -1933,10 +2072,10 @@ class YoutubeLiveStream:
         return (video_stream, audio_stream)
 
 
-    def write_to_file(self, fsrc, fdst, length=0):
+    def write_to_file(self, fsrc, fdst, length=0) -> int:
         """Copy data from file-like object fsrc to file-like object fdst.
-        If no bytes are read from fsrc, do not create fdst and return False.
-        Return True when file has been created and data has been written."""
+        If no bytes are read from fsrc, do not create fdst and return 0.
+        Return the number of bytes written otherwise."""
         # Localize variable access to minimize overhead.
         if not length:
             length = COPY_BUFSIZE
@@ -1952,13 +2091,14 @@ class YoutubeLiveStream:
             buf = None
 
         if not buf:
-            return False
+            return 0
+        written = 0
         with open(fdst, 'wb') as out_file:
             fdst_write = out_file.write
             while buf:
-                fdst_write(buf)
+                written += fdst_write(buf)
                 buf = fsrc_read(length)
-        return True
+        return written
 
     def get_metadata_dict(self) -> Dict[str, Any]:
         """
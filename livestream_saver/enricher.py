@@ -0,0 +1,133 @@
+"""
+Fetch the metadata of many videos at once, for instance when a channel has
+published several videos since the last scan, instead of one after the other.
+"""
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic, sleep
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Requests made at the same time
+MAX_WORKERS = 4
+# Requests started per second at most
+RATE = 2.0
+# Seconds during which fetched metadata is reused
+TTL = 900.0
+# Number of videos whose metadata is kept in memory
+MAX_ENTRIES = 256
+
+
+class RateLimiter:
+    """
+    Block in wait() so that calls to it return no more than rate times per
+    second, across all threads.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        clock: Callable[[], float] = monotonic,
+        sleep: Callable[[float], Any] = sleep
+    ) -> None:
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.clock = clock
+        self.sleep = sleep
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        with self._lock:
+            now = self.clock()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            self.sleep(slot - now)
+
+
+class MetadataEnricher:
+    """
+    Fetch the metadata of videos with fetch(video), which returns a dict, or
+    None on failure. Videos are deduplicated by video Id, metadata fetched
+    less than ttl seconds ago is reused, and the rest is fetched on up to
+    max_workers threads, starting no more than rate requests per second.
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[Any], Optional[Dict]],
+        max_workers: int = MAX_WORKERS,
+        rate: float = RATE,
+        ttl: float = TTL,
+        max_entries: int = MAX_ENTRIES,
+        clock: Callable[[], float] = monotonic
+    ) -> None:
+        self.fetch = fetch
+        self.max_workers = max_workers
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self.limiter = RateLimiter(rate, clock=clock)
+        # video Id -> (time fetched, metadata), least recently used first
+        self._cache: OrderedDict[str, Tuple[float, Dict]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, video: Any) -> Optional[Dict]:
+        return self.get_many((video,)).get(video.get("videoId"))
+
+    def get_many(self, videos: Iterable[Any]) -> Dict[str, Optional[Dict]]:
+        """
+        Return the metadata of each video by video Id, None for those which
+        could not be fetched. Failures are not cached.
+        """
+        results: Dict[str, Optional[Dict]] = {}
+        pending: Dict[str, Any] = {}
+        now = self.clock()
+        with self._lock:
+            for video in videos:
+                videoId = video.get("videoId")
+                if not videoId or videoId in results or videoId in pending:
+                    continue
+                cached = self._cache.get(videoId)
+                if cached is not None and now - cached[0] < self.ttl:
+                    self._cache.move_to_end(videoId)
+                    results[videoId] = cached[1]
+                else:
+                    pending[videoId] = video
+
+        if len(pending) == 1:
+            videoId, video = pending.popitem()
+            results[videoId] = self._fetch(video)
+        elif pending:
+            logger.debug(f"Fetching metadata of {len(pending)} videos.")
+            with ThreadPoolExecutor(
+                max_workers=min(self.max_workers, len(pending)),
+                thread_name_prefix="metadata"
+            ) as executor:
+                futures = {
+                    videoId: executor.submit(self._fetch, video)
+                    for videoId, video in pending.items()
+                }
+            for videoId, future in futures.items():
+                results[videoId] = future.result()
+        return results
+
+    def _fetch(self, video: Any) -> Optional[Dict]:
+        self.limiter.wait()
+        try:
+            metadata = self.fetch(video)
+        except Exception as e:
+            logger.warning(
+                f"Error fetching metadata for {video.get('videoId')}: {e}")
+            return None
+        if metadata is None:
+            return None
+        with self._lock:
+            self._cache[video.get("videoId")] = (self.clock(), metadata)
+            self._cache.move_to_end(video.get("videoId"))
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return metadata
@@ -1,8 +1,8 @@
 import logging
 import re
 from datetime import datetime
-from typing import Dict, Optional
-from livestream_saver.util import str_as_json
+from json import JSONDecoder
+from typing import Dict, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -67,26 +67,72 @@ def get_video_id_re(url_pattern: str) -> str:
     return results.group(1)
 
 
-def initial_player_response(html: Optional[str] = None) -> str:
+# Variables holding the JSON objects embedded in watch and channel pages
+EMBEDDED_JSON_VARS = ("ytInitialPlayerResponse", "ytInitialData")
+EMBEDDED_JSON_RE = re.compile(
+    r"(ytInitialPlayerResponse|ytInitialData)[\"']?\]?\s*=\s*(?=\{)")
+# Common prefix of the variable names, found faster with str.find() than by
+# searching the page with the regex above
+EMBEDDED_JSON_PREFIX = "ytInitial"
+_decoder = JSONDecoder()
+
+
+def extract_embedded_json(
+    html: str, names: Tuple[str, ...] = EMBEDDED_JSON_VARS
+) -> Dict[str, Dict]:
+    """
+    Return the JSON objects assigned to the variables named in names, found
+    in html in a single pass. Each object is decoded right from its offset in
+    the page with raw_decode(), which stops at the end of the object, so that
+    the page is never copied and any trailing script is ignored.
+    """
+    found: Dict[str, Dict] = {}
+    pos = 0
+    while (pos := html.find(EMBEDDED_JSON_PREFIX, pos)) != -1:
+        if not (match := EMBEDDED_JSON_RE.match(html, pos)):
+            pos += len(EMBEDDED_JSON_PREFIX)
+            continue
+        # Resume after the decoded object, not within it
+        pos = match.end()
+        name = match.group(1)
+        if name not in names or name in found:
+            continue
+        try:
+            found[name], pos = _decoder.raw_decode(html, match.end())
+        except ValueError as e:
+            logger.debug(f"Failed to decode {name} at offset {match.end()}: {e}")
+            continue
+        if len(found) == len(names):
+            break
+    return found
+
+
+def initial_data(html: Optional[str] = None) -> Dict:
+    """The ytInitialData object of a channel page."""
     if not html:
         raise ValueError(f"Invalid html: {html}")
+    if data := extract_embedded_json(html, ("ytInitialData",)):
+        return data["ytInitialData"]
+    raise Exception("Could not find ytInitialData in HTML.")
 
-    # logger.debug(f"Raw response:\n{content_page}")
-    if "ytInitialPlayerResponse =" in html:
-        _json = html.split("ytInitialPlayerResponse = ")[1]\
-                            .split(";var meta = document.createElement('meta');")[0]
-    # HACK This a bit wonky, as this has to be tested _after_ the
-    # ytInitialPlayerResponse, as in some pages both are present.
-    # Might need some refactoring.
-    elif "var ytInitialData =" in html:
-        _json = html.split("var ytInitialData = ")[1]\
-                            .split(';</script><script nonce="')[0]
-    else:
-        logger.critical(f"Failed to extract JSON. HTML content:\n{_json}")
-        raise Exception(
-            "Could not find ytInitialData nor ytInitialPlayerResponse in HTML."
-        )
-    return str_as_json(_json)
+
+def initial_player_response(html: Optional[str] = None) -> Dict:
+    """
+    The ytInitialPlayerResponse object of a watch page, or its ytInitialData
+    object if it does not have one.
+    """
+    if not html:
+        raise ValueError(f"Invalid html: {html}")
+
+    found = extract_embedded_json(html)
+    for name in EMBEDDED_JSON_VARS:
+        if name in found:
+            return found[name]
+    logger.critical("Failed to extract JSON from HTML.")
+    logger.debug(f"HTML content:\n{html}")
+    raise Exception(
+        "Could not find ytInitialData nor ytInitialPlayerResponse in HTML."
+    )
 
 
 # from pytube.extract, with some modifications
@@ -0,0 +1,179 @@
+"""
+Run ffmpeg while reading its stderr line by line, so that long remuxes do not
+keep their whole output in memory, and report their progress as they go.
+"""
+import logging
+import subprocess
+from collections import deque
+from dataclasses import dataclass, field
+from time import monotonic
+from typing import Optional, Dict, List, Iterable, Callable
+
+# How many lines of regular stderr output to keep for error reporting
+TAIL_LINES = 200
+# Write progress reports as key=value lines to stderr, instead of the
+# carriage-return separated stats line.
+PROGRESS_ARGS = ["-progress", "pipe:2", "-nostats"]
+PROGRESS_KEYS = {
+    "frame", "fps", "bitrate", "total_size", "out_time_us", "out_time_ms",
+    "out_time", "dup_frames", "drop_frames", "speed", "progress",
+}
+
+
+@dataclass(slots=True)
+class Progress:
+    """Latest progress report of an ffmpeg process."""
+    frame: int = 0
+    fps: float = 0.0
+    total_size: int = 0
+    # Position in the output, in seconds
+    out_time: float = 0.0
+    speed: float = 0.0
+    # Expected duration of the output, if known, to compute a percentage
+    expected: Optional[float] = None
+    done: bool = False
+
+    @property
+    def percent(self) -> Optional[float]:
+        if not self.expected:
+            return None
+        return min(100.0, self.out_time * 100 / self.expected)
+
+
+@dataclass(slots=True)
+class RunResult:
+    args: List[str]
+    returncode: int
+    # Last lines of stderr output, progress reports excluded
+    tail: List[str]
+    # How many lines contained each pattern that was looked for
+    matches: Dict[str, int]
+    progress: Progress = field(default_factory=Progress)
+    elapsed: float = 0.0
+    lines: int = 0
+
+    @property
+    def stderr(self) -> str:
+        return "\n".join(self.tail)
+
+
+def _to_float(value: str) -> float:
+    try:
+        return float(value.rstrip("x"))
+    except ValueError:
+        # "N/A" until the first packet is written
+        return 0.0
+
+
+def parse_progress_line(line: str, progress: Progress) -> Optional[str]:
+    """
+    Update progress from a key=value line written by -progress. Return the
+    key, or None if the line is regular output.
+    """
+    key, sep, value = line.partition("=")
+    if not sep or (key not in PROGRESS_KEYS and not key.startswith("stream_")):
+        return None
+    value = value.strip()
+    if key == "frame":
+        progress.frame = int(_to_float(value))
+    elif key == "fps":
+        progress.fps = _to_float(value)
+    elif key == "total_size":
+        progress.total_size = int(_to_float(value))
+    elif key == "out_time_us":
+        # out_time_ms is also in microseconds, despite its name
+        progress.out_time = _to_float(value) / 1_000_000
+    elif key == "speed":
+        progress.speed = _to_float(value)
+    elif key == "progress":
+        progress.done = value == "end"
+    return key
+
+
+def with_progress(cmd: List[str]) -> List[str]:
+    """Add the progress options, which are global, right after the program."""
+    if "-progress" in cmd:
+        return list(cmd)
+    return [cmd[0], *PROGRESS_ARGS, *cmd[1:]]
+
+
+def run(
+    cmd: List[str],
+    patterns: Iterable[str] = (),
+    on_progress: Optional[Callable[[Progress], None]] = None,
+    expected_duration: Optional[float] = None,
+    tail_lines: int = TAIL_LINES,
+    check: bool = True
+) -> RunResult:
+    """
+    Run an ffmpeg command, counting the lines of output containing each of
+    patterns as they are read, and calling on_progress after each progress
+    report. Only the last tail_lines lines of output are kept.
+    Raise subprocess.CalledProcessError with that tail as stderr if check
+    and ffmpeg failed.
+    """
+    patterns = list(patterns)
+    args = with_progress(cmd)
+    tail: deque = deque(maxlen=tail_lines)
+    matches: Dict[str, int] = {}
+    progress = Progress(expected=expected_duration)
+    line_count = 0
+    start = monotonic()
+    with subprocess.Popen(
+        args,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+        encoding="utf-8",
+        errors="replace"
+    ) as proc:
+        assert proc.stderr is not None
+        for line in proc.stderr:
+            line = line.rstrip("\r\n")
+            line_count += 1
+            if (key := parse_progress_line(line, progress)) is not None:
+                if key == "progress" and on_progress is not None:
+                    on_progress(progress)
+                continue
+            tail.append(line)
+            for pattern in patterns:
+                if pattern in line:
+                    matches[pattern] = matches.get(pattern, 0) + 1
+    result = RunResult(
+        args=args,
+        returncode=proc.returncode,
+        tail=list(tail),
+        matches=matches,
+        progress=progress,
+        elapsed=monotonic() - start,
+        lines=line_count
+    )
+    if check and result.returncode:
+        raise subprocess.CalledProcessError(
+            result.returncode, args, stderr=result.stderr)
+    return result
+
+
+class ProgressLogger:
+    """Log progress reports of a process at most every interval seconds."""
+
+    def __init__(
+        self, log: logging.Logger, label: str, interval: float = 30.0
+    ) -> None:
+        self.log = log
+        self.label = label
+        self.interval = interval
+        self._last = monotonic()
+
+    def __call__(self, progress: Progress) -> None:
+        now = monotonic()
+        if progress.done or now - self._last < self.interval:
+            return
+        self._last = now
+        position = f"{progress.out_time:.0f}s"
+        if (percent := progress.percent) is not None:
+            position += f" of {progress.expected:.0f}s ({percent:.0f}%)"
+        self.log.info(
+            "%s: %s written, %.1f MiB at %.1fx speed.",
+            self.label, position, progress.total_size / 1048576, progress.speed)
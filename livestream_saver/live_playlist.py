@@ -0,0 +1,186 @@
+"""
+HLS playlists over the segments of a download in progress, so that the
+recording can be watched, or served by any HTTP server, before it is merged.
+
+Segments are referenced where they are written, nothing is remuxed: each
+track gets an append-only EVENT media playlist in its own directory, and a
+master playlist in the data directory ties the video and audio tracks
+together. Only MPEG-TS segments, as downloaded from HLS formats, are
+supported; fragmented MP4 segments from DASH formats would need an init
+segment for players to make sense of them.
+"""
+import logging
+import math
+from pathlib import Path
+from typing import Optional, List, Tuple
+
+from livestream_saver.mpegts import read_timestamps, is_mpegts, TS_PACKET_SIZE
+
+logger = logging.getLogger(__name__)
+
+LIVE_PLAYLIST = "live.m3u8"
+MEDIA_PLAYLIST = "index.m3u8"
+# Used for segments whose timestamps could not be read
+DEFAULT_DURATION = 5.0
+
+
+class MediaPlaylist:
+    """
+    Playlist of the segments of one track. Entries are appended to the file
+    as segments are committed; the file is only rewritten when a segment
+    turns out longer than the target duration declared in its header.
+    """
+
+    def __init__(self, directory: Path, suffix: str) -> None:
+        self.directory = directory
+        self.path = directory / MEDIA_PLAYLIST
+        # "_video" or "_audio"
+        self.suffix = suffix
+        self.target_duration = 0
+        # Segment number, duration, and whether it follows a gap
+        self.entries: List[Tuple[int, float, bool]] = []
+        # Set once a segment turned out not to be MPEG-TS
+        self.unsupported = False
+        self.load()
+
+    def load(self) -> None:
+        """Continue the playlist left by a previous download, if any."""
+        try:
+            lines = self.path.read_text(encoding="utf-8").splitlines()
+        except FileNotFoundError:
+            return
+        duration = DEFAULT_DURATION
+        discontinuity = False
+        for line in lines:
+            if line.startswith("#EXT-X-TARGETDURATION:"):
+                self.target_duration = int(line.split(":", 1)[1])
+            elif line.startswith("#EXTINF:"):
+                duration = float(line[len("#EXTINF:"):].split(",", 1)[0])
+            elif line == "#EXT-X-DISCONTINUITY":
+                discontinuity = True
+            elif line and not line.startswith("#"):
+                self.entries.append(
+                    (int(line.partition("_")[0]), duration, discontinuity))
+                discontinuity = False
+        if lines and lines[-1] == "#EXT-X-ENDLIST":
+            # The download is being resumed, the playlist is live again
+            self.rewrite()
+
+    @property
+    def last_seq(self) -> Optional[int]:
+        return self.entries[-1][0] if self.entries else None
+
+    def segment_name(self, seq: int) -> str:
+        return f"{seq:0{10}}{self.suffix}.ts"
+
+    def append(self, seq: int) -> Optional[float]:
+        """
+        Add segment seq if it was written and is MPEG-TS. Return its duration.
+        """
+        if self.unsupported:
+            return None
+        segment = self.directory / self.segment_name(seq)
+        if not segment.exists():
+            # Skipped, the next segment will follow a gap
+            return None
+        span = read_timestamps(segment)
+        if span is None and not self.is_mpegts(segment):
+            self.unsupported = True
+            logger.warning(
+                f"Segment {segment.name} is not MPEG-TS. "
+                f"Not adding segments to {self.path} anymore.")
+            return None
+        if span is not None and span.duration > 0:
+            duration = span.duration
+        else:
+            duration = self.entries[-1][1] if self.entries else DEFAULT_DURATION
+        last_seq = self.last_seq
+        entry = (seq, duration, last_seq is not None and seq != last_seq + 1)
+        self.entries.append(entry)
+
+        if math.ceil(duration) > self.target_duration or not self.path.exists():
+            self.target_duration = max(self.target_duration, math.ceil(duration))
+            self.rewrite()
+        else:
+            with open(self.path, "a", encoding="utf-8") as fp:
+                fp.write(self._format(entry))
+        return duration
+
+    @staticmethod
+    def is_mpegts(segment: Path) -> bool:
+        with open(segment, "rb") as f:
+            return is_mpegts(f.read(3 * TS_PACKET_SIZE))
+
+    def _format(self, entry: Tuple[int, float, bool]) -> str:
+        seq, duration, discontinuity = entry
+        return (
+            ("#EXT-X-DISCONTINUITY\n" if discontinuity else "")
+            + f"#EXTINF:{duration:.3f},\n{self.segment_name(seq)}\n")
+
+    def rewrite(self, end: bool = False) -> None:
+        first = self.entries[0][0] if self.entries else 0
+        tmp = self.path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as fp:
+            fp.write(
+                "#EXTM3U\n"
+                "#EXT-X-VERSION:3\n"
+                "#EXT-X-PLAYLIST-TYPE:EVENT\n"
+                f"#EXT-X-TARGETDURATION:{max(1, self.target_duration)}\n"
+                f"#EXT-X-MEDIA-SEQUENCE:{first}\n")
+            fp.writelines(self._format(entry) for entry in self.entries)
+            if end:
+                fp.write("#EXT-X-ENDLIST\n")
+        tmp.replace(self.path)
+
+    def finish(self) -> None:
+        """Mark the playlist as complete."""
+        if self.path.exists():
+            with open(self.path, "a", encoding="utf-8") as fp:
+                fp.write("#EXT-X-ENDLIST\n")
+
+
+class LivePlaylist:
+    """
+    Playlists of a download, updated each time a segment number is
+    committed. Without an audio directory, the video segments are assumed to
+    hold both tracks.
+    """
+
+    def __init__(self, data_dir: Path, muxed: bool = False) -> None:
+        self.path = data_dir / LIVE_PLAYLIST
+        self.video = MediaPlaylist(data_dir / "vid", "_video")
+        self.audio = None if muxed else MediaPlaylist(data_dir / "aud", "_audio")
+
+    def commit(self, seq: int) -> None:
+        try:
+            duration = self.video.append(seq)
+            if self.audio is not None:
+                self.audio.append(seq)
+            if duration and not self.path.exists():
+                self.write_master(seq, duration)
+        except Exception as e:
+            # The download matters more than being able to watch it live
+            logger.warning(f"Failed to add segment {seq} to live playlist: {e}")
+
+    def write_master(self, seq: int, duration: float) -> None:
+        """Write the master playlist, with the bit rate of the first segment."""
+        size = (self.video.directory / self.video.segment_name(seq)).stat().st_size
+        lines = ["#EXTM3U", "#EXT-X-VERSION:3"]
+        attributes = ""
+        if self.audio is not None:
+            audio_segment = self.audio.directory / self.audio.segment_name(seq)
+            if audio_segment.exists():
+                size += audio_segment.stat().st_size
+            lines.append(
+                '#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="audio",NAME="audio",'
+                f'DEFAULT=YES,AUTOSELECT=YES,URI="aud/{MEDIA_PLAYLIST}"')
+            attributes = ',AUDIO="audio"'
+        lines.append(
+            f"#EXT-X-STREAM-INF:BANDWIDTH={int(size * 8 / duration)}{attributes}")
+        lines.append(f"vid/{MEDIA_PLAYLIST}")
+        self.path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+    def finish(self) -> None:
+        for playlist in (self.video, self.audio):
+            if playlist is not None:
+                playlist.finish()
@@ -1,4 +1,4 @@
-from typing import Iterable, Optional, Any, List, Dict, Union
+from typing import Callable, Iterable, Optional, Any, List, Dict, Union
 from os import sep, makedirs, getcwd, environ
 from sys import platform
 from sys import argv
@@ -9,18 +9,24 @@ from pathlib import Path
 from configparser import ConfigParser, ExtendedInterpolation
 import traceback
 import threading
+import signal
 from copy import deepcopy
-from concurrent.futures import ThreadPoolExecutor
-from queue import Queue
 import re
 from shlex import split
-from time import sleep
 
 from livestream_saver.channel import YoutubeChannel, VideoPost
 from livestream_saver.download import YoutubeLiveStream
-from livestream_saver.merge import merge, get_metadata_info
+from livestream_saver.merge import (
+    merge, split_merge, get_metadata_info, InsufficientSpaceError
+)
+from livestream_saver.merge_queue import (
+    MergeQueue, MergeJob, batch_merge, IONICE_CLASSES
+)
 from livestream_saver.util import get_channel_id, event_props
-from livestream_saver.request import YoutubeUrllibSession
+from livestream_saver.request import YoutubeUrllibSession, SessionPool
+from livestream_saver.scheduler import ChannelScheduler, UpcomingPoller
+from livestream_saver.dispatcher import DownloadDispatcher
+from livestream_saver.state import StateStore, PROCESSED, SKIPPED, FAILED
 from livestream_saver.notifier import NotificationDispatcher, WebHookFactory
 from livestream_saver.hooks import HookCommand
 from livestream_saver.util import (
@@ -140,6 +146,12 @@ channel ID deduced from the URL otherwise.'
             ' If none is specified, will load the first section in config with that name pattern.'
         )
     )
+    monitor_parser.add_argument('--all-sections', action='store_true',
+        default=False,
+        help='Monitor the channels of every [monitor NAME] section found in '
+            'config file from this single process, sharing sessions, '
+            'downloads and merges between them.'
+    )
 
     monitor_group = monitor_parser.add_mutually_exclusive_group()
     monitor_parser.add_argument('-d', '--delete-source',
@@ -151,6 +163,13 @@ merging of them has been done.'
         action='store_true',
         help='Do not merge segments after live streams has ended.'
     )
+    monitor_parser.add_argument('--progressive-merge',
+        action='store_true',
+        default=argparse.SUPPRESS,
+        help='With --delete-source, delete source segments as soon as they \
+are merged, instead of at the end, to use less disk space.'
+            f' (Default: {config.getboolean("monitor", "progressive_merge")})'
+    )
     monitor_parser.add_argument('-k', '--keep-concat',
         action='store_true',
         help='Keep concatenated intermediary files even if \
@@ -182,6 +201,53 @@ merging of streams has been successful. Only useful for troubleshooting.'
         help='If stream resolution changes during live-stream, keep downloading anyway.'\
             f' (Default: {config.getboolean("monitor", "ignore_quality_change")})'
     )
+    monitor_parser.add_argument('--rolling-merge',
+        action='store', type=float,
+        dest='rolling_merge_interval',
+        metavar='MINUTES',
+        default=argparse.SUPPRESS,
+        help='Merge downloaded segments into chunks every MINUTES while the '
+            'stream is still being downloaded, to shorten the final merge. '
+            '0 disables it.'
+            f' (Default: {config.getfloat("monitor", "rolling_merge_interval")})'
+    )
+    monitor_parser.add_argument('--live-playlist',
+        action='store_true',
+        default=argparse.SUPPRESS,
+        help='Write HLS playlists (live.m3u8) over the segments as they are '
+            'downloaded, to watch the stream while it is being recorded.'
+            f' (Default: {config.getboolean("monitor", "live_playlist")})'
+    )
+    monitor_parser.add_argument('--rss-precheck',
+        action='store_true',
+        default=argparse.SUPPRESS,
+        help='Fetch the RSS feed of the channel before each scan, and only '
+            'scan its tabs if new videos appeared in it, if a known video is '
+            'live or about to start, or every --full-scan-delay minutes.'
+            f' (Default: {config.getboolean("monitor", "rss_precheck")})'
+    )
+    monitor_parser.add_argument('--full-scan-delay',
+        action='store', type=float,
+        default=argparse.SUPPRESS,
+        help='Interval in minutes between two scans of the channel tabs when '
+            'the RSS feed shows no change, with --rss-precheck.'
+            f' (Default: {config.getfloat("monitor", "full_scan_delay")})'
+    )
+    monitor_parser.add_argument('--adaptive-scan',
+        action='store_true',
+        default=argparse.SUPPRESS,
+        help='Poll upcoming videos around their scheduled start time, and '
+            'only scan the channel every --idle-scan-delay minutes while it '
+            'has no scheduled video.'
+            f' (Default: {config.getboolean("monitor", "adaptive_scan")})'
+    )
+    monitor_parser.add_argument('--idle-scan-delay',
+        action='store', type=float,
+        default=argparse.SUPPRESS,
+        help='Interval in minutes to scan a channel without any scheduled '
+            'video, with --adaptive-scan.'
+            f' (Default: {config.getfloat("monitor", "idle_scan_delay")})'
+    )
     monitor_parser.add_argument('--max-simultaneous-streams',
         action='store',
         type=int,
@@ -192,6 +258,16 @@ merging of streams has been successful. Only useful for troubleshooting.'
             f' (Default: {MAX_SIMULTANEOUS_LIVE_DOWNLOAD})'
         )
     )
+    monitor_parser.add_argument('--max-simultaneous-merges',
+        action='store',
+        type=int,
+        default=argparse.SUPPRESS,
+        help=(
+            'Merge up to this number of downloaded streams simultaneously, '
+            'in the background.'
+            f' (Default: {config.getint("monitor", "max_simultaneous_merges")})'
+        )
+    )
 
     # Sub-command "download"
     download_parser = subparsers.add_parser('download',
@@ -232,6 +308,13 @@ merging of streams has been successful. Only useful for troubleshooting.'
         action='store_true',
         help='Do not merge segments after live streams has ended.'
     )
+    download_parser.add_argument('--progressive-merge',
+        action='store_true',
+        default=argparse.SUPPRESS,
+        help='With --delete-source, delete source segments as soon as they \
+are merged, instead of at the end, to use less disk space.'
+            f' (Default: {config.getboolean("download", "progressive_merge")})'
+    )
     download_parser.add_argument('-k', '--keep-concat',
         action='store_true',
         help='Keep concatenated intermediary files even if merging of \
@@ -261,6 +344,23 @@ streams has been successful. Only useful for troubleshooting.'
         help='If stream resolution changes during live-stream, keep downloading anyway.'\
             f' (Default: {config.getboolean("download", "ignore_quality_change")})'
     )
+    download_parser.add_argument('--rolling-merge',
+        action='store', type=float,
+        dest='rolling_merge_interval',
+        metavar='MINUTES',
+        default=argparse.SUPPRESS,
+        help='Merge downloaded segments into chunks every MINUTES while the '
+            'stream is still being downloaded, to shorten the final merge. '
+            '0 disables it.'
+            f' (Default: {config.getfloat("download", "rolling_merge_interval")})'
+    )
+    download_parser.add_argument('--live-playlist',
+        action='store_true',
+        default=argparse.SUPPRESS,
+        help='Write HLS playlists (live.m3u8) over the segments as they are '
+            'downloaded, to watch the stream while it is being recorded.'
+            f' (Default: {config.getboolean("download", "live_playlist")})'
+    )
 
     # Sub-command "merge"
     merge_parser = subparsers.add_parser('merge',
@@ -272,13 +372,67 @@ streams has been successful. Only useful for troubleshooting.'
     merge_parser.add_argument('PATH',
         type=str,
         help='Path to directory holding vid/aud sub-directories \
-in which segments have been downloaded as well as the metadata.txt file.'
+in which segments have been downloaded as well as the metadata.txt file. \
+With --batch, path to a directory holding such directories.'
+    )
+    merge_parser.add_argument('--batch',
+        action='store_true',
+        help='Merge every "stream_capture_*" directory found in PATH, \
+skipping those already merged, and write a summary to merge_report.json.'
+    )
+    merge_parser.add_argument('-j', '--jobs',
+        action='store', type=int,
+        dest='max_simultaneous_merges',
+        metavar='N',
+        default=argparse.SUPPRESS,
+        help='Number of directories to merge simultaneously with --batch'
+            f' (Default: {config.getint("merge", "max_simultaneous_merges")}),'
+            ' or of ranges remuxed simultaneously with --split'
+            ' (Default: all of them).'
+    )
+    merge_parser.add_argument('--niceness',
+        action='store', type=int,
+        dest='merge_niceness',
+        metavar='NICENESS',
+        default=argparse.SUPPRESS,
+        help='CPU niceness of merges with --batch, from 0 to 19.'
+            f' (Default: {config.getint("merge", "merge_niceness")})'
+    )
+    merge_parser.add_argument('--ionice-class',
+        action='store',
+        dest='merge_ionice_class',
+        choices=IONICE_CLASSES.keys(),
+        default=argparse.SUPPRESS,
+        help='I/O scheduling class of merges with --batch (Linux only).'
+    )
+    merge_parser.add_argument('--split',
+        action='store', type=int,
+        dest='split_parts',
+        metavar='N',
+        default=argparse.SUPPRESS,
+        help='Split segments into N contiguous time ranges and remux them in \
+parallel, then join them into the final file. Useful for very long streams.'
+            f' (Default: {config.getint("merge", "split_parts")})'
+    )
+    merge_parser.add_argument('--no-join',
+        action='store_false',
+        dest='join_parts',
+        default=argparse.SUPPRESS,
+        help='With --split, write each range to its own part file instead \
+of joining them.'
     )
     merge_parser.add_argument('-d', '--delete-source',
         action='store_true',
         help='Delete source files (vid/aud) once final merging of \
 streams has been successfully done.'
     )
+    merge_parser.add_argument('--progressive-merge',
+        action='store_true',
+        default=argparse.SUPPRESS,
+        help='With --delete-source, delete source segments as soon as they \
+are merged, instead of at the end, to use less disk space.'
+            f' (Default: {config.getboolean("merge", "progressive_merge")})'
+    )
     merge_parser.add_argument('-k', '--keep-concat',
         action='store_true',
         help='Keep concatenated intermediary files even if merging of \
@@ -417,6 +571,14 @@ def _get_regex_from_config(
     return None
 
 
+def get_monitor_sections(config: ConfigParser) -> List[str]:
+    """Names of the [monitor NAME] sections, in config file order."""
+    return [
+        section[len("monitor "):] for section in config.sections()
+        if section.startswith("monitor ") and len(section) > len("monitor ")
+    ]
+
+
 def _get_target_params(
     config: ConfigParser,
     args: Dict,
@@ -448,6 +610,14 @@ def _get_target_params(
 
     # This may throw, it should crash the program to avoid bad surprises
     if sub_cmd == "monitor":
+        params["rss_precheck"] = config.getboolean(
+            sub_cmd, "rss_precheck", vars=args)
+        params["full_scan_delay"] = config.getfloat(
+            sub_cmd, "full_scan_delay", vars=args)
+        params["adaptive_scan"] = config.getboolean(
+            sub_cmd, "adaptive_scan", vars=args)
+        params["idle_scan_delay"] = config.getfloat(
+            sub_cmd, "idle_scan_delay", vars=args)
         for regex_str in ("allow_regex", "block_regex"):
             try:
                 params["filters"][regex_str] = _get_regex_from_config(
@@ -494,6 +664,22 @@ def _get_target_params(
                 section, "ignore_quality_change", vars=args,
                 fallback=params["ignore_quality_change"]
             )
+            params["rss_precheck"] = config.getboolean(
+                section, "rss_precheck", vars=args,
+                fallback=params["rss_precheck"]
+            )
+            params["full_scan_delay"] = config.getfloat(
+                section, "full_scan_delay", vars=args,
+                fallback=params["full_scan_delay"]
+            )
+            params["adaptive_scan"] = config.getboolean(
+                section, "adaptive_scan", vars=args,
+                fallback=params["adaptive_scan"]
+            )
+            params["idle_scan_delay"] = config.getfloat(
+                section, "idle_scan_delay", vars=args,
+                fallback=params["idle_scan_delay"]
+            )
 
             # Update any hook already present with those defined in that section
             overriden_hooks = get_hooks_for_section(section, config, "_command")
@@ -525,28 +711,79 @@ def _get_target_params(
     return params
 
 
-video_queue: Queue[VideoPost] = Queue(maxsize=4)
-video_processing = set()
-video_processed = set()
+# Videos being processed, processed or skipped, by video Id
+video_state = StateStore()
+merge_queue: Optional[MergeQueue] = None
 
 
-def video_feeder(queue: Queue, channel: YoutubeChannel, scan_delay: float):
-    while True:
-        try:
-            live_videos = channel.filter_videos('isLiveNow')
-            log.debug(
-                "Live videos found for channel "
-                f"\"{channel.name}\": "
-                f"{live_videos if len(live_videos) else None}"
-            )
+def scan_channel(
+    target: tuple,
+    dispatch: Callable[[YoutubeChannel, Dict[str, Any], VideoPost], None],
+    poller: Optional[UpcomingPoller] = None
+) -> Optional[float]:
+    """
+    Scan a target of a ChannelScheduler: either a (channel, channel_args)
+    pair, whose live videos are dispatched, or an upcoming video polled by
+    poller around its start time. With adaptive scans, return the number of
+    seconds until the channel should be scanned again.
+    """
+    if len(target) == 3:
+        return poller.poll(*target)
+
+    channel, channel_args = target
+    live_videos = channel.filter_videos(
+        'isLiveNow', on_found=lambda v: dispatch(channel, channel_args, v))
+    log.debug(
+        "Live videos found for channel "
+        f"\"{channel.name}\": "
+        f"{live_videos if len(live_videos) else None}"
+    )
+    if poller is None or not channel_args.get("adaptive_scan"):
+        return None
+    if poller.track(channel, channel_args):
+        return poller.scheduler.interval(channel_args["scan_delay"])
+    return poller.scheduler.interval(channel_args["idle_scan_delay"])
 
-            for v in live_videos[:MAX_SIMULTANEOUS_LIVE_DOWNLOAD]:
-                if v not in video_processing:
-                    queue.put(v)
-        except Exception as e:
-            # Handle urllib.error.URLError <urlopen error [Errno -3] Temporary failure in name resolution>
-            log.exception(f"Error while getting live videos: {e}")
-        wait_block(min_minutes=scan_delay, variance=TIME_VARIANCE)
+
+def make_dispatcher(
+    config: ConfigParser, args: Dict[str, Any]
+) -> DownloadDispatcher:
+    """
+    Dispatcher of downloads limited to max_simultaneous_streams, which skips
+    videos already processed or skipped according to video_state.
+    """
+    return DownloadDispatcher(
+        max_workers=config.getint(
+            "monitor", "max_simultaneous_streams", vars=args),
+        is_known=lambda video_id: video_state.get(video_id) is not None
+    )
+
+
+def make_dispatch(
+    dispatcher: DownloadDispatcher, config: ConfigParser
+) -> Callable[[YoutubeChannel, Dict[str, Any], VideoPost], None]:
+    """Hand each live video found by a scan to the dispatcher right away."""
+    def dispatch(
+        channel: YoutubeChannel, channel_args: Dict[str, Any], v: VideoPost
+    ) -> None:
+        key = v.get("videoId") or v.get("url")
+        if dispatcher.submit(
+            key, download_task, v, config, channel_args, channel.session
+        ):
+            log.debug(f"Dispatched {key} for download.")
+    return dispatch
+
+
+def stop_on_sigterm() -> None:
+    """
+    Shut down on SIGTERM the same way as on Ctrl+C: new videos are no longer
+    dispatched, and running downloads are waited for.
+    """
+    def handler(signum, frame):
+        raise KeyboardInterrupt(f"Received signal {signum}")
+
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, handler)
 
 
 def download_task(
@@ -557,11 +794,6 @@ def download_task(
 ):
     use_ytdl = args.get("use_ytdl", False)
 
-    if video in video_processing or video in video_processed:
-        log.debug(f"Video already processed or being processed: {video}")
-        return
-    video_processing.add(video)
-
     video_id = video.get("videoId")
     # Build the full "/watch?v=..." URL
     video_url = f"https://www.youtube.com{video.get('url')}"
@@ -571,9 +803,12 @@ def download_task(
             video_id = get_video_id(video_url)
         except ValueError as e:
             log.critical(e)
-            video_processing.remove(video)
             return
 
+    if not video_state.claim(video_id):
+        log.debug(f"Video already processed or being processed: {video}")
+        return
+
     log.info(
         f"Found live: {video_id}. Title: \"{video.get('title')}\".")
 
@@ -600,7 +835,11 @@ def download_task(
         log_level=config.get("monitor", "log_level", vars=args),  # type: ignore
         initial_metadata=video,
         use_ytdl=use_ytdl,
-        ytdl_opts=deepcopy(args["ytdlp_config"])
+        ytdl_opts=deepcopy(args["ytdlp_config"]),
+        rolling_merge_interval=config.getfloat(
+            "monitor", "rolling_merge_interval", vars=args),
+        delete_source=config.getboolean("monitor", "delete_source", vars=args),
+        live_playlist=config.getboolean("monitor", "live_playlist", vars=args)
     )
 
     # ls.get_metadata(force=True)
@@ -610,10 +849,12 @@ def download_task(
     if not skip_download:
         download_wanted = live_video.pre_download_checks()
 
+    failed = False
     if download_wanted:
         try:
             live_video.download()
         except Exception as e:
+            failed = True
             log.exception(
                 f"Got error in stream download but continuing...\n {e}")
 
@@ -628,6 +869,7 @@ def download_task(
         # Add a small wait to read debug output in case of network errors
         # cf issue #76
         wait_block(min_minutes=0.5, variance=0.1)
+        video_state.finish(video_id, SKIPPED)
         return
 
     if live_video.done:
@@ -639,23 +881,24 @@ def download_task(
             message_text=f""
         )
         if not config.getboolean("monitor", "no_merge", vars=args) \
-                and not use_ytdl:
-            log.info("Merging segments...")
-            # TODO in a separate thread?
-            try:
-                merge(
-                    info=live_video.video_info,
-                    data_dir=live_video.output_dir,
+                and not use_ytdl and merge_queue is not None:
+            log.info("Queuing segments for merging...")
+            # TODO pass arguments about (un)successful merge
+            merge_queue.submit(
+                MergeJob(
+                    data_dir=str(live_video.output_dir),
                     keep_concat=config.getboolean(
                         "monitor", "keep_concat", vars=args),
                     delete_source=config.getboolean(
-                        "monitor", "delete_source", vars=args)
-                )
-            except Exception as e:
-                log.error(e)
-
-            # TODO pass arguments about (un)successful merge
-            live_video.trigger_hooks("on_merge_done")
+                        "monitor", "delete_source", vars=args),
+                    info=live_video.video_info,
+                    progressive=config.getboolean(
+                        "monitor", "progressive_merge", vars=args),
+                    channel_id=args.get("channel_id")
+                ),
+                callback=lambda job, result: live_video.trigger_hooks(
+                    "on_merge_done")
+            )
 
             # TODO get the updated stream title from the channel page if
             # the stream was recorded correctly?
@@ -669,8 +912,9 @@ def download_task(
         )
         log.critical("Error during stream download! Resuming monitoring...")
 
-    video_processed.add(video)
-    video_processing.remove(video)
+    # Failures are retried once the monitor is restarted
+    video_state.finish(
+        video_id, FAILED if failed or live_video.error else PROCESSED)
 
 
 
@@ -685,35 +929,188 @@ def monitor_mode(config: ConfigParser, args: Dict[str, Any]):
     )
     session._initialize_consent()
 
+    global video_state
+    video_state = StateStore(
+        (args["output_dir"] or Path()) / f"monitor_state_{channel_id}.db")
+
     URL = sanitize_channel_url(URL)
     channel = YoutubeChannel(
         URL, channel_id, session,
         output_dir=args["output_dir"],
         hooks=args["hooks"],
         notifier=NOTIFIER,
-        name=args.get("channel_name")
+        name=args.get("channel_name"),
+        state=video_state,
+        rss_precheck=args["rss_precheck"],
+        full_scan_delay=args["full_scan_delay"]
     )
     log.info(f"Monitoring channel: {channel._id}")
 
-    feeder_thread = threading.Thread(
-        target=video_feeder,
-        args=(video_queue, channel, scan_delay)
+    global merge_queue
+    ionice_class = config.get("monitor", "merge_ionice_class", vars=args)
+    merge_queue = MergeQueue(
+        state_path=(args["output_dir"] or Path()) / f"merge_queue_{channel_id}.json",
+        max_workers=config.getint("monitor", "max_simultaneous_merges", vars=args),
+        niceness=config.getint("monitor", "merge_niceness", vars=args),
+        ionice_class=ionice_class or None,
+        on_done=lambda job, result: trigger_merge_hooks(job, args),
+        on_deferred=alert_merge_deferred,
+        retry_delay=config.getfloat(
+            "monitor", "merge_retry_delay", vars=args) * 60
+    )
+    if resumed := merge_queue.resume():
+        log.info(f"Resumed {resumed} pending merges from a previous run.")
+
+    dispatcher = make_dispatcher(config, args)
+    dispatch = make_dispatch(dispatcher, config)
+    scheduler = ChannelScheduler(
+        lambda target: scan_channel(target, dispatch, poller),
+        max_workers=config.getint("monitor", "max_simultaneous_scans", vars=args),
+        variance=TIME_VARIANCE
     )
-    feeder_thread.daemon = True
-    feeder_thread.start()
+    poller = UpcomingPoller(scheduler, dispatch)
+    scheduler.add((channel, args), scan_delay)
+    stop_on_sigterm()
 
-    with ThreadPoolExecutor(
-        max_workers=MAX_SIMULTANEOUS_LIVE_DOWNLOAD
-    ) as executor:
-        # TODO better handle keyboard interrupts
-        while feeder_thread.is_alive():
-            executor.submit(
-                download_task, video_queue.get(), config, args, channel.session
-            )
-            log.debug("waiting 5 seconds")
-            sleep(5)  # probably not necessary if queue.get blocks
+    try:
+        scheduler.run()
+    finally:
+        scheduler.stop(wait=False)
+        channel.close()
+        dispatcher.shutdown(wait=True)
+        merge_queue.shutdown()
+
+
+def monitor_all_mode(config: ConfigParser, args: Dict[str, Any]):
+    """
+    Monitor the channels of every [monitor NAME] section from this process.
+    Channel scans are scheduled on a shared timer, channels using the same
+    cookies share a session, and downloads of all channels run from a single
+    executor limited to max_simultaneous_streams.
+    """
+    global merge_queue
+    ionice_class = config.get("monitor", "merge_ionice_class", vars=args)
+    merge_queue = MergeQueue(
+        state_path=(args["output_dir"] or Path()) / "merge_queue_all.json",
+        max_workers=config.getint("monitor", "max_simultaneous_merges", vars=args),
+        niceness=config.getint("monitor", "merge_niceness", vars=args),
+        ionice_class=ionice_class or None,
+        on_done=lambda job, result: trigger_merge_hooks(job, args),
+        on_deferred=alert_merge_deferred,
+        retry_delay=config.getfloat(
+            "monitor", "merge_retry_delay", vars=args) * 60
+    )
+    if resumed := merge_queue.resume():
+        log.info(f"Resumed {resumed} pending merges from a previous run.")
+
+    global video_state
+    video_state = StateStore(
+        (args["output_dir"] or Path()) / "monitor_state_all.db")
+
+    dispatcher = make_dispatcher(config, args)
+    dispatch = make_dispatch(dispatcher, config)
+    scheduler = ChannelScheduler(
+        lambda target: scan_channel(target, dispatch, poller),
+        max_workers=config.getint("monitor", "max_simultaneous_scans", vars=args),
+        variance=TIME_VARIANCE
+    )
+    poller = UpcomingPoller(scheduler, dispatch)
+    sessions = SessionPool(notifier=NOTIFIER)
+    channels: List[YoutubeChannel] = []
+    for params in args["channels"]:
+        URL = sanitize_channel_url(params["URL"])
+        channel = YoutubeChannel(
+            URL, params["channel_id"],
+            sessions.get(params.get("cookies")),
+            output_dir=args["output_dir"],
+            hooks=params["hooks"],
+            notifier=NOTIFIER,
+            name=params.get("channel_name"),
+            state=video_state,
+            rss_precheck=params["rss_precheck"],
+            full_scan_delay=params["full_scan_delay"]
+        )
+        channel_args = {
+            **args,
+            "URL": URL,
+            "channel_id": params["channel_id"],
+            "channel_name": params.get("channel_name"),
+            "cookies": params.get("cookies"),
+            "hooks": params["hooks"],
+            "filters": params["filters"],
+            "skip_download": params["skip_download"],
+            "ignore_quality_change": params["ignore_quality_change"],
+            "scan_delay": params["scan_delay"],
+            "adaptive_scan": params["adaptive_scan"],
+            "idle_scan_delay": params["idle_scan_delay"],
+        }
+        channels.append(channel)
+        scheduler.add((channel, channel_args), params["scan_delay"])
+        log.info(
+            f"Monitoring channel: {channel._id} "
+            f"every {params['scan_delay']} minutes.")
+    log.info(
+        f"Monitoring {len(args['channels'])} channels "
+        f"with {len(sessions)} sessions.")
+
+    stop_on_sigterm()
+    try:
+        scheduler.run()
+    finally:
+        scheduler.stop(wait=False)
+        for channel in channels:
+            channel.close()
+        dispatcher.shutdown(wait=True)
+        merge_queue.shutdown()
+
+
+def alert_merge_deferred(job: MergeJob, error: InsufficientSpaceError):
+    NOTIFIER.send_email(
+        subject=f"Merge of {job.video_id} deferred: not enough disk space",
+        message_text=(
+            f"{error}\n"
+            "The merge will be retried later. Free some space in the "
+            "meantime, or run the merge sub-command on "
+            f"{job.data_dir} once it is done."
+        )
+    )
 
-    feeder_thread.join()
+
+def trigger_merge_hooks(job: MergeJob, args: Dict[str, Any]):
+    """
+    Trigger "on_merge_done" for jobs resumed from a previous run, for which
+    we no longer have a YoutubeLiveStream at hand. With --all-sections, the
+    hooks of the channel the job was downloaded from are used.
+    """
+    hooks = args["hooks"]
+    cookies = args.get("cookies")
+    for params in args.get("channels", ()):
+        if job.channel_id is not None \
+        and params["channel_id"] == job.channel_id:
+            hooks = params["hooks"]
+            cookies = params.get("cookies")
+            break
+    hook_cmd = hooks.get("on_merge_done")
+    webhookfactory = NOTIFIER.get_webhook("on_merge_done")
+    if hook_cmd is None and webhookfactory is None:
+        return
+    metadata = {
+        "url": f"https://www.youtube.com/watch?v={job.video_id}",
+        "videoId": job.video_id,
+        "cookiefile_path": cookies,
+        "logger": log,
+        "output_dir": Path(job.data_dir),
+        "title": job.info.get("title"),
+        "description": job.info.get("description"),
+        "author": job.info.get("author"),
+        "isLive": False,
+        "thumbnail": {}
+    }
+    if hook_cmd:
+        hook_cmd.spawn_subprocess(metadata)
+    if webhookfactory:
+        if webhook := webhookfactory.get(metadata):
+            NOTIFIER.q.put(webhook)
 
 
 def download_mode(config: ConfigParser, args: Dict[str, Any]):
@@ -741,7 +1138,11 @@ def download_mode(config: ConfigParser, args: Dict[str, Any]):
             "download", "ignore_quality_change", vars=args, fallback=False),
         log_level=config.get("download", "log_level", vars=args),  # type: ignore
         use_ytdl=use_ytdl,
-        ytdl_opts=args["ytdlp_config"]
+        ytdl_opts=args["ytdlp_config"],
+        rolling_merge_interval=config.getfloat(
+            "download", "rolling_merge_interval", vars=args),
+        delete_source=config.getboolean("download", "delete_source", vars=args),
+        live_playlist=config.getboolean("download", "live_playlist", vars=args)
     )
 
     ls.trigger_hooks("on_download_initiated")
@@ -756,7 +1157,17 @@ def download_mode(config: ConfigParser, args: Dict[str, Any]):
                 info=ls.video_info,
                 data_dir=ls.output_dir,
                 keep_concat=config.getboolean("download", "keep_concat", vars=args),
-                delete_source=config.getboolean("download", "delete_source", vars=args)
+                delete_source=config.getboolean("download", "delete_source", vars=args),
+                progressive=config.getboolean(
+                    "download", "progressive_merge", vars=args)
+            )
+        except InsufficientSpaceError as e:
+            log.critical(
+                f"{e} Run the merge sub-command on {ls.output_dir} "
+                "once enough space has been freed.")
+            NOTIFIER.send_email(
+                subject=f"Merge of {ls.video_id} deferred: not enough disk space",
+                message_text=str(e)
             )
         except Exception as e:
             log.error(e)
@@ -768,14 +1179,60 @@ def download_mode(config: ConfigParser, args: Dict[str, Any]):
 
 def merge_mode(config, args):
     data_path = Path(args["PATH"]).resolve()
+    output_dir = config.get("merge", "output_dir", vars=args)
+    if args.get("batch"):
+        ionice_class = config.get("merge", "merge_ionice_class", vars=args)
+        report = batch_merge(
+            root=data_path,
+            output_dir=Path(output_dir) if output_dir else None,
+            keep_concat=config.getboolean("merge", "keep_concat", vars=args),
+            delete_source=config.getboolean("merge", "delete_source", vars=args),
+            max_workers=config.getint(
+                "merge", "max_simultaneous_merges", vars=args),
+            niceness=config.getint("merge", "merge_niceness", vars=args),
+            ionice_class=ionice_class or None,
+            progressive=config.getboolean(
+                "merge", "progressive_merge", vars=args)
+        )
+        return 1 if report["failed"] or report["deferred"] else 0
+
     info = get_metadata_info(data_path)
-    written_file = merge(
-        info=info,
-        data_dir=data_path,
-        output_dir=config.get("merge", "output_dir", vars=args),
-        keep_concat=config.getboolean("merge", "keep_concat", vars=args),
-        delete_source=config.getboolean("merge", "delete_source", vars=args)
-    )
+    split_parts = config.getint("merge", "split_parts", vars=args)
+    if split_parts > 1:
+        try:
+            written_files = split_merge(
+                info=info,
+                data_dir=data_path,
+                output_dir=Path(output_dir) if output_dir else None,
+                parts=split_parts,
+                join=config.getboolean("merge", "join_parts", vars=args),
+                max_workers=args.get("max_simultaneous_merges"),
+                keep_concat=config.getboolean(
+                    "merge", "keep_concat", vars=args),
+                delete_source=config.getboolean(
+                    "merge", "delete_source", vars=args)
+            )
+        except InsufficientSpaceError as e:
+            log.critical(f"{e} Free some space and try again.")
+            return 1
+        if not written_files:
+            log.critical("Something failed. Please report the issue with logs.")
+            return 1
+        return 0
+
+    try:
+        written_file = merge(
+            info=info,
+            data_dir=data_path,
+            output_dir=Path(output_dir) if output_dir else None,
+            keep_concat=config.getboolean("merge", "keep_concat", vars=args),
+            delete_source=config.getboolean("merge", "delete_source", vars=args),
+            progressive=config.getboolean(
+                "merge", "progressive_merge", vars=args)
+        )
+    except InsufficientSpaceError as e:
+        log.critical(f"{e} Free some space and try again.")
+        return 1
 
     if not written_file:
         log.critical("Something failed. Please report the issue with logs.")
@@ -852,13 +1309,35 @@ def init_config() -> ConfigParser:
         "skip_download": "False",
         "email_notifications": "False",
         "ignore_quality_change": "False",
+        "rolling_merge_interval": "0",  # minutes, 0 to disable
+        "progressive_merge": "False",
+        "live_playlist": "False",
     }
     other_defaults = {
         "monitor": {
-            "scan_delay": 15.0  # minutes
+            "scan_delay": 15.0,  # minutes
+            "max_simultaneous_merges": 1,
+            "merge_niceness": 10,
+            "merge_ionice_class": "",  # realtime, best-effort or idle
+            # minutes before retrying a merge deferred for lack of space
+            "merge_retry_delay": 30.0,
+            "max_simultaneous_streams": MAX_SIMULTANEOUS_LIVE_DOWNLOAD,
+            # channels scanned at the same time with --all-sections
+            "max_simultaneous_scans": 4,
+            "rss_precheck": "False",
+            "full_scan_delay": 60.0,  # minutes
+            "adaptive_scan": "False",
+            "idle_scan_delay": 60.0,  # minutes
         },
         "download": {
             "scan_delay": 2.0  # minutes
+        },
+        "merge": {
+            "max_simultaneous_merges": 2,
+            "merge_niceness": 10,
+            "merge_ionice_class": "",  # realtime, best-effort or idle
+            "split_parts": 1,
+            "join_parts": True,
         }
     }
 
@@ -878,7 +1357,6 @@ def init_config() -> ConfigParser:
     )
     # Set defaults for each section
     config.read_dict(other_defaults)
-    config.add_section("merge")
     config.add_section("test-notification")  # FIXME this one is useless
     return config
 
@@ -1003,7 +1481,44 @@ def main():
     args["use_ytdl"] = config.getboolean(sub_cmd, "use_ytdl", vars=args, fallback=False)
 
     logfile_path = Path("")  # cwd by default
-    if sub_cmd == "monitor":
+    if sub_cmd == "monitor" and args.get("all_sections"):
+        # Webhooks are dispatched by a single notifier, so only those from the
+        # monitor section apply to all channels.
+        NOTIFIER.webhooks = get_hooks_for_section(sub_cmd, config, "_webhook")
+        NOTIFIER.setup(config, args)
+
+        channels = []
+        for name in get_monitor_sections(config):
+            params = _get_target_params(
+                config, {**args, "URL": None}, sub_cmd=sub_cmd, override=name)
+            params["cookies"] = normalize_path_str(params.get("cookies"))
+            params["channel_id"] = get_channel_id(
+                params["URL"], service_name="youtube")
+            channels.append(params)
+        if not channels:
+            raise Exception(
+                "No [monitor {channel}] section found in the config file."
+                " Config file path was:"
+                f" \"{config.get('DEFAULT', 'config_file', vars=args)}\"")
+        args["channels"] = channels
+        args["hooks"] = get_hooks_for_section(sub_cmd, config, "_command")
+        args["cookies"] = normalize_path_str(
+            config.get(sub_cmd, "cookies", vars=args, fallback=None))
+        args["func"] = monitor_all_mode
+
+        output_dir: Optional[str] = config.get(
+            "monitor", "output_dir", vars=args, fallback=None)
+        output_path = Path(output_dir) if output_dir else Path()
+        makedirs(output_path, exist_ok=True)
+        args["output_dir"] = Path(output_dir) if output_dir else None
+
+        logfile_path = output_path / "monitor_all.log"
+        setup_logger(
+            output_filepath=logfile_path,
+            loglevel=config.get(sub_cmd, "log_level", vars=args)
+        )
+        args["logger"] = log
+    elif sub_cmd == "monitor":
         params = _get_target_params(
             config, args, sub_cmd=sub_cmd, override=args["section"])
         NOTIFIER.webhooks = params.get("webhooks", {})
@@ -1018,6 +1533,10 @@ def main():
         args["skip_download"] = params.get("skip_download")
         args["ignore_quality_change"] = params.get("ignore_quality_change")
         args["filters"] = params.get("filters", {})
+        args["rss_precheck"] = params.get("rss_precheck")
+        args["full_scan_delay"] = params.get("full_scan_delay")
+        args["adaptive_scan"] = params.get("adaptive_scan")
+        args["idle_scan_delay"] = params.get("idle_scan_delay")
 
         channel_id = get_channel_id(args["URL"], service_name="youtube")
         args["channel_id"] = channel_id
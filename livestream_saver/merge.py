@@ -1,18 +1,51 @@
 #!/bin/env python3
 from shutil import rmtree
-from typing import Optional, Dict, List, Iterable, Iterator
+from functools import partial
+from typing import Optional, Dict, List, Iterable, Iterator, Callable, Union
 import subprocess
-from json import load
+from json import load, dump
 from pathlib import Path
-from shutil import copyfileobj, which
+from shutil import which, disk_usage
 import logging
+import math
+import os
 import re
+import threading
+from contextvars import ContextVar, copy_context
+from concurrent.futures import ThreadPoolExecutor, wait
 from filetype import guess_extension
 
-logger = logging.getLogger(__name__)
+from livestream_saver import ffmpeg_runner
+from livestream_saver.concat import concat_files
+from livestream_saver.mpegts import DurationTable
+from livestream_saver.segment_index import SegmentIndex, combined_signature
+from livestream_saver.live_playlist import LIVE_PLAYLIST
+from livestream_saver.sidecar import SegmentSidecar
+
+class _ContextLogger:
+    """
+    Forward to the logger of the merge running in the current context, since
+    merges may now run concurrently from different threads.
+    """
+    def __getattr__(self, name):
+        return getattr(_current_logger.get(), name)
+
+
+_current_logger: ContextVar[logging.Logger] = ContextVar(
+    "merge_logger", default=logging.getLogger(__name__))
+logger = _ContextLogger()
 # logger.setLevel(logging.DEBUG)
 
 MAX_NAME_LEN = 255
+# Where the rolling merge writes its chunk files, relative to the data dir
+CHUNK_DIR = "chunks"
+CHUNK_MANIFEST = "chunks.json"
+# Stages completed by merge(), in the data dir
+CHECKPOINT_NAME = "merge_checkpoint.json"
+# Free space kept on top of estimates, for logs and small files
+SPACE_MARGIN = 64 * 1024 * 1024
+# Approximate size of the ranges remuxed at a time by a progressive merge
+PROGRESSIVE_RANGE_BYTES = 1024 * 1024 * 1024
 
 
 def get_hash_from_path(path: Path) -> str:
@@ -42,11 +75,189 @@ class NonMonotonousDTSError(Exception):
 class DurationMismatchError(Exception):
     pass
 
+class MuxError(Exception):
+    pass
+
+class InsufficientSpaceError(Exception):
+    def __init__(self, path: Path, needed: int, available: int) -> None:
+        super().__init__(
+            f"Not enough free space in {path} to merge: "
+            f"{needed // 1048576} MiB needed, "
+            f"{available // 1048576} MiB available.")
+        self.path = path
+        self.needed = needed
+        self.available = available
+
+
+def files_signature(files: List[Path]) -> Dict:
+    """Identify a list of input files, to tell whether it changed."""
+    return {
+        "count": len(files),
+        "first": files[0].name if files else None,
+        "last": files[-1].name if files else None,
+        "size": sum(f.stat().st_size for f in files if f.exists()),
+    }
+
+
+def _signature(inputs: Union[List[Path], Dict]) -> Dict:
+    """Inputs may be given as a signature already, from a SegmentIndex."""
+    return inputs if isinstance(inputs, dict) else files_signature(inputs)
+
+
+class MergeCheckpoint:
+    """
+    Stages of a merge completed so far, with the size and duration of their
+    output, so that an interrupted merge can resume from the first stage
+    whose output is missing or does not match anymore.
+    """
+
+    def __init__(self, data_dir: Path) -> None:
+        self.path = data_dir / CHECKPOINT_NAME
+        self.stages: Dict[str, Dict] = self.load()
+        self._lock = threading.Lock()
+
+    def load(self) -> Dict[str, Dict]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as fp:
+                return load(fp)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.error(f"Failed to load merge checkpoint {self.path}: {e}.")
+            return {}
+
+    def save(self) -> None:
+        tmp = self.path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as fp:
+            dump(self.stages, fp, indent=2)
+        tmp.replace(self.path)
+
+    def record(
+        self,
+        stage: str,
+        output: Path,
+        inputs: Union[List[Path], Dict],
+        duration: Optional[float] = None,
+        **extra
+    ) -> None:
+        """Record that stage wrote output from inputs. Extra values are kept
+        in the entry, for the caller to restore when skipping the stage."""
+        entry = {
+            "output": str(output),
+            "size": output.stat().st_size,
+            "duration": duration,
+            "inputs": _signature(inputs),
+            **extra
+        }
+        with self._lock:
+            self.stages[stage] = entry
+            self.save()
+
+    def record_failure(
+        self, stage: str, inputs: Union[List[Path], Dict]
+    ) -> None:
+        with self._lock:
+            self.stages[stage] = {
+                "failed": True, "inputs": _signature(inputs)}
+            self.save()
+
+    def failed(self, stage: str, inputs: Union[List[Path], Dict]) -> bool:
+        entry = self.stages.get(stage)
+        return entry is not None and entry.get("failed", False) \
+            and entry["inputs"] == _signature(inputs)
+
+    def done(
+        self, stage: str, output: Path, inputs: Union[List[Path], Dict]
+    ) -> Optional[Dict]:
+        """
+        Return the entry of stage if it was completed from the same inputs,
+        and its output is still there with the recorded size and duration.
+        """
+        entry = self.stages.get(stage)
+        if entry is None or entry.get("failed"):
+            return None
+        if entry["output"] != str(output) or not output.is_file() \
+        or output.stat().st_size != entry["size"] \
+        or entry["inputs"] != _signature(inputs):
+            logger.info("Output of merge stage %s changed. Redoing it.", stage)
+            return None
+        if entry["duration"] is not None:
+            duration = probe(output).get("duration", 0.0)
+            if abs(duration - entry["duration"]) > 1:
+                logger.info(
+                    "Duration of %s changed from %s to %s. Redoing stage %s.",
+                    output.name, entry["duration"], duration, stage)
+                return None
+        logger.info(
+            "Skipping merge stage %s, %s was completed by a previous run.",
+            stage, output.name)
+        return entry
+
+    def clear(self) -> None:
+        with self._lock:
+            self.stages = {}
+            self.path.unlink(missing_ok=True)
+
 
 def segname_to_int(path: Path) -> int:
     return int(path.stem[:-6])
 
 
+# Patterns looked for in ffmpeg output, and the error they indicate.
+# Something might be wrong? Those might just be harmless warning?
+# "Found duplicated MOOV Atom. Skipped it", "Failed to add index entry"
+FFMPEG_ERRORS = {
+    # These are usually fatal, we should remove the corrup segments, then retry:
+    "Packet corrupt": CorruptPacketError,
+    # This error seems to happen when concatenating mpegts
+    "Non-monotonous DTS": NonMonotonousDTSError,
+}
+
+
+def run_streaming(
+    cmd: List[str],
+    patterns: Iterable[str] = FFMPEG_ERRORS,
+    expected_duration: Optional[float] = None
+) -> ffmpeg_runner.RunResult:
+    """Run an ffmpeg command through ffmpeg_runner, logging its progress."""
+    result = ffmpeg_runner.run(
+        cmd,
+        patterns=patterns,
+        on_progress=ffmpeg_runner.ProgressLogger(
+            logger, Path(cmd[-1]).name),  # type: ignore
+        expected_duration=expected_duration
+    )
+    logger.debug(
+        "%s took %.1fs at %.1fx speed, last %s of %s stderr lines:\n%s",
+        result.args, result.elapsed, result.progress.speed,
+        len(result.tail), result.lines, result.stderr)
+    return result
+
+
+def run_ffmpeg(cmd: List[str], expected_duration: Optional[float] = None) -> None:
+    """Run an ffmpeg command, raising if its output reports broken packets."""
+    try:
+        result = run_streaming(cmd, expected_duration=expected_duration)
+    except subprocess.CalledProcessError as e:
+        logger.exception(
+            f"{e.cmd} returned error {e.returncode}. "
+            f"STDERR:\n{e.stderr}")
+        raise
+    except FileNotFoundError as e:
+        logger.error(f"Failed to run ffmpeg: {e}.")
+        raise
+
+    check_ffmpeg_output(result.matches)
+
+
+def check_ffmpeg_output(matches: Dict[str, int]) -> None:
+    """Raise if ffmpeg reported broken packets in its output, given how many
+    lines matched each of FFMPEG_ERRORS."""
+    for pattern, error in FFMPEG_ERRORS.items():
+        if matches.get(pattern):
+            raise error(f"{pattern} detected {matches[pattern]} times!")
+
+
 class ConcatMethod():
     def __init__(
         self, segment_list: List[Path],
@@ -54,13 +265,24 @@ class ConcatMethod():
         video_id: str,
         output_dir: Path,
         missing_ints: List = [],
-        corrupt_segs: Optional[List] = None
+        corrupt_segs: Optional[List] = None,
+        sidecar: Optional[SegmentSidecar] = None,
+        checkpoint: Optional[MergeCheckpoint] = None
     ) -> None:
         self.datatype = datatype
+        self.checkpoint = checkpoint
         self.segment_list = segment_list
+        self.sidecar = sidecar
+        self._suspects: List[Path] = []
+        # Muxed segments are recorded as video
+        self.track = "audio" if segment_list \
+            and segment_list[0].stem.endswith("_audio") else "video"
         self._missing_seg_ints = missing_ints
         self._corrupt_segments = corrupt_segs
         self._segment_duration = None
+        self._duration_table: Optional[DurationTable] = None
+        # First and last segment numbers, and the duration expected from them
+        self._expected_duration: Optional[tuple[int, int, float]] = None
         self.error = None
         self.video_id = video_id
         self.output_dir = output_dir
@@ -83,40 +305,29 @@ class ConcatMethod():
             f"{video_id}_{datatype}_ffmpeg.{ext}"
 
     def run_ffmpeg(self, cmd):
-        cproc = None
-        try:
-            cproc = subprocess.run(
-                cmd,
-                check=True,
-                capture_output=True,
-                text=True)
-            logger.debug("%s stderr output:\n%s", cproc.args, cproc.stderr)
-        except subprocess.CalledProcessError as e:
-            logger.exception(
-                f"{e.cmd} returned error {e.returncode}. "
-                f"STDERR:\n{e.stderr}")
-            raise
-        except FileNotFoundError as e:
-            logger.error(f"Failed to run ffmpeg: {e}.")
-            raise
-
-        # Something might be wrong? Those might just be harmless warning?
-        # if cproc is not None\
-        # and ("Found duplicated MOOV Atom. Skipped it" in cproc.stderr
-        #     or "Failed to add index entry" in cproc.stderr):
-
-        # These are usually fatal, we should remove the corrup segments, then retry:
-        if cproc is not None and "Packet corrupt" in cproc.stderr:
-            raise CorruptPacketError("Corrupt packet detected!")
-
-        if cproc is not None and "Non-monotonous DTS" in cproc.stderr:
-            # This error seems to happen when concatenating mpegts
-            raise NonMonotonousDTSError("Non-monotonous DTS detected!")
+        run_ffmpeg(cmd, expected_duration=self.total_expected_duration)
+
+    @property
+    def duration_table(self) -> Optional[DurationTable]:
+        """Durations read from the timestamps of each segment, if these are
+        MPEG-TS. Segments removed from segment_list later on are kept."""
+        if self._duration_table is None:
+            self._duration_table = DurationTable.from_segments(
+                self.segment_list, list(path_list_to_int(self.segment_list)))
+        return self._duration_table
 
     @property
     def segment_duration(self) -> float:
         if self._segment_duration is not None:
             return self._segment_duration
+        if self.sidecar is not None \
+        and (dur := self.sidecar.median_duration(self.track)) is not None:
+            self._segment_duration = dur
+            return dur
+        if (table := self.duration_table) is not None:
+            self._segment_duration = table.median_duration
+            return self._segment_duration
+        # Fallback if segments could not be parsed:
         # FIXME this value is very unpredictable and unreliable, need a better way.
         if segname_to_int(self.segment_list[0]) == 0:
             # Audio has a lower than 1.0 value for some reason, so round up:
@@ -147,6 +358,26 @@ class ConcatMethod():
         #     f"(segments available) {len(self.segment_list)} = {expected}.")
         # return expected
 
+        first = segname_to_int(self.segment_list[0])
+        last = segname_to_int(self.segment_list[-1])
+        # Only changes if the first or last segment were found corrupt, so
+        # that ffprobe is not run again before each ffmpeg run.
+        if self._expected_duration is not None \
+        and self._expected_duration[:2] == (first, last):
+            return self._expected_duration[2]
+        total = self._compute_expected_duration(first, last)
+        self._expected_duration = (first, last, total)
+        return total
+
+    def _compute_expected_duration(self, first: int, last: int) -> float:
+        # Durations from the playlist, recorded at download time
+        if self.sidecar is not None and (
+            total := self.sidecar.total_duration(self.track, first, last)
+        ) is not None:
+            return total
+        if (table := self.duration_table) is not None:
+            if first in table.spans and last in table.spans:
+                return table.total_duration(first, last)
         return round(probe(self.segment_list[-1]).get("duration", 0.0))
 
     def exists(self):
@@ -173,7 +404,9 @@ class ConcatMethod():
     def corrupt_segments(self) -> List[Path]:
         if self._corrupt_segments is not None:
             return self._corrupt_segments
-        self._corrupt_segments = get_corrupt(self.segment_list)
+        if self.sidecar is not None:
+            self._suspects = self.sidecar.suspects(self.segment_list, self.track)
+        self._corrupt_segments = get_corrupt(self.segment_list, self._suspects)
         return self._corrupt_segments
 
     def is_valid_duration(self, filepath: Path, duration: float) -> bool:
@@ -258,7 +491,7 @@ class ConcatDemuxer(ConcatMethod):
             corrupt = self.corrupt_segments
             if corrupt:
                 # Doing f for f in segment_list if f not in corrupt
-                corrupt_ints = list(path_list_to_int(corrupt))
+                corrupt_ints = set(path_list_to_int(corrupt))
                 self.segment_list = list(
                     filter(lambda f: segname_to_int(f) not in corrupt_ints,
                     self.segment_list))
@@ -317,6 +550,19 @@ class NativeConcatFile(ConcatMethod):
             f"{self.video_id}_{self.datatype}_{self.__class__.__name__}.ts"
 
     def make(self, overwrite=False):
+        stage = f"track_{self.track}"
+        inputs = list(self.segment_list)
+        if not overwrite and self.checkpoint is not None and (
+            done := self.checkpoint.done(stage, self._final_file, inputs)
+        ) is not None:
+            # Restore what the previous run found out
+            corrupt = set(done.get("corrupt", []))
+            self._corrupt_segments = [f for f in inputs if f.name in corrupt]
+            self.segment_list = [f for f in inputs if f.name not in corrupt]
+            if done.get("error"):
+                self.error = done["error"]
+            return
+
         self.native_concat(overwrite=overwrite)
         # cmd = self.setup_ts_command() # First pass as .ts temporary file
         cmd = self.setup_command()
@@ -339,25 +585,19 @@ class NativeConcatFile(ConcatMethod):
                 "We encountered corrupt packets during first muxing.")
             corrupt = self.corrupt_segments
             if corrupt:
-                # Recreate the list of segments minus the corrupted ones
-                # f for f in segment_list if f not in corrupt
-                corrupt_ints = list(path_list_to_int(corrupt))
-                self.segment_list = list(
-                    filter(lambda f: segname_to_int(f) not in corrupt_ints,
-                    self.segment_list))
-                self.native_concat(overwrite=True)
-
-                # cmd = self.setup_ts_command()
-                # logger.info("Fixing mpeg-ts container with ffmpeg...")
-                # self.run_ffmpeg(cmd)
-
-                cmd = self.setup_command()
-                logger.info("Re-Muxing %s track file...", self.datatype)
-                self.run_ffmpeg(cmd)
-
-                duration = probe(self._final_file).get("duration", 0.0)
-                if not self.is_valid_duration(self._final_file, duration):
-                    raise DurationMismatchError()
+                try:
+                    self.remux_without(corrupt)
+                except CorruptPacketError:
+                    if not set(corrupt) <= set(self._suspects):
+                        raise
+                    # Only suspects were scanned, others might be corrupt too
+                    logger.warning(
+                        "Still got corrupt packets. Scanning all segments...")
+                    more = get_corrupt(self.segment_list)
+                    if not more:
+                        raise
+                    self._corrupt_segments = corrupt + more
+                    self.remux_without(more)
             elif not self._final_file.exists():
                 # no corrupt packet, but something else is wrong.
                 raise
@@ -379,16 +619,49 @@ class NativeConcatFile(ConcatMethod):
                 self.temp_concat.unlink()
 
         logger.info("Successfully wrote %s.", self.name)
+        if self.checkpoint is not None and self.exists():
+            self.checkpoint.record(
+                stage, self._final_file, inputs,
+                duration=probe(self._final_file).get("duration", 0.0),
+                corrupt=[f.name for f in self._corrupt_segments or []],
+                error=str(self.error) if self.error is not None else None)
+
+    def remux_without(self, corrupt: List[Path]) -> None:
+        # Recreate the list of segments minus the corrupted ones
+        # f for f in segment_list if f not in corrupt
+        corrupt_ints = set(path_list_to_int(corrupt))
+        self.segment_list = list(
+            filter(lambda f: segname_to_int(f) not in corrupt_ints,
+            self.segment_list))
+        self.native_concat(overwrite=True)
+
+        # cmd = self.setup_ts_command()
+        # logger.info("Fixing mpeg-ts container with ffmpeg...")
+        # self.run_ffmpeg(cmd)
+
+        cmd = self.setup_command()
+        logger.info("Re-Muxing %s track file...", self.datatype)
+        self.run_ffmpeg(cmd)
+
+        duration = probe(self._final_file).get("duration", 0.0)
+        if not self.is_valid_duration(self._final_file, duration):
+            raise DurationMismatchError()
 
     def native_concat(self, overwrite=False) -> Optional[Path]:
         """Concatenate into a broken container that needs to be fixed by ffmpeg."""
         # TODO write this into a fifo/pipe and call ffmpeg on it in parallel?
+        stage = f"concat_{self.track}"
+        if self.checkpoint is not None and not overwrite \
+        and self.temp_concat.exists():
+            # Left over by an interrupted run, maybe only partially written
+            overwrite = self.checkpoint.done(
+                stage, self.temp_concat, self.segment_list) is None
         if not self.temp_concat.exists() or overwrite:
             logger.debug("Writing native concat file %s ...", self.temp_concat.name)
-            with open(self.temp_concat, "wb") as f:
-                for i in self.segment_list:
-                    with open(i, "rb") as ff:
-                        copyfileobj(ff, f)
+            used = concat_files(self.segment_list, self.temp_concat)
+            logger.debug("Concat backends used: %s", used)
+            if self.checkpoint is not None:
+                self.checkpoint.record(stage, self.temp_concat, self.segment_list)
         if self.temp_concat.exists():
             return self.temp_concat
         return None
@@ -459,34 +732,81 @@ def probe(fpath: Path) -> Dict:
     return values
 
 
+def probe_streams(fpath: Path) -> List[Dict]:
+    """Like probe(), but return the values of each stream separately."""
+    probecmd = ['ffprobe', '-v', 'quiet', '-hide_banner',
+                '-show_streams', str(fpath)]
+    try:
+        probeproc = subprocess.run(probecmd, capture_output=True, text=True)
+    except FileNotFoundError as e:
+        logger.error(f"Failed to use ffprobe: {e}.")
+        return []
+
+    streams: List[Dict] = []
+    for line in probeproc.stdout.split("\n"):
+        if line == "[STREAM]":
+            streams.append({})
+            continue
+        if not streams or "=" not in line:
+            continue
+        key, val = line.split("=", 1)
+        if key in ("duration", "start_time"):
+            streams[-1][key] = float(val) if val != "N/A" else 0.0
+        elif key in ("codec_name", "codec_type"):
+            streams[-1][key] = val if val != "N/A" else None
+        elif key == "DISPOSITION:attached_pic":
+            streams[-1]["attached_pic"] = val == "1"
+    return streams
+
+
+def run_concurrently(*funcs: Callable, max_workers: Optional[int] = None) -> List:
+    """
+    Call each function in its own thread and return their results in order.
+    The work is mostly done by ffmpeg processes and file I/O, so threads are
+    enough. Waits for all calls to finish before raising any exception.
+    At most max_workers functions run at the same time, all of them if None.
+    """
+    with ThreadPoolExecutor(
+        max_workers=min(max_workers or len(funcs), len(funcs)),
+        thread_name_prefix="merge"
+    ) as pool:
+        # Each thread gets a copy of the context to log to the same logger
+        futures = [pool.submit(copy_context().run, func) for func in funcs]
+        wait(futures)
+    return [future.result() for future in futures]
+
+
 def path_list_to_int(seg_list: List[Path]) -> Iterator[int]:
     # remove the "_audio/_video" part
     return (int(i.stem[:-6]) for i in seg_list)
 
 
-def merge(
-    info: Dict,
-    data_dir: Path,
-    output_dir: Optional[Path] = None,
-    keep_concat: bool = False,
-    delete_source: bool = False
-) -> Optional[Path]:
+def compare_tracks(
+    video: SegmentIndex, audio: SegmentIndex
+) -> tuple[List[int], List[int], List[int]]:
     """
-    Merge the video and audio segments into a single file.
+    Compare the segment numbers of both tracks. Return the numbers of
+    segments missing from either track, from the video track only and from
+    the audio track only, in ascending order.
     """
-    if not output_dir:
-        output_dir = data_dir
+    video_ints = video.numbers()
+    audio_ints = audio.numbers()
+    missing_audio_ints = [i for i in video.seqs if i not in audio_ints]
+    missing_video_ints = [i for i in audio.seqs if i not in video_ints]
+    affected_segs = sorted(missing_video_ints + missing_audio_ints)
+    return affected_segs, missing_video_ints, missing_audio_ints
 
-    if not data_dir or not data_dir.exists():
-        # logger.critical(f"Data directory \"{data_dir}\" not found.")
-        return None
 
+def init_merge(info: Dict, data_dir: Path) -> None:
+    """
+    Make helper functions log to the logger of the stream in the current
+    context, and check that ffmpeg is available.
+    """
     # Reuse the logging handlers from the download module if possible
     # to centralize logs pertaining to stream video handling
-    global logger
-    logger = logging.getLogger("download" + "." + info.get('id', "_"))
-    if not logger.hasHandlers():
-        logger.setLevel(logging.DEBUG)
+    merge_logger = logging.getLogger("download" + "." + info.get('id', "_"))
+    if not merge_logger.hasHandlers():
+        merge_logger.setLevel(logging.DEBUG)
         # File output
         logfile = logging.FileHandler(\
             filename=data_dir / "download.log", delay=True, encoding='utf-8')
@@ -494,63 +814,185 @@ def merge(
         formatter = logging.Formatter(\
             '%(asctime)s - %(levelname)s - %(name)s - %(message)s')
         logfile.setFormatter(formatter)
-        logger.addHandler(logfile)
+        merge_logger.addHandler(logfile)
 
         # Console output
         conhandler = logging.StreamHandler()
         conhandler.setLevel(logging.DEBUG)
         conhandler.setFormatter(formatter)
-        logger.addHandler(conhandler)
+        merge_logger.addHandler(conhandler)
+    _current_logger.set(merge_logger)
 
     if not which("ffmpeg") or not which("ffprobe"):
         raise Exception(
             "Could not find ffmpeg or ffprobe! Make sure it is installed and "
             "discoverable from your PATH environment variable.")
 
+
+def source_size(data_dir: Path) -> int:
+    """Total size of the segments and chunk files of a download."""
+    total = 0
+    for sub_dir in ("vid", "aud", CHUNK_DIR):
+        try:
+            with os.scandir(data_dir / sub_dir) as entries:
+                total += sum(
+                    entry.stat().st_size for entry in entries
+                    if entry.name.endswith(".ts") and entry.is_file())
+        except FileNotFoundError:
+            continue
+    return total
+
+
+def estimate_space(
+    data_dir: Path,
+    output_dir: Path,
+    progressive: bool = False,
+    split: bool = False
+) -> Dict[Path, int]:
+    """
+    Estimate the peak extra space needed to merge, keyed by a path on each
+    filesystem involved.
+    A regular merge writes the concatenated segments of each track, then the
+    final file, or an intermediate file per track first if it falls back to
+    muxing tracks separately. Either way, about twice the size of the sources
+    is needed in output_dir, since sources are only deleted at the end.
+    A progressive merge replaces sources with chunk files range by range,
+    which needs twice the size of a range in data_dir, then joins the chunks
+    into the final file in output_dir.
+    A split merge writes chunk files for every range in data_dir, then the
+    final file or part files in output_dir while the chunks still exist.
+    """
+    total = source_size(data_dir)
+    if split:
+        needs = [(data_dir, total), (output_dir, total)]
+    elif not progressive:
+        needs = [(output_dir, 2 * total)]
+    else:
+        ranges = max(1, math.ceil(total / PROGRESSIVE_RANGE_BYTES))
+        needs = [(data_dir, 2 * total // ranges), (output_dir, total)]
+    peaks: Dict[int, tuple[Path, int]] = {}
+    for path, size in needs:
+        while not path.exists() and path != path.parent:
+            # The output directory may not have been created yet
+            path = path.parent
+        device = path.stat().st_dev
+        if device not in peaks:
+            peaks[device] = (path, size)
+        elif split:
+            # Chunks are kept until the output is written
+            peaks[device] = (peaks[device][0], peaks[device][1] + size)
+        elif peaks[device][1] < size:
+            # These steps are sequential, so only the largest counts
+            peaks[device] = (path, size)
+    return {path: size + SPACE_MARGIN for path, size in peaks.values()}
+
+
+def check_free_space(
+    data_dir: Path,
+    output_dir: Path,
+    progressive: bool = False,
+    split: bool = False
+) -> None:
+    """Raise InsufficientSpaceError if a merge would run out of space."""
+    for path, needed in estimate_space(
+        data_dir, output_dir, progressive, split
+    ).items():
+        available = disk_usage(path).free
+        logger.debug(
+            "Merge needs about %s MiB in %s, %s MiB available.",
+            needed // 1048576, path, available // 1048576)
+        if available < needed:
+            raise InsufficientSpaceError(path, needed, available)
+
+
+def merge(
+    info: Dict,
+    data_dir: Path,
+    output_dir: Optional[Path] = None,
+    keep_concat: bool = False,
+    delete_source: bool = False,
+    progressive: bool = False
+) -> Optional[Path]:
+    """
+    Merge the video and audio segments into a single file.
+    If progressive and delete_source, source segments are deleted as they
+    are consumed instead of at the end. See progressive_merge().
+    Raise InsufficientSpaceError before doing anything if there is not
+    enough free space to complete the merge.
+    """
+    if not output_dir:
+        output_dir = data_dir
+
+    if not data_dir or not data_dir.exists():
+        # logger.critical(f"Data directory \"{data_dir}\" not found.")
+        return None
+
+    init_merge(info, data_dir)
+
+    if progressive and not delete_source:
+        logger.warning(
+            "Progressive merge has no effect without deleting source files.")
+        progressive = False
+    check_free_space(data_dir, output_dir, progressive)
+
+    if progressive:
+        return progressive_merge(info, data_dir, output_dir, keep_concat)
+
+    if (data_dir / CHUNK_DIR / CHUNK_MANIFEST).exists():
+        logger.info("Found chunks from a rolling merge. Joining them...")
+        return merge_chunks(
+            info, data_dir, output_dir,
+            keep_concat=keep_concat,
+            delete_source=delete_source
+        )
+
     video_seg_dir = data_dir / "vid"
     audio_seg_dir = data_dir / "aud"
 
-    video_files = collect(video_seg_dir)
-    audio_files = collect(audio_seg_dir, warn_missing=False)
+    # Scanned once, everything below works from these
+    video_index = collect_index(video_seg_dir)
+    audio_index = collect_index(audio_seg_dir, warn_missing=False)
 
-    if not video_files and not audio_files:
+    if not video_index and not audio_index:
         raise Exception("Missing video or audio segment source files!")
 
-    muxed_only = bool(video_files and not audio_files)
+    # Written during download, if the downloader was recent enough
+    sidecar = SegmentSidecar.load(data_dir)
+
+    muxed_only = bool(video_index and not audio_index)
 
     # Various checks on source segments to detect any missing:
     segment_number_mismatch = False
-    if not muxed_only and len(video_files) != len(audio_files):
+    if not muxed_only and len(video_index) != len(audio_index):
         logger.warning(
             "Number of audio and video segments do not match! "
-            f"{len(video_files)} video segments, {len(audio_files)} audio segments."
+            f"{len(video_index)} video segments, {len(audio_index)} audio segments."
         )
         segment_number_mismatch = True
 
     # FIXME this is redundant with checks below
-    missing_video_paths = print_missing_segments(video_files, "_video")
-    missing_audio_paths = [] if muxed_only else print_missing_segments(audio_files, "_audio")
+    missing_video_paths = print_missing_segments(video_index, "_video")
+    missing_audio_paths = [] if muxed_only else print_missing_segments(audio_index, "_audio")
     if missing_video_paths or missing_audio_paths:
         segment_number_mismatch = True
         logger.warning(f"Some segments appear to be missing!")
+    if sidecar is not None:
+        for track in ("video", "audio"):
+            if never_written := sidecar.missing(track):
+                segment_number_mismatch = True
+                logger.warning(
+                    "Segment index reports %s %s segments never written "
+                    "during download: %s",
+                    len(never_written), track, never_written)
 
     # Compare each track with the other for missing segments:
     missing_video_ints = []
     missing_audio_ints = []
-    video_as_int = list(path_list_to_int(video_files))
-    audio_as_int = [] if muxed_only else list(path_list_to_int(audio_files))
-    seg_list_as_ints = video_as_int + audio_as_int
-
     if muxed_only:
-        affected_segs = []
         logger.info("Detected a single muxed segment track. Skipping A/V parity checks.")
     else:
-        affected_segs = [
-            i for i in seg_list_as_ints
-            if i not in video_as_int or i not in audio_as_int
-        ]
-        missing_audio_ints = [i for i in video_as_int if i not in audio_as_int]
-        missing_video_ints = [i for i in audio_as_int if i not in video_as_int]
+        affected_segs, missing_video_ints, missing_audio_ints = compare_tracks(
+            video_index, audio_index)
         if affected_segs:
             logger.warning(
                 "Some segments appear to be missing! "
@@ -559,22 +1001,75 @@ def merge(
                 f" Missing audio segments: {missing_audio_ints}")
         else:
             logger.info("No missing segment detected. All good.")
-    del video_as_int
-    del audio_as_int
-    del seg_list_as_ints
-    del affected_segs
-
-    # Determine codec from one file
-    vid_props = probe(video_files[0])
-    aud_props = {} if muxed_only else probe(audio_files[0])
+        del affected_segs
 
     # We could either remove to balance both lists, or fill in. Removing
     # is probably better here, especially regarding audio.
-    video_files = list(filter(
-        lambda f: segname_to_int(f) not in missing_video_ints, video_files))
+    video_index = video_index.without(set(missing_video_ints))
+    if not muxed_only:
+        audio_index = audio_index.without(set(missing_audio_ints))
+    video_files = video_index.paths()
+    audio_files = audio_index.paths()
+
+    # Determine codec from one file
+    if muxed_only:
+        vid_props, aud_props = probe(video_files[0]), {}
+    else:
+        vid_props, aud_props = run_concurrently(
+            lambda: probe(video_files[0]), lambda: probe(audio_files[0]))
+
+    final_output_file = get_final_output_path(info, output_dir)
+
+    # Resume from the stages completed by a previous run, if any
+    checkpoint = MergeCheckpoint(data_dir)
+    sources = combined_signature(video_index, audio_index)
+
+    # Try to write the final file directly from the raw concatenated streams,
+    # which avoids rewriting each track into an intermediary file first.
+    tracks = [NativeConcatFile(
+        video_files, vid_props.get("codec_name", "video"),
+        info.get("id", "UNKNOWN_ID"), output_dir, missing_video_ints,
+        sidecar=sidecar, checkpoint=checkpoint)]
     if not muxed_only:
-        audio_files = list(filter(
-            lambda f: segname_to_int(f) not in missing_audio_ints, audio_files))
+        tracks.append(NativeConcatFile(
+            audio_files, aud_props.get("codec_name", "audio"),
+            info.get("id", "UNKNOWN_ID"), output_dir, missing_audio_ints,
+            sidecar=sidecar, checkpoint=checkpoint))
+
+    if (done := checkpoint.done("final", final_output_file, sources)) is not None:
+        return finish_merge(
+            data_dir, final_output_file, tracks, checkpoint,
+            keep_concat, delete_source, done.get("problem"))
+
+    if checkpoint.failed("single_pass", sources):
+        logger.info(
+            "Single pass muxing failed during a previous run. "
+            "Muxing each track separately first.")
+    else:
+        try:
+            concats_have_different_durations = single_pass_mux(
+                tracks, info, data_dir, final_output_file)
+        except (
+            CorruptPacketError, NonMonotonousDTSError, DurationMismatchError, MuxError
+        ) as e:
+            logger.warning(
+                "Single pass muxing failed: %s "
+                "Falling back to muxing each track separately first.", e)
+            final_output_file.unlink(missing_ok=True)
+            checkpoint.record_failure("single_pass", sources)
+        else:
+            problem = None
+            if segment_number_mismatch:
+                problem = "Some segments are missing."
+            elif concats_have_different_durations:
+                problem = "There was a track duration mismatch."
+            checkpoint.record(
+                "final", final_output_file, sources,
+                duration=probe(final_output_file).get("duration", 0.0),
+                problem=problem)
+            return finish_merge(
+                data_dir, final_output_file, tracks, checkpoint,
+                keep_concat, delete_source, problem)
 
     # There is only one method that works currently
     methods = (NativeConcatFile,)
@@ -590,8 +1085,19 @@ def merge(
             concat_video_file = methods[attempt](
                 video_files, vid_props.get("codec_name", "video"),
                 info.get("id", "UNKNOWN_ID"), output_dir,
-                missing_video_ints, corrupt_vid_segs)
-            concat_video_file.make()
+                missing_video_ints, corrupt_vid_segs, sidecar=sidecar,
+                checkpoint=checkpoint)
+            if muxed_only:
+                concat_video_file.make()
+            else:
+                concat_audio_file = methods[attempt](
+                    audio_files, aud_props.get("codec_name", "audio"),
+                    info.get("id", "UNKNOWN_ID"), output_dir,
+                    missing_audio_ints, corrupt_aud_segs, sidecar=sidecar,
+                    checkpoint=checkpoint)
+                # Both tracks are independent until the final mux.
+                run_concurrently(concat_video_file.make, concat_audio_file.make)
+
             if concat_video_file.error is not None:
                 got_errors = True
 
@@ -610,12 +1116,7 @@ def merge(
                 # audio_files = list(filter(
                 #    lambda f: segname_to_int(f) not in new_missing, audio_files))
 
-            if not muxed_only:
-                concat_audio_file = methods[attempt](
-                    audio_files, aud_props.get("codec_name", "audio"),
-                    info.get("id", "UNKNOWN_ID"), output_dir,
-                    missing_audio_ints, corrupt_aud_segs)
-                concat_audio_file.make()
+            if concat_audio_file is not None:
                 if concat_audio_file.error is not None:
                     got_errors = True
 
@@ -624,7 +1125,7 @@ def merge(
                 # FIXME this is untested! Need some corrupt audio segments.
                 if concat_audio_file._corrupt_segments:
                     corrupt_aud_segs = concat_audio_file._corrupt_segments
-                    new_missing = list(path_list_to_int(corrupt_aud_segs))
+                    new_missing = set(path_list_to_int(corrupt_aud_segs))
                     video_files = list(filter(
                         lambda f: segname_to_int(f) not in new_missing, video_files))
                     concat_video_file.unlink(missing_ok=True)
@@ -652,8 +1153,12 @@ def merge(
 
     # Compare durations of each track:
     concats_have_different_durations = False
-    concat_vid_props = probe(concat_video_file._final_file)
-    concat_aud_props = probe(concat_audio_file._final_file) if concat_audio_file else {}
+    if concat_audio_file:
+        concat_vid_props, concat_aud_props = run_concurrently(
+            lambda: probe(concat_video_file._final_file),
+            lambda: probe(concat_audio_file._final_file))
+    else:
+        concat_vid_props, concat_aud_props = probe(concat_video_file._final_file), {}
     # cast to int to round down
     if muxed_only:
         dur_dirr = 0
@@ -675,6 +1180,149 @@ def merge(
                 "Aborting due to concat files duration difference superior to 2 seconds.")
             return None
 
+    # Final muxing of tracks, plus thumbnail and metadata embedding:
+    inputs = [concat_video_file._final_file]
+    if not muxed_only:
+        inputs.append(concat_audio_file._final_file)
+    if mux_tracks(
+        inputs, info, data_dir, final_output_file,
+        expected_duration=concat_vid_props.get("duration")
+    ) is None:
+        return None
+
+    # TODO check final duration just in case.
+
+    problem = None
+    if segment_number_mismatch:
+        problem = "Some segments are missing."
+    elif concats_have_different_durations:
+        problem = "There was a track duration mismatch."
+    elif corrupt_aud_segs or corrupt_vid_segs:
+        problem = "Some segments were corrupted!"
+    elif attempt > 0:
+        problem = "A concat method failed."
+    elif got_errors:
+        problem = "We got suspicious errors while concatenating."
+    checkpoint.record(
+        "final", final_output_file, sources,
+        duration=probe(final_output_file).get("duration", 0.0),
+        problem=problem)
+    return finish_merge(
+        data_dir, final_output_file,
+        [f for f in (concat_video_file, concat_audio_file) if f is not None],
+        checkpoint, keep_concat, delete_source, problem)
+
+
+def finish_merge(
+    data_dir: Path,
+    final_output_file: Path,
+    tracks: List[ConcatMethod],
+    checkpoint: MergeCheckpoint,
+    keep_concat: bool,
+    delete_source: bool,
+    problem: Optional[str]
+) -> Path:
+    """
+    Clean up once the final file has been written: remove the temporary
+    files of each track and the checkpoint, then the source segments unless
+    a problem was noticed.
+    """
+    logger.info('Successfully wrote file "%s".', final_output_file.name)
+    rename_thumbnail(data_dir, final_output_file)
+
+    if not keep_concat:
+        for track in tracks:
+            temp_files = [track._final_file]
+            if isinstance(track, NativeConcatFile):
+                temp_files.append(track.temp_concat)
+            for temp_file in temp_files:
+                if temp_file.exists():
+                    logger.info("Removing temporary file %s", temp_file.name)
+                    temp_file.unlink()
+        checkpoint.clear()
+
+    if delete_source:
+        delete_segments(data_dir / "vid", data_dir / "aud", problem)
+    return final_output_file
+
+
+def delete_segments(
+    video_seg_dir: Path, audio_seg_dir: Path, problem: Optional[str] = None
+) -> None:
+    """Remove source segment directories, unless a problem was noticed."""
+    if problem is not None:
+        logger.warning("%s Not deleting source segments.", problem)
+        return
+    if audio_seg_dir.exists():
+        logger.info(
+            "Deleting source segments in %s and %s...",
+            video_seg_dir, audio_seg_dir
+        )
+        rmtree(audio_seg_dir)
+    else:
+        logger.info("Deleting source segments in %s...", video_seg_dir)
+    rmtree(video_seg_dir)
+    # Would only refer to the deleted segments
+    (video_seg_dir.parent / LIVE_PLAYLIST).unlink(missing_ok=True)
+
+
+def single_pass_mux(
+    tracks: List["NativeConcatFile"],
+    info: Dict,
+    data_dir: Path,
+    final_output_file: Path
+) -> bool:
+    """
+    Mux the raw concatenated segments of each track, metadata and thumbnail
+    into the final file with a single ffmpeg pass. Raise if ffmpeg reports
+    broken packets or if durations look wrong, so that the caller can fall
+    back to remuxing each track separately first.
+    The raw concat files are left in place to be reused in that case.
+    Return whether track durations differ by more than a second.
+    """
+    run_concurrently(*(track.native_concat for track in tracks))
+    logger.info(
+        "Muxing %s into %s in a single pass...",
+        ", ".join(track.temp_concat.name for track in tracks),
+        final_output_file.name)
+    if mux_tracks(
+        [track.temp_concat for track in tracks],
+        info, data_dir, final_output_file, strict=True,
+        expected_duration=tracks[0].total_expected_duration
+    ) is None:
+        raise MuxError("Failed to write the final file.")
+
+    # Muxed streams hold both video and audio in the first track
+    durations: Dict[str, float] = {}
+    for stream in probe_streams(final_output_file):
+        if stream.get("attached_pic"):
+            continue
+        durations.setdefault(stream.get("codec_type"), stream.get("duration", 0.0))
+    for track, codec_type in zip(tracks, ("video", "audio")):
+        if codec_type not in durations:
+            raise DurationMismatchError(
+                f"Missing {codec_type} track in the final file.")
+        if not track.is_valid_duration(final_output_file, durations[codec_type]):
+            raise DurationMismatchError(
+                f"Invalid {codec_type} track duration {durations[codec_type]}.")
+    if len(durations) < 2:
+        return False
+
+    dur_diff = abs(
+        round(durations["video"]) - round(durations.get("audio", 0.0)))
+    if dur_diff > 2:
+        raise DurationMismatchError(
+            f"Track duration difference of {dur_diff} seconds.")
+    if dur_diff > 1:
+        logger.warning(
+            "Track duration mismatch: Audio duration %s, Video duration %s.",
+            durations.get("audio"), durations["video"])
+        return True
+    return False
+
+
+def get_final_output_path(info: Dict, output_dir: Path) -> Path:
+    """Return the path of the final merged file described by info."""
     ext = "mp4"
     # Seems like an MP4 container can handle vp9 just fine. Perhaps we don't
     # really need MKV (which doesn't support embedded thumbnails yet anyway).
@@ -693,21 +1341,32 @@ def merge(
             f"[{info.get('id')}]"
             f".{ext}"
         )
+    return output_dir / final_output_name
 
-    final_output_file = output_dir / final_output_name
 
-    # Final muxing of tracks, plus thumbnail and metadata embedding:
+def mux_tracks(
+    inputs: List,
+    info: Dict,
+    data_dir: Path,
+    final_output_file: Path,
+    strict: bool = False,
+    expected_duration: Optional[float] = None
+) -> Optional[Path]:
+    """
+    Mux each input (file path or ffmpeg protocol URL) into final_output_file
+    with stream copy, embedding metadata and the thumbnail if there is one.
+    If strict, raise like run_ffmpeg() if ffmpeg reported broken packets.
+    expected_duration is only used to report progress.
+    """
     try_thumb = True
     while True:
-        ffmpeg_command = ["ffmpeg", "-hide_banner", "-y", "-i", str(concat_video_file)]
-        input_count = 1
-        if not muxed_only:
-            ffmpeg_command.extend(["-i", str(concat_audio_file)])
-            input_count = 2
+        ffmpeg_command = ["ffmpeg", "-hide_banner", "-y"]
+        for _input in inputs:
+            ffmpeg_command.extend(["-i", str(_input)])
         metadata_cmd = metadata_arguments(
             info, data_dir,
             want_thumb=try_thumb,
-            input_count=input_count
+            input_count=len(inputs)
         )
         # ffmpeg -hide_banner -i video.mp4 -i audio.m4a -i thumbnail.jpg -map 0
         # -map 1 -map 2 -c:v:2 jpg -disposition:v:1 attached_pic -c copy out.mp4
@@ -715,14 +1374,10 @@ def merge(
         ffmpeg_command.extend(["-c", "copy", str(final_output_file)])
 
         try:
-            cproc = subprocess.run(
-                ffmpeg_command,
-                check=True,
-                capture_output=True,
-                text=True,
-                encoding="utf-8"
-            )
-            logger.debug("%s stderr output:\n%s", cproc.args, cproc.stderr)
+            result = run_streaming(
+                ffmpeg_command, expected_duration=expected_duration)
+            if strict:
+                check_ffmpeg_output(result.matches)
         except subprocess.CalledProcessError as e:
             logger.debug(
                 "%s return code %s. STDERR:\n%s",
@@ -759,59 +1414,488 @@ def merge(
             "Check for errors in DEBUG log level.")
         final_output_file.unlink()
         return None
+    return final_output_file
 
-    # TODO check final duration just in case.
+
+class RollingMerger:
+    """
+    Remux committed segments into chunk files while the download is still
+    running, so that the final merge only has to join a handful of chunks.
+    Segments strictly below <committed> are assumed to be fully written.
+    """
+
+    def __init__(
+        self,
+        data_dir: Path,
+        video_id: str,
+        interval: float = 10.0,
+        delete_source: bool = False,
+        log: Optional[logging.Logger] = None
+    ) -> None:
+        self.data_dir = data_dir
+        self.video_id = video_id
+        self.interval = interval  # minutes
+        self.delete_source = delete_source
+        self.log = log if log is not None else _current_logger.get()
+        self.chunk_dir = data_dir / CHUNK_DIR
+        self.manifest_path = self.chunk_dir / CHUNK_MANIFEST
+        self.committed = 0
+        self.chunks: List[Dict] = self.load_manifest()
+        # Chunks whose sources are only deleted once the final file is written
+        self.kept_sources: List[tuple[Dict, List[Path]]] = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def next_seq(self) -> int:
+        """First segment number that has not been written to a chunk yet."""
+        if not self.chunks:
+            return 0
+        return self.chunks[-1]["last"] + 1
+
+    def remaining(self) -> List[int]:
+        """Numbers of the segments not written to a chunk yet."""
+        first = self.next_seq
+        return [
+            seg_num for track in ("vid", "aud")
+            for seg_num in SegmentIndex.scan(self.data_dir / track)
+            if seg_num >= first
+        ]
+
+    def load_manifest(self) -> List[Dict]:
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as fp:
+                return load(fp)
+        except FileNotFoundError:
+            return []
+        except Exception as e:
+            self.log.error(f"Failed to load chunk manifest: {e}.")
+            return []
+
+    def write_manifest(self) -> None:
+        tmp = self.manifest_path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as fp:
+            dump(self.chunks, fp, indent=2)
+        tmp.replace(self.manifest_path)
+
+    def start(self) -> None:
+        self.chunk_dir.mkdir(exist_ok=True)
+        self._thread = threading.Thread(
+            target=self._run,
+            name=f"rolling_merge_{self.video_id}",
+            daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        # Helper functions log to the logger of the current context
+        _current_logger.set(self.log)
+        while not self._stop.wait(self.interval * 60):
+            try:
+                self.roll()
+            except Exception as e:
+                self.log.exception(f"Rolling merge failed: {e}")
+
+    def pending(self, upto: int) -> tuple[List[Path], List[Path], bool]:
+        """Return the segments between next_seq and upto, like segments()."""
+        # Live streams may not start at sequence number 0
+        return self.segments(self.next_seq, upto, from_first=not self.chunks)
+
+    def segments(
+        self, first: int, upto: int, from_first: bool = False
+    ) -> tuple[List[Path], List[Path], bool]:
+        """
+        Return the video and audio segments between first and upto
+        (excluded), minus those missing their counterpart in the other track,
+        and whether any segment was missing from the range. If from_first,
+        the range starts at the first segment found instead.
+        """
+        video = SegmentIndex.scan(self.data_dir / "vid").between(first, upto)
+        if not video:
+            return [], [], False
+        if from_first:
+            first = video.first
+        if not (self.data_dir / "aud").exists():
+            # Muxed stream, video segments also hold the audio track
+            return video.paths(), [], len(video) != (upto - first)
+
+        audio = SegmentIndex.scan(self.data_dir / "aud").between(first, upto)
+        video_ints = video.numbers()
+        audio_ints = audio.numbers()
+        common = video_ints & audio_ints
+        missing = len(common) != (upto - first) \
+            or len(common) != len(video_ints | audio_ints)
+        return video.only(common).paths(), audio.only(common).paths(), missing
+
+    def roll(
+        self, upto: Optional[int] = None, keep_sources: bool = False
+    ) -> Optional[Dict]:
+        """
+        Write all pending segments below upto into a new chunk per track.
+        If keep_sources, the source segments of the chunk are not deleted,
+        but recorded in kept_sources for cleanup_chunks() to delete.
+        """
+        with self._lock:
+            if upto is None:
+                upto = self.committed
+            if upto <= self.next_seq:
+                return None
+            result = self.write_range(
+                self.next_seq, upto, from_first=not self.chunks)
+            if result is None:
+                return None
+            entry, sources = result
+            self.chunks.append(entry)
+            self.write_manifest()
+            if keep_sources:
+                self.kept_sources.append((entry, sources))
+            else:
+                self.delete_sources(entry, sources)
+            return entry
+
+    def write_range(
+        self, first: int, upto: int, from_first: bool = False
+    ) -> Optional[tuple[Dict, List[Path]]]:
+        """
+        Write the segments between first and upto (excluded) into a chunk
+        file per track. Return the manifest entry of the chunk and the source
+        segments it holds, or None if there is no segment in that range.
+        The manifest itself is left to the caller.
+        """
+        self.chunk_dir.mkdir(exist_ok=True)
+        video_files, audio_files, missing = self.segments(
+            first, upto, from_first)
+        if not video_files:
+            return None
+
+        last = upto - 1
+        entry = {
+            "first": first,
+            "last": last,
+            "segments": len(video_files),
+            "video": None,
+            "audio": None,
+            "corrupt": [],
+            "clean": not missing,
+        }
+        self.log.info(
+            "Remuxing segments %s to %s into chunk files...",
+            first, last)
+
+        if audio_files:
+            chunk, corrupt = self.write_chunk(audio_files, first, last, "audio")
+            entry["audio"] = chunk.name
+            entry["corrupt"].extend(corrupt)
+            # Like in merge(), also drop the video segments that
+            # correspond to corrupt audio segments.
+            video_files = [
+                f for f in video_files if segname_to_int(f) not in corrupt]
+        chunk, corrupt = self.write_chunk(video_files, first, last, "video")
+        entry["video"] = chunk.name
+        entry["corrupt"].extend(corrupt)
+        if entry["corrupt"]:
+            entry["clean"] = False
+
+        return entry, video_files + audio_files
+
+    def delete_sources(self, entry: Dict, sources: List[Path]) -> None:
+        """Remove the source segments of a chunk, if delete_source is set and
+        none was missing or corrupted. Only call once the manifest is saved."""
+        if not self.delete_source:
+            return
+        if entry["clean"]:
+            for f in sources:
+                f.unlink(missing_ok=True)
+        else:
+            self.log.warning(
+                "Segments %s to %s were missing or corrupted. "
+                "Not deleting their source segments.",
+                entry["first"], entry["last"])
+
+    def write_chunk(
+        self,
+        segment_list: List[Path],
+        first: int,
+        last: int,
+        track: str
+    ) -> tuple[Path, List[int]]:
+        """Remux segments into one chunk file, excluding corrupt segments.
+        Return the chunk path and the numbers of the segments left out."""
+        chunk = self.chunk_dir / f"{first:0{10}}-{last:0{10}}_{track}.ts"
+        temp_concat = chunk.with_suffix(".concat")
+        corrupt_ints: List[int] = []
+        try:
+            for _ in range(2):
+                concat_files(segment_list, temp_concat)
+                # Keep the original timestamps so that chunks can be joined
+                # back together by simple concatenation.
+                cmd = ["ffmpeg", "-hide_banner", "-y",
+                       "-i", str(temp_concat),
+                       "-map", "0",
+                       "-c", "copy",
+                       "-copyts",
+                       "-f", "mpegts",
+                       str(chunk)]
+                try:
+                    run_ffmpeg(cmd)
+                    break
+                except CorruptPacketError:
+                    if corrupt_ints:
+                        # Already removed the corrupt segments once.
+                        break
+                    corrupt = get_corrupt(segment_list)
+                    if not corrupt:
+                        break
+                    corrupt_ints = list(path_list_to_int(corrupt))
+                    segment_list = [
+                        f for f in segment_list
+                        if segname_to_int(f) not in corrupt_ints
+                    ]
+                except NonMonotonousDTSError as e:
+                    self.log.warning(e)
+                    break
+        finally:
+            temp_concat.unlink(missing_ok=True)
+        return chunk, corrupt_ints
+
+    def finalize(self) -> None:
+        """
+        Roll every remaining segment into a last chunk, keeping its sources
+        until the final file has been written from it.
+        """
+        last_seen = -1
+        for track in ("vid", "aud"):
+            if index := SegmentIndex.scan(self.data_dir / track):
+                last_seen = max(last_seen, index.last)
+        self.roll(upto=last_seen + 1, keep_sources=True)
+
+
+def merge_chunks(
+    info: Dict,
+    data_dir: Path,
+    output_dir: Path,
+    keep_concat: bool = False,
+    delete_source: bool = False
+) -> Optional[Path]:
+    """
+    Join the chunk files written by a RollingMerger during the download into
+    the final file, after rolling any segment that was not chunked yet.
+    """
+    merger = RollingMerger(
+        data_dir, info.get("id", "UNKNOWN_ID"), delete_source=delete_source)
+    merger.finalize()
+    if not merger.chunks:
+        raise Exception("Missing chunk files from rolling merge!")
+
+    # The concat protocol reads chunks back to back as a single stream,
+    # which is fine since they are all MPEG-TS with continuous timestamps.
+    inputs = ["concat:" + "|".join(
+        str(merger.chunk_dir / c["video"]) for c in merger.chunks)]
+    if merger.chunks[0]["audio"]:
+        inputs.append("concat:" + "|".join(
+            str(merger.chunk_dir / c["audio"]) for c in merger.chunks))
+
+    final_output_file = get_final_output_path(info, output_dir)
+    logger.info(
+        "Joining %s chunks from rolling merge into %s...",
+        len(merger.chunks), final_output_file.name)
+    if mux_tracks(inputs, info, data_dir, final_output_file) is None:
+        return None
 
     logger.info('Successfully wrote file "%s".', final_output_file.name)
     rename_thumbnail(data_dir, final_output_file)
+    cleanup_chunks(merger, keep_concat, delete_source)
+    return final_output_file
 
+
+def cleanup_chunks(
+    merger: RollingMerger, keep_concat: bool, delete_source: bool
+) -> None:
+    """Remove chunk files and source segments once the final file is written."""
     if not keep_concat:
-        if concat_audio_file:
-            logger.info(
-                "Removing temporary audio/video concatenated files %s and %s",
-                concat_audio_file.name,
-                concat_video_file.name,
-            )
-            concat_audio_file.unlink()
-        else:
-            logger.info(
-                "Removing temporary muxed concatenated file %s",
-                concat_video_file.name,
-            )
-        concat_video_file.unlink()
+        logger.info("Removing temporary chunk files in %s", merger.chunk_dir)
+        rmtree(merger.chunk_dir)
 
     if delete_source:
-        action_msg = "Not deleting source segments."
-        if segment_number_mismatch:
-            logger.warning("Some segments are missing. %s", action_msg)
-        elif concats_have_different_durations:
-            logger.warning(
-                "There was a track duration mismatch. %s", action_msg)
-        elif corrupt_aud_segs or corrupt_vid_segs:
-            logger.warning("Some segments were corrupted! %s", action_msg)
-        elif attempt > 0:
-            logger.warning("A concat method failed. %s", action_msg)
-        elif got_errors:
-            logger.warning("We got suspicious errors while concatenating. %s", action_msg)
+        if all(c["clean"] for c in merger.chunks):
+            logger.info("Deleting source segments in %s...", merger.data_dir)
+            for track in ("vid", "aud"):
+                if (merger.data_dir / track).exists():
+                    rmtree(merger.data_dir / track)
+            (merger.data_dir / LIVE_PLAYLIST).unlink(missing_ok=True)
         else:
-            if muxed_only:
-                logger.info("Deleting source segments in %s...", video_seg_dir)
-            else:
-                logger.info(
-                    "Deleting source segments in %s and %s...",
-                    video_seg_dir, audio_seg_dir
-                )
-            rmtree(video_seg_dir)
-            if audio_seg_dir.exists():
-                rmtree(audio_seg_dir)
+            logger.warning(
+                "Some segments were missing or corrupted. "
+                "Only deleting the source segments of complete chunks.")
+            for entry, sources in merger.kept_sources:
+                merger.delete_sources(entry, sources)
 
-    return final_output_file
+
+def progressive_merge(
+    info: Dict,
+    data_dir: Path,
+    output_dir: Path,
+    keep_concat: bool = False
+) -> Optional[Path]:
+    """
+    Remux segments into chunk files one range at a time, deleting the source
+    segments of each range as soon as its chunk is written, then join the
+    chunks into the final file. Disk usage stays close to the size of the
+    stream, instead of up to three times that size with merge().
+    Ranges with missing or corrupt segments keep their sources.
+    """
+    merger = RollingMerger(
+        data_dir, info.get("id", "UNKNOWN_ID"), delete_source=True)
+    seg_numbers = merger.remaining()
+    if not seg_numbers and not merger.chunks:
+        raise Exception("Missing video or audio segment source files!")
+
+    parts = max(1, math.ceil(source_size(data_dir) / PROGRESSIVE_RANGE_BYTES))
+    ranges = split_ranges(seg_numbers, parts)
+    logger.info(
+        "Merging progressively in %s ranges, deleting source segments "
+        "as they are consumed...", len(ranges))
+    for _, last in ranges:
+        merger.roll(upto=last + 1)
+    return merge_chunks(
+        info, data_dir, output_dir,
+        keep_concat=keep_concat,
+        delete_source=True
+    )
 
 
-def get_corrupt(filelist: List[Path]) -> List[Path]:
+def split_ranges(seg_numbers: List[int], parts: int) -> List[tuple[int, int]]:
+    """
+    Split segment numbers into at most <parts> contiguous (first, last)
+    ranges holding about as many segments each. Together, the ranges cover
+    every number from the first to the last segment, gaps included.
+    """
+    numbers = sorted(set(seg_numbers))
+    if not numbers:
+        return []
+    parts = max(1, min(parts, len(numbers)))
+    starts = [numbers[len(numbers) * i // parts] for i in range(parts)]
+    ends = [start - 1 for start in starts[1:]] + [numbers[-1]]
+    return list(zip(starts, ends))
+
+
+def get_part_output_path(final_output_file: Path, index: int, count: int) -> Path:
+    """Return the path of part <index> (from 1) of <count> of a final file."""
+    width = len(str(count))
+    suffix = f" (part {index:0{width}}-{count}){final_output_file.suffix}"
+    stem = final_output_file.stem
+    # Keep the file name within limits once the part number is added
+    max_stem = MAX_NAME_LEN - len(suffix.encode("utf-8"))
+    if len(stem.encode("utf-8")) > max_stem:
+        stem = simple_truncate(stem, max_stem)
+    return final_output_file.with_name(stem + suffix)
+
+
+def split_merge(
+    info: Dict,
+    data_dir: Path,
+    output_dir: Optional[Path] = None,
+    parts: int = 2,
+    join: bool = True,
+    max_workers: Optional[int] = None,
+    keep_concat: bool = False,
+    delete_source: bool = False
+) -> List[Path]:
+    """
+    Split the segments into <parts> contiguous time ranges and remux each
+    range into chunk files in parallel, using at most max_workers threads.
+    If join, the chunks are then joined into the final file like after a
+    rolling merge. Otherwise, each chunk is muxed into its own part file.
+    Chunks already written by a previous run are reused.
+    Return the paths of the files written.
+    Raise InsufficientSpaceError if there is not enough free space for it.
+    """
+    if not output_dir:
+        output_dir = data_dir
+
+    init_merge(info, data_dir)
+    check_free_space(data_dir, output_dir, split=True)
+
+    merger = RollingMerger(
+        data_dir, info.get("id", "UNKNOWN_ID"), delete_source=delete_source)
+    seg_numbers = merger.remaining()
+    if not seg_numbers and not merger.chunks:
+        raise Exception("Missing video or audio segment source files!")
+
+    ranges = split_ranges(seg_numbers, parts)
+    if ranges:
+        logger.info(
+            "Remuxing segments %s to %s in %s ranges with %s workers...",
+            ranges[0][0], ranges[-1][1], len(ranges),
+            min(max_workers or len(ranges), len(ranges)))
+        results = run_concurrently(
+            *(partial(merger.write_range, first, last + 1)
+              for first, last in ranges),
+            max_workers=max_workers)
+        written = [result for result in results if result is not None]
+        merger.chunks.extend(entry for entry, _ in written)
+        merger.write_manifest()
+        for entry, sources in written:
+            merger.delete_sources(entry, sources)
+
+    if join:
+        final_output_file = merge_chunks(
+            info, data_dir, output_dir,
+            keep_concat=keep_concat,
+            delete_source=delete_source
+        )
+        return [final_output_file] if final_output_file is not None else []
+
+    final_output_file = get_final_output_path(info, output_dir)
+    count = len(merger.chunks)
+
+    def write_part(index: int, chunk: Dict) -> Optional[Path]:
+        inputs = [merger.chunk_dir / chunk["video"]]
+        if chunk["audio"]:
+            inputs.append(merger.chunk_dir / chunk["audio"])
+        part_file = get_part_output_path(final_output_file, index, count)
+        logger.info(
+            "Writing segments %s to %s into %s...",
+            chunk["first"], chunk["last"], part_file.name)
+        return mux_tracks(inputs, info, data_dir, part_file)
+
+    part_files = run_concurrently(
+        *(partial(write_part, index, chunk)
+          for index, chunk in enumerate(merger.chunks, start=1)),
+        max_workers=max_workers)
+    if not all(part_files):
+        logger.critical("Failed to write some part files. Keeping chunks.")
+        return [part for part in part_files if part is not None]
+
+    logger.info("Successfully wrote %s part files.", count)
+    rename_thumbnail(data_dir, part_files[0])
+    cleanup_chunks(merger, keep_concat, delete_source)
+    return part_files
+
+
+def get_corrupt(
+    filelist: List[Path], suspects: Optional[List[Path]] = None
+) -> List[Path]:
     """Return the list of corrupt files in filelist, detected with ffprobe.
     This is super slow, but ffmpeg does not report corrupt packet file unless
-    its log level is set to debug level."""
+    its log level is set to debug level.
+    Suspects are scanned first, and if any of them turns out to be corrupt,
+    the other files are not scanned at all."""
+    if suspects:
+        logger.info(
+            "Scanning %s suspect segment files first...", len(suspects))
+        if corrupt := get_corrupt(suspects):
+            return corrupt
+        suspect_set = set(suspects)
+        filelist = [f for f in filelist if f not in suspect_set]
+
     logger.info("Scanning for corrupt segment files...")
     probecmd = ['ffprobe', '-hide_banner', '-v', 'warning']
     corrupt = []
@@ -881,24 +1965,18 @@ def remove_missing_segments(filelist: List[Path], missing: Iterable[int]) -> Lis
     return filtered
 
 
-def print_missing_segments(filelist: List[Path], filetype: str) -> List[Path]:
+def print_missing_segments(index: SegmentIndex, filetype: str) -> List[Path]:
     """
     Check that all segments are available.
-    :param list filelist: a list of pathlib.Path
+    :param SegmentIndex index: segments of one track
     :param str filetype: "_video" or "_audio"
-    :return bool: list of missing segment Paths (that point to nothing)
+    :return list: missing segment Paths (that point to nothing)
     """
-    missing = []
-    first_segnum = 0
-    last_segnum = 0
-    if not filelist:
+    if not index:
         raise Exception(f"Missing files in {filetype} filelist!")
 
-    # Get the numbers from the file name
-    # filename format is 0000000001_[audio|video].ts
-    first_segnum = int(filelist[0].name.split(filetype + ".ts")[0])
-    last_segnum = int(filelist[-1].name.split(filetype + ".ts")[0])
-
+    first_segnum = index.first
+    last_segnum = index.last
     if first_segnum == last_segnum:
         raise Exception(f"First and last {filetype} segments are the same number!?")
 
@@ -908,22 +1986,16 @@ def print_missing_segments(filelist: List[Path], filetype: str) -> List[Path]:
             "instead of 0.")
 
     # Numbering in filenames should start from 0
-    if len(filelist) != last_segnum + 1:
+    missing = []
+    if len(index) != last_segnum + 1:
         logger.warning(
             f"Number of {filetype[1:]} segments doesn't match last segment "
             f"number: Last {filetype[1:]} segment number: "
-            f"{last_segnum} / {len(filelist)} total files.")
-        i = first_segnum
-        base_dir = filelist[0].parent
-        for f in filelist:
+            f"{last_segnum} / {len(index)} total files.")
+        for i in index.missing():
             name = f"{i:0{10}}{filetype}.ts"
-            if f.name != name:
-                logger.warning(
-                    f"Segment {name}.ts seems to be missing.")
-                missing.append(Path(base_dir) / name)
-                # Add a second time to account for missing segment
-                i += 1
-            i += 1
+            logger.warning(f"Segment {name} seems to be missing.")
+            missing.append(index.directory / name)
     return missing
 
 
@@ -1049,14 +2121,16 @@ def rename_thumbnail(data_path: Path, final_output_file: Path) -> Optional[Path]
     return new_path
 
 
-def collect(data_path: Path, warn_missing: bool = True) -> List[Path]:
+def collect_index(data_path: Path, warn_missing: bool = True) -> SegmentIndex:
     if not data_path.exists():
         if warn_missing:
             logger.warning("%s does not exist!", data_path)
-        return []
-    files = [p for p in data_path.glob('*.ts')]
-    files.sort()
-    return files
+        return SegmentIndex(data_path)
+    return SegmentIndex.scan(data_path)
+
+
+def collect(data_path: Path, warn_missing: bool = True) -> List[Path]:
+    return collect_index(data_path, warn_missing).paths()
 
 
 def sanitize_filename(filename: str) -> str:
@@ -0,0 +1,325 @@
+import os
+import json
+import logging
+import subprocess
+import threading
+from dataclasses import dataclass, asdict, field
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from shutil import which
+from typing import Optional, Dict, List, Callable, Any
+
+from livestream_saver.merge import (
+    merge, get_metadata_info, get_final_output_path, InsufficientSpaceError
+)
+
+logger = logging.getLogger(__name__)
+
+# Class names accepted by ionice(1)
+IONICE_CLASSES = {
+    "realtime": "1",
+    "best-effort": "2",
+    "idle": "3",
+}
+
+
+@dataclass(slots=True)
+class MergeJob:
+    """Arguments of a pending merge, as persisted to disk."""
+    data_dir: str
+    output_dir: Optional[str] = None
+    keep_concat: bool = False
+    delete_source: bool = False
+    info: Dict[str, Any] = field(default_factory=dict)
+    progressive: bool = False
+    # Channel whose hooks to trigger once merged
+    channel_id: Optional[str] = None
+
+    @property
+    def video_id(self) -> str:
+        return self.info.get("id", Path(self.data_dir).name)
+
+
+class MergeQueue:
+    """
+    Run merges in a dedicated pool of worker threads, with lowered CPU and
+    I/O priorities, so that merging never holds up a download slot.
+    Pending jobs are written to state_path and can be resumed after a restart.
+    Jobs that cannot start for lack of disk space are deferred: on_deferred
+    is called, and they are retried after retry_delay seconds if it is
+    positive, or dropped otherwise.
+    """
+
+    def __init__(
+        self,
+        state_path: Optional[Path] = None,
+        max_workers: int = 1,
+        niceness: int = 0,
+        ionice_class: Optional[str] = None,
+        on_done: Optional[Callable[[MergeJob, Optional[Path]], None]] = None,
+        on_deferred: Optional[
+            Callable[[MergeJob, InsufficientSpaceError], None]] = None,
+        retry_delay: Optional[float] = None
+    ) -> None:
+        self.state_path = state_path
+        self.niceness = niceness
+        if ionice_class is not None and ionice_class not in IONICE_CLASSES:
+            raise ValueError(
+                f"Invalid ionice class \"{ionice_class}\". "
+                f"Valid values are: {', '.join(IONICE_CLASSES)}.")
+        self.ionice_class = ionice_class
+        # Called after each merge, unless the job was submitted with its own
+        self.on_done = on_done
+        self.on_deferred = on_deferred
+        # Retrying right away would fail again and alert on every attempt
+        self.retry_delay = retry_delay \
+            if retry_delay is not None and retry_delay > 0 else None
+        self._retries: List[threading.Timer] = []
+        self._pending: List[MergeJob] = []
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix="merge_queue",
+            initializer=self._lower_priority
+        )
+
+    def _lower_priority(self) -> None:
+        """
+        Lower the priority of the current worker thread. On Linux, both the
+        nice value and the I/O priority are per-thread and inherited by the
+        ffmpeg processes spawned from it.
+        """
+        tid = threading.get_native_id()
+        if self.niceness:
+            try:
+                os.setpriority(os.PRIO_PROCESS, tid, self.niceness)
+            except (AttributeError, OSError) as e:
+                logger.warning(f"Could not set merge niceness: {e}")
+        if self.ionice_class:
+            if not which("ionice"):
+                logger.warning(
+                    "Could not find ionice. Not changing merge I/O priority.")
+                return
+            try:
+                subprocess.run(
+                    ["ionice", "-c", IONICE_CLASSES[self.ionice_class],
+                     "-p", str(tid)],
+                    check=True, capture_output=True
+                )
+            except subprocess.CalledProcessError as e:
+                logger.warning(
+                    f"Could not set merge I/O priority: {e.stderr.strip()}")
+
+    def load(self) -> List[MergeJob]:
+        if self.state_path is None or not self.state_path.exists():
+            return []
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as fp:
+                return [MergeJob(**job) for job in json.load(fp)]
+        except Exception as e:
+            logger.error(f"Failed to load merge queue {self.state_path}: {e}")
+            return []
+
+    def save(self) -> None:
+        if self.state_path is None:
+            return
+        tmp = self.state_path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as fp:
+            json.dump(
+                [asdict(job) for job in self._pending], fp,
+                indent=4, ensure_ascii=False
+            )
+        tmp.replace(self.state_path)
+
+    def resume(self) -> int:
+        """Submit again the jobs left pending by a previous run."""
+        jobs = self.load()
+        for job in jobs:
+            logger.info(f"Resuming pending merge of {job.data_dir}.")
+            self.submit(job)
+        return len(jobs)
+
+    def submit(
+        self,
+        job: MergeJob,
+        callback: Optional[Callable[[MergeJob, Optional[Path]], None]] = None
+    ) -> None:
+        with self._lock:
+            self._pending.append(job)
+            self.save()
+        self._executor.submit(self._run, job, callback or self.on_done)
+
+    def _retry(
+        self,
+        job: MergeJob,
+        callback: Optional[Callable[[MergeJob, Optional[Path]], None]]
+    ) -> None:
+        try:
+            self._executor.submit(self._run, job, callback)
+        except RuntimeError:
+            # Shut down in the meantime, the job is resumed on next start
+            pass
+
+    def _run(
+        self,
+        job: MergeJob,
+        callback: Optional[Callable[[MergeJob, Optional[Path]], None]]
+    ) -> Optional[Path]:
+        data_dir = Path(job.data_dir)
+        logger.info(f"Merging segments in {data_dir}...")
+        result = None
+        try:
+            result = merge(
+                info=job.info or get_metadata_info(data_dir),
+                data_dir=data_dir,
+                output_dir=Path(job.output_dir) if job.output_dir else None,
+                keep_concat=job.keep_concat,
+                delete_source=job.delete_source,
+                progressive=job.progressive
+            )
+        except InsufficientSpaceError as e:
+            self._defer(job, callback, e)
+            return None
+        except Exception as e:
+            logger.error(f"Error while merging {data_dir}: {e}")
+
+        with self._lock:
+            self._pending.remove(job)
+            self.save()
+
+        if callback is not None:
+            try:
+                callback(job, result)
+            except Exception as e:
+                logger.exception(f"Error in merge callback: {e}")
+        return result
+
+    def _defer(
+        self,
+        job: MergeJob,
+        callback: Optional[Callable[[MergeJob, Optional[Path]], None]],
+        error: InsufficientSpaceError
+    ) -> None:
+        if self.retry_delay is None:
+            logger.error(f"Not merging {job.data_dir}: {error}")
+            with self._lock:
+                self._pending.remove(job)
+                self.save()
+        else:
+            logger.warning(
+                f"Deferring merge of {job.data_dir} by "
+                f"{self.retry_delay / 60:.0f} minutes: {error}")
+            timer = threading.Timer(
+                self.retry_delay, self._retry, args=(job, callback))
+            timer.daemon = True
+            with self._lock:
+                self._retries = [t for t in self._retries if t.is_alive()]
+                self._retries.append(timer)
+            timer.start()
+        if self.on_deferred is not None:
+            try:
+                self.on_deferred(job, error)
+            except Exception as e:
+                logger.exception(f"Error in merge deferral callback: {e}")
+
+    @property
+    def pending(self) -> List[MergeJob]:
+        with self._lock:
+            return list(self._pending)
+
+    def shutdown(self, wait: bool = True) -> None:
+        # Deferred jobs stay in the state file, to be resumed on next start
+        with self._lock:
+            for timer in self._retries:
+                timer.cancel()
+        self._executor.shutdown(wait=wait)
+
+
+def find_capture_dirs(root: Path) -> List[Path]:
+    """Return the capture directories found directly under root."""
+    return sorted(
+        p for p in root.glob("stream_capture_*") if p.is_dir())
+
+
+def batch_merge(
+    root: Path,
+    output_dir: Optional[Path] = None,
+    keep_concat: bool = False,
+    delete_source: bool = False,
+    max_workers: int = 1,
+    niceness: int = 0,
+    ionice_class: Optional[str] = None,
+    report_path: Optional[Path] = None,
+    progressive: bool = False
+) -> Dict[str, Any]:
+    """
+    Merge every capture directory found under root through a MergeQueue,
+    skipping those whose final file already exists, and those lacking disk
+    space, which are reported as deferred. Write a summary report as JSON to
+    report_path (root/merge_report.json by default) and return it.
+    """
+    report: Dict[str, Any] = {
+        "root": str(root),
+        "started": datetime.now().isoformat(timespec="seconds"),
+        "jobs": [],
+    }
+
+    def record(job: MergeJob, result: Optional[Path]) -> None:
+        report["jobs"].append({
+            "data_dir": job.data_dir,
+            "status": "merged" if result is not None else "failed",
+            "output": str(result) if result is not None else None,
+            "finished": datetime.now().isoformat(timespec="seconds"),
+        })
+
+    def record_deferred(job: MergeJob, error: InsufficientSpaceError) -> None:
+        report["jobs"].append({
+            "data_dir": job.data_dir,
+            "status": "deferred",
+            "output": None,
+            "error": str(error),
+        })
+
+    queue = MergeQueue(
+        max_workers=max_workers,
+        niceness=niceness,
+        ionice_class=ionice_class,
+        on_done=record,
+        on_deferred=record_deferred
+    )
+    capture_dirs = find_capture_dirs(root)
+    logger.info(f"Found {len(capture_dirs)} capture directories in {root}.")
+    for data_dir in capture_dirs:
+        info = get_metadata_info(data_dir)
+        output = get_final_output_path(info, output_dir or data_dir)
+        if output.exists():
+            logger.info(f"Skipping {data_dir}: {output.name} already exists.")
+            report["jobs"].append({
+                "data_dir": str(data_dir),
+                "status": "skipped",
+                "output": str(output),
+            })
+            continue
+        queue.submit(MergeJob(
+            data_dir=str(data_dir),
+            output_dir=str(output_dir) if output_dir else None,
+            keep_concat=keep_concat,
+            delete_source=delete_source,
+            info=info,
+            progressive=progressive
+        ))
+    queue.shutdown()
+
+    report["finished"] = datetime.now().isoformat(timespec="seconds")
+    for status in ("merged", "skipped", "deferred", "failed"):
+        report[status] = sum(1 for job in report["jobs"] if job["status"] == status)
+    report_path = report_path or root / "merge_report.json"
+    with open(report_path, "w", encoding="utf-8") as fp:
+        json.dump(report, fp, indent=4, ensure_ascii=False)
+    logger.info(
+        f"Batch merge done: {report['merged']} merged, "
+        f"{report['skipped']} skipped, {report['deferred']} deferred, "
+        f"{report['failed']} failed. "
+        f"Report written to {report_path}.")
+    return report
@@ -0,0 +1,260 @@
+"""
+Read timestamps from MPEG-TS segments without spawning ffprobe.
+
+Only the first and last packets of each segment are looked at, through mmap,
+so that durations can be computed cheaply for thousands of segments.
+"""
+import mmap
+import logging
+from dataclasses import dataclass
+from pathlib import Path
+from statistics import median
+from typing import Optional, Dict, List, Iterator, Tuple
+
+logger = logging.getLogger(__name__)
+
+TS_PACKET_SIZE = 188
+SYNC_BYTE = 0x47
+# PTS and PCR base are expressed in 90kHz ticks, on 33 bits
+CLOCK_RATE = 90000
+TIMESTAMP_WRAP = 1 << 33
+# How many bytes to scan at most from each end of a segment
+MAX_SCAN_BYTES = 2 * 1024 * 1024
+# How many PES timestamps to collect from each end, since frames may be
+# reordered (B-frames) and the extreme timestamps not be the first found.
+PES_SAMPLES = 8
+# Packets after which a segment without video is assumed to be audio only
+VIDEO_PROBE_PACKETS = 64
+
+
+@dataclass(slots=True)
+class SegmentTimestamps:
+    """Presentation time span of a segment, in 90kHz ticks."""
+    start: int
+    end: int
+
+    @property
+    def duration(self) -> float:
+        return ticks_diff(self.start, self.end) / CLOCK_RATE
+
+
+def ticks_diff(start: int, end: int) -> int:
+    """Difference between two timestamps, accounting for the 33 bits wrap."""
+    return (end - start) % TIMESTAMP_WRAP
+
+
+def signed_ticks_diff(start: int, end: int) -> int:
+    """Like ticks_diff(), but negative if end is likely before start."""
+    diff = ticks_diff(start, end)
+    return diff - TIMESTAMP_WRAP if diff >= TIMESTAMP_WRAP // 2 else diff
+
+
+def parse_pts(packet: bytes) -> Tuple[int, Optional[int], Optional[int]]:
+    """
+    Return the PID of a TS packet, and the stream id and PTS of the PES
+    starting in it, if any.
+    """
+    pid = ((packet[1] & 0x1f) << 8) | packet[2]
+    # Payload unit start indicator
+    if not packet[1] & 0x40:
+        return pid, None, None
+    adaptation = (packet[3] >> 4) & 0x3
+    if not adaptation & 0x1:  # no payload
+        return pid, None, None
+    offset = 4
+    if adaptation & 0x2:
+        offset += 1 + packet[4]
+    pes = packet[offset:]
+    if len(pes) < 14 or pes[0:3] != b"\x00\x00\x01":
+        return pid, None, None
+    stream_id = pes[3]
+    # Only audio and video streams have the optional PES header we need
+    if not (0xc0 <= stream_id <= 0xef):
+        return pid, None, None
+    if not pes[7] & 0x80:  # PTS_DTS_flags
+        return pid, stream_id, None
+    pts = (
+        ((pes[9] >> 1) & 0x07) << 30
+        | pes[10] << 22
+        | (pes[11] >> 1) << 15
+        | pes[12] << 7
+        | pes[13] >> 1
+    )
+    return pid, stream_id, pts
+
+
+def parse_pcr(packet: bytes) -> Optional[int]:
+    """Return the PCR base of a TS packet, in 90kHz ticks, if any."""
+    adaptation = (packet[3] >> 4) & 0x3
+    if not adaptation & 0x2 or packet[4] < 7:
+        return None
+    if not packet[5] & 0x10:  # PCR flag
+        return None
+    return (
+        packet[6] << 25
+        | packet[7] << 17
+        | packet[8] << 9
+        | packet[9] << 1
+        | packet[10] >> 7
+    )
+
+
+def is_mpegts(data) -> bool:
+    """Check the sync bytes of the first packets."""
+    count = min(len(data) // TS_PACKET_SIZE, 3)
+    return count > 0 and all(
+        data[i * TS_PACKET_SIZE] == SYNC_BYTE for i in range(count))
+
+
+def iter_packets(data, reverse: bool = False) -> Iterator[bytes]:
+    count = len(data) // TS_PACKET_SIZE
+    max_count = MAX_SCAN_BYTES // TS_PACKET_SIZE
+    indices = range(count - 1, max(count - 1 - max_count, -1), -1) \
+        if reverse else range(min(count, max_count))
+    for i in indices:
+        packet = data[i * TS_PACKET_SIZE:(i + 1) * TS_PACKET_SIZE]
+        if packet[0] != SYNC_BYTE:
+            continue
+        yield packet
+
+
+def _pick_stream(data) -> Tuple[Optional[int], List[int], List[int]]:
+    """
+    Find the PID to take timestamps from, preferring video over audio in
+    muxed segments. Return it with the first PTS and PCR values found.
+    Segments without a video stream in their first VIDEO_PROBE_PACKETS
+    packets are read no further than enough samples of another stream.
+    """
+    pts_by_pid: Dict[int, List[int]] = {}
+    stream_ids: Dict[int, int] = {}
+    pcrs: List[int] = []
+    has_video = False
+    has_samples = False
+    for count, packet in enumerate(iter_packets(data), start=1):
+        if len(pcrs) < PES_SAMPLES and (pcr := parse_pcr(packet)) is not None:
+            pcrs.append(pcr)
+        pid, stream_id, pts = parse_pts(packet)
+        if stream_id is not None:
+            stream_ids.setdefault(pid, stream_id)
+            has_video = has_video or stream_id >= 0xe0
+        if pts is not None:
+            pts_by_pid.setdefault(pid, []).append(pts)
+            if len(pts_by_pid[pid]) >= PES_SAMPLES:
+                # Stop once there are enough samples for a video stream
+                if stream_ids[pid] >= 0xe0:
+                    break
+                has_samples = True
+        if has_samples and not has_video and count >= VIDEO_PROBE_PACKETS:
+            break
+    if not pts_by_pid:
+        return None, [], pcrs
+    pid = max(pts_by_pid, key=lambda p: (stream_ids[p] >= 0xe0, -p))
+    return pid, pts_by_pid[pid][:PES_SAMPLES], pcrs
+
+
+def _frame_ticks(samples: List[int]) -> int:
+    """Estimate the duration of one frame from a few timestamps."""
+    ordered = sorted(set(samples))
+    diffs = [b - a for a, b in zip(ordered, ordered[1:]) if b > a]
+    return min(diffs) if diffs else 0
+
+
+def read_timestamps(path: Path) -> Optional[SegmentTimestamps]:
+    """
+    Return the presentation time span of a MPEG-TS segment, or None if it is
+    not a MPEG-TS file or no timestamp could be found.
+    """
+    try:
+        with open(path, "rb") as f:
+            if f.seek(0, 2) < TS_PACKET_SIZE:
+                return None
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return _read_timestamps(data)
+    except (OSError, ValueError) as e:
+        logger.debug(f"Could not read timestamps from {path}: {e}")
+        return None
+
+
+def _read_timestamps(data) -> Optional[SegmentTimestamps]:
+    if not is_mpegts(data):
+        return None
+    pid, head_pts, head_pcrs = _pick_stream(data)
+
+    if pid is None:
+        # No PES timestamp, fall back to the program clock reference
+        tail_pcrs: List[int] = []
+        for packet in iter_packets(data, reverse=True):
+            if (pcr := parse_pcr(packet)) is not None:
+                tail_pcrs.append(pcr)
+                if len(tail_pcrs) >= PES_SAMPLES:
+                    break
+        if not head_pcrs or not tail_pcrs:
+            return None
+        return SegmentTimestamps(head_pcrs[0], tail_pcrs[0])
+
+    tail_pts: List[int] = []
+    for packet in iter_packets(data, reverse=True):
+        packet_pid, _, pts = parse_pts(packet)
+        if packet_pid == pid and pts is not None:
+            tail_pts.append(pts)
+            if len(tail_pts) >= PES_SAMPLES:
+                break
+
+    # Compare relative to the first timestamp to handle wrap arounds
+    first = head_pts[0]
+    start = first + min(signed_ticks_diff(first, pts) for pts in head_pts)
+    last = start + max(
+        signed_ticks_diff(start, pts) for pts in tail_pts + head_pts)
+    # Count the duration of the last frame as well
+    end = last + _frame_ticks(tail_pts or head_pts)
+    return SegmentTimestamps(start % TIMESTAMP_WRAP, end % TIMESTAMP_WRAP)
+
+
+class DurationTable:
+    """Time span of each segment, keyed by segment number."""
+
+    def __init__(self, spans: Dict[int, SegmentTimestamps]) -> None:
+        self.spans = spans
+
+    @classmethod
+    def from_segments(
+        cls, segments: List[Path], seg_numbers: List[int]
+    ) -> Optional["DurationTable"]:
+        """
+        Read the timestamps of each segment. Return None if the first or last
+        segment could not be read, since they are needed for the total.
+        """
+        spans = {}
+        for seg_num, path in zip(seg_numbers, segments):
+            if (span := read_timestamps(path)) is not None:
+                spans[seg_num] = span
+        if not seg_numbers \
+        or seg_numbers[0] not in spans or seg_numbers[-1] not in spans:
+            return None
+        return cls(spans)
+
+    def segment_duration(self, seg_num: int) -> Optional[float]:
+        """
+        Duration of a segment, up to the start of the next one if available
+        since it is more accurate than estimating the last frame duration.
+        """
+        span = self.spans.get(seg_num)
+        if span is None:
+            return None
+        if (next_span := self.spans.get(seg_num + 1)) is not None:
+            return ticks_diff(span.start, next_span.start) / CLOCK_RATE
+        return span.duration
+
+    @property
+    def median_duration(self) -> float:
+        durations = [
+            dur for seg_num in self.spans
+            if (dur := self.segment_duration(seg_num)) is not None
+        ]
+        return median(durations) if durations else 0.0
+
+    def total_duration(self, first: int, last: int) -> float:
+        """Duration from the start of segment first to the end of last,
+        including any gap in between as timestamps keep running."""
+        return ticks_diff(
+            self.spans[first].start, self.spans[last].end) / CLOCK_RATE
@@ -4,13 +4,15 @@ import json
 from random import randint
 from urllib.request import Request, urlopen #, build_opener, HTTPCookieProcessor, HTTPHandler
 from urllib.parse import urlencode
+from urllib.error import HTTPError
 import http.cookiejar
 from http.cookies import SimpleCookie
-from typing import Dict, Optional, Union
+from typing import Dict, Optional, Tuple, Union
 import time
 import hashlib
+import threading
 
-from livestream_saver.util import UA, str_as_json
+from livestream_saver.util import UA, str_as_json, json_loads
 from livestream_saver.cookies import get_cookie
 
 from yt_dlp.extractor.youtube._base import INNERTUBE_CLIENTS
@@ -60,7 +62,7 @@ class YoutubeUrllibSession:
             # Assuming the first result is the one we're looking for
             objstr = result.group(1)
             try:
-                return json.loads(objstr)
+                return json_loads(objstr)
             except Exception as e:
                 log.error(f"Error loading ytcfg as json: {e}.")
         return {}
@@ -212,6 +214,39 @@ class YoutubeUrllibSession:
         self.cookie_jar.add_cookie_header(req)
         return self.get_response_as_str(req)
 
+    def make_conditional_request(
+        self, url: str, etag: Optional[str] = None,
+        last_modified: Optional[str] = None
+    ) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+        """
+        Make a GET request which the server may answer with 304 Not Modified
+        if the resource has not changed since the response that returned the
+        etag and last_modified validators. Return the content, or None if it
+        has not been modified, along with the validators to send next time.
+        No cookies are sent, this is only meant for public feeds.
+        """
+        headers = dict(self.headers)
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        req = Request(url, headers=headers)
+        try:
+            with urlopen(req, timeout=20.0) as res:
+                return (
+                    res.read().decode('utf-8'),
+                    res.headers.get("ETag"),
+                    res.headers.get("Last-Modified")
+                )
+        except HTTPError as e:
+            if e.code != 304:
+                raise
+            return (
+                None,
+                e.headers.get("ETag") or etag,
+                e.headers.get("Last-Modified") or last_modified
+            )
+
     def make_api_request(
         self, endpoint: str, payload: Optional[Dict],
         custom_headers: Optional[Dict] = None, client: str = "android"
@@ -384,3 +419,26 @@ class YoutubeUrllibSession:
             except Exception as e:
                 log.critical(f"Failed to load {req.full_url}: {e}")
                 raise e
+
+
+class SessionPool:
+    """
+    One session per cookie file, shared by every channel monitored with it,
+    so that each cookie jar is loaded and kept up to date only once.
+    """
+    def __init__(self, notifier=None):
+        self.notifier = notifier
+        self._sessions: Dict[Optional[str], YoutubeUrllibSession] = {}
+        self._lock = threading.Lock()
+
+    def get(self, cookiefile_path: Optional[str] = None) -> YoutubeUrllibSession:
+        with self._lock:
+            if (session := self._sessions.get(cookiefile_path)) is None:
+                session = YoutubeUrllibSession(
+                    cookiefile_path=cookiefile_path, notifier=self.notifier)
+                session._initialize_consent()
+                self._sessions[cookiefile_path] = session
+            return session
+
+    def __len__(self) -> int:
+        return len(self._sessions)
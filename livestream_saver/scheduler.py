@@ -0,0 +1,215 @@
+"""
+Scan many channels from a single process: each channel is scanned when its
+deadline in a shared heap is due, by a small pool of worker threads, instead
+of each channel sleeping in its own thread or process.
+Upcoming videos are polled from the same heap around their start time.
+"""
+import heapq
+import itertools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from random import uniform
+from time import monotonic, time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Start polling a video this many seconds before its scheduled start
+RAMP_UP = 300.0
+# Seconds between two polls of a video around its scheduled start
+POLL_INTERVAL = 20.0
+# Polls of a video late to start back off up to this many seconds
+MAX_POLL_INTERVAL = 600.0
+# Stop polling a video this many seconds after its scheduled start
+GIVE_UP_AFTER = 6 * 3600
+
+
+def poll_delay(start: float, now: float) -> Optional[float]:
+    """
+    Seconds until a video scheduled to start at the start timestamp should
+    be polled: RAMP_UP seconds before it is due, then every POLL_INTERVAL
+    until RAMP_UP seconds after, then twice less often every RAMP_UP seconds
+    it is late. None once it is GIVE_UP_AFTER seconds late.
+    """
+    until = start - now
+    if until > RAMP_UP:
+        return until - RAMP_UP
+    late = -until
+    if late > GIVE_UP_AFTER:
+        return None
+    if late <= RAMP_UP:
+        return POLL_INTERVAL
+    return min(MAX_POLL_INTERVAL, POLL_INTERVAL * 2 ** (late / RAMP_UP - 1))
+
+
+class ChannelScheduler:
+    """
+    Call scan(target) for each target added, every delay minutes plus up to
+    variance minutes, like wait_block() does between two scans of a single
+    channel. Scans run on max_workers threads. A target is only rescheduled
+    once its scan is done, so that scans of the same channel never overlap.
+    If scan() returns a number of seconds, the target is scanned again in
+    that many seconds instead. Targets added without a delay are only scanned
+    again if scan() returns one.
+    """
+
+    def __init__(
+        self,
+        scan: Callable[[Any], None],
+        max_workers: int = 4,
+        variance: float = 0.0,
+        clock: Callable[[], float] = monotonic
+    ) -> None:
+        self.scan = scan
+        self.variance = variance
+        self.clock = clock
+        # Deadline, insertion order to break ties, target, delay in minutes
+        self._heap: List[Tuple[float, int, Any, Optional[float]]] = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="channel_scan")
+
+    def __len__(self) -> int:
+        with self._cond:
+            return len(self._heap)
+
+    def add(
+        self, target: Any, delay: Optional[float], first_in: float = 0.0
+    ) -> None:
+        """Scan target in first_in seconds, then every delay minutes."""
+        self._push(self.clock() + first_in, target, delay)
+
+    def _push(self, due: float, target: Any, delay: Optional[float]) -> None:
+        with self._cond:
+            heapq.heappush(self._heap, (due, next(self._counter), target, delay))
+            self._cond.notify()
+
+    def interval(self, delay: float) -> float:
+        """Seconds until the next scan of a target scanned every delay minutes."""
+        return uniform(delay * 60, (delay + self.variance) * 60)
+
+    def run(self) -> None:
+        """Submit scans as they become due, until stop() is called."""
+        with self._cond:
+            while not self._stopped:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                due, _, target, delay = self._heap[0]
+                if (timeout := due - self.clock()) > 0:
+                    self._cond.wait(timeout)
+                    continue
+                heapq.heappop(self._heap)
+                self._executor.submit(self._scan, target, delay)
+
+    def _scan(self, target: Any, delay: Optional[float]) -> None:
+        next_in = None
+        try:
+            next_in = self.scan(target)
+        except Exception as e:
+            logger.exception(f"Error while scanning {target}: {e}")
+        if next_in is None and delay is not None:
+            next_in = self.interval(delay)
+        if next_in is not None and not self._stopped:
+            self._push(self.clock() + next_in, target, delay)
+
+    def stop(self, wait: bool = True) -> None:
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+
+class UpcomingPoller:
+    """
+    Poll the upcoming videos of channels around their scheduled start time,
+    as targets of a ChannelScheduler, so that they are downloaded as soon as
+    they go live without scanning every tab of the channel that often.
+    dispatch(channel, channel_args, video) is called once a video is live.
+    """
+
+    def __init__(
+        self,
+        scheduler: ChannelScheduler,
+        dispatch: Callable[[Any, Dict, Any], None],
+        clock: Callable[[], float] = time
+    ) -> None:
+        self.scheduler = scheduler
+        self.dispatch = dispatch
+        self.clock = clock
+        # Videos polled by video Id
+        self._polled: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._polled)
+
+    def track(self, channel: Any, channel_args: Dict) -> bool:
+        """
+        Poll the scheduled videos of channel which are not polled yet, and
+        update the start time of those which are. Return whether the channel
+        has any scheduled video.
+        """
+        for vid in channel.known_videos():
+            if vid.isLiveNow:
+                # Already dispatched by the scan
+                self._forget(vid)
+        scheduled = channel.scheduled_videos()
+        for vid in scheduled:
+            with self._lock:
+                if (polled := self._polled.get(vid.videoId)) is not None:
+                    # It may have been rescheduled
+                    polled.startTime = vid.startTime
+                    continue
+                self._polled[vid.videoId] = vid
+            first_in = poll_delay(float(vid.startTime), self.clock())
+            if first_in is None:
+                self._forget(vid)
+                continue
+            logger.debug(
+                f"Polling {vid.videoId} in {first_in:.0f} seconds, "
+                "around its scheduled start time.")
+            self.scheduler.add((channel, channel_args, vid), None, first_in)
+        return bool(scheduled)
+
+    def poll(
+        self, channel: Any, channel_args: Dict, vid: Any
+    ) -> Optional[float]:
+        """
+        Check whether vid is live, and dispatch it if it is. Return the
+        number of seconds until it should be polled again, or None to stop.
+        """
+        with self._lock:
+            if vid.videoId not in self._polled:
+                return None
+        start = float(vid.startTime)
+        if start - self.clock() > RAMP_UP:
+            # Rescheduled later since this poll was planned
+            return poll_delay(start, self.clock())
+
+        status = channel.poll_live_status(vid)
+        if status == "live":
+            logger.info(f"Scheduled video {vid.videoId} is now live.")
+            self._forget(vid)
+            self.dispatch(channel, channel_args, vid)
+            return None
+        if status == "gone":
+            logger.info(
+                f"Scheduled video {vid.videoId} has ended or was cancelled.")
+            self._forget(vid)
+            return None
+
+        if (next_in := poll_delay(float(vid.startTime), self.clock())) is None:
+            logger.info(
+                f"Giving up on scheduled video {vid.videoId}, "
+                "which is too late to start.")
+            self._forget(vid)
+        return next_in
+
+    def _forget(self, vid: Any) -> None:
+        with self._lock:
+            self._polled.pop(vid.videoId, None)
@@ -0,0 +1,139 @@
+"""
+Index of the segment files of a track, built from a single directory scan,
+so that merging does not parse file names or stat files more than once.
+"""
+import os
+from array import array
+from bisect import bisect_left
+from pathlib import Path
+from typing import Optional, Dict, List, Iterable, Iterator, Set
+
+
+class SegmentIndex:
+    """
+    Sequence numbers, sizes and names of the segment files found in a
+    directory, sorted by sequence number. Segment files are named like
+    0000000001_video.ts.
+    """
+    __slots__ = ("directory", "seqs", "sizes", "names")
+
+    def __init__(
+        self,
+        directory: Path,
+        seqs: Optional[array] = None,
+        sizes: Optional[array] = None,
+        names: Optional[List[str]] = None
+    ) -> None:
+        self.directory = directory
+        self.seqs = seqs if seqs is not None else array("q")
+        self.sizes = sizes if sizes is not None else array("Q")
+        self.names = names if names is not None else []
+
+    @classmethod
+    def scan(cls, directory: Path) -> "SegmentIndex":
+        """Index the segment files in directory, which may not exist."""
+        found = []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    name = entry.name
+                    if not name.endswith(".ts"):
+                        continue
+                    number, sep, _ = name.partition("_")
+                    if not sep or not number.isdigit():
+                        continue
+                    try:
+                        if not entry.is_file():
+                            continue
+                        size = entry.stat().st_size
+                    except FileNotFoundError:
+                        # Removed in the meantime
+                        continue
+                    found.append((int(number), size, name))
+        except FileNotFoundError:
+            pass
+        found.sort()
+        return cls(
+            directory,
+            array("q", [seq for seq, _, _ in found]),
+            array("Q", [size for _, size, _ in found]),
+            [name for _, _, name in found]
+        )
+
+    def __len__(self) -> int:
+        return len(self.seqs)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.seqs)
+
+    @property
+    def first(self) -> int:
+        return self.seqs[0]
+
+    @property
+    def last(self) -> int:
+        return self.seqs[-1]
+
+    @property
+    def total_size(self) -> int:
+        return sum(self.sizes)
+
+    def paths(self) -> List[Path]:
+        return [self.directory / name for name in self.names]
+
+    def numbers(self) -> Set[int]:
+        return set(self.seqs)
+
+    def missing(self) -> List[int]:
+        """Sequence numbers missing between the first and last segments."""
+        missing: List[int] = []
+        seqs = self.seqs
+        for i in range(1, len(seqs)):
+            if seqs[i] - seqs[i - 1] > 1:
+                missing.extend(range(seqs[i - 1] + 1, seqs[i]))
+        return missing
+
+    def _subset(self, indices: Iterable[int]) -> "SegmentIndex":
+        indices = list(indices)
+        return SegmentIndex(
+            self.directory,
+            array("q", [self.seqs[i] for i in indices]),
+            array("Q", [self.sizes[i] for i in indices]),
+            [self.names[i] for i in indices]
+        )
+
+    def between(self, first: int, upto: int) -> "SegmentIndex":
+        """Segments from first to upto excluded."""
+        start = bisect_left(self.seqs, first)
+        end = bisect_left(self.seqs, upto)
+        return self._subset(range(start, end))
+
+    def without(self, excluded: Set[int]) -> "SegmentIndex":
+        if not excluded:
+            return self
+        return self._subset(
+            i for i, seq in enumerate(self.seqs) if seq not in excluded)
+
+    def only(self, included: Set[int]) -> "SegmentIndex":
+        return self._subset(
+            i for i, seq in enumerate(self.seqs) if seq in included)
+
+    def signature(self) -> Dict:
+        """Same as merge.files_signature(), without statting files again."""
+        return {
+            "count": len(self),
+            "first": self.names[0] if self.names else None,
+            "last": self.names[-1] if self.names else None,
+            "size": self.total_size,
+        }
+
+
+def combined_signature(*indexes: SegmentIndex) -> Dict:
+    """Signature of the files of several indexes, taken one after the other."""
+    names = [index.names for index in indexes if index.names]
+    return {
+        "count": sum(len(index) for index in indexes),
+        "first": names[0][0] if names else None,
+        "last": names[-1][-1] if names else None,
+        "size": sum(index.total_size for index in indexes),
+    }
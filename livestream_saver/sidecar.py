@@ -0,0 +1,153 @@
+"""
+Compact index of the segments written during a download, so that merging
+does not have to rediscover facts that were already known at that time.
+"""
+import struct
+import logging
+import threading
+from dataclasses import dataclass, astuple
+from pathlib import Path
+from statistics import median
+from typing import Optional, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+SIDECAR_NAME = "segments.idx"
+MAGIC = b"LSSIDX\x00\x01"
+TRACKS = ("video", "audio")
+# seq, track, HTTP status, size, duration, X-Segment-Lmt, X-Walltime-Ms, time
+RECORD = struct.Struct("<qBxHQdqqd")
+
+
+@dataclass(slots=True)
+class SegmentRecord:
+    seq: int
+    track: str
+    status: int
+    size: int
+    # From EXTINF in HLS playlists, 0.0 if unknown
+    duration: float = 0.0
+    # Timestamps sent by Youtube in response headers, 0 if missing
+    lmt: int = 0
+    walltime_ms: int = 0
+    written_at: float = 0.0
+
+    def pack(self) -> bytes:
+        values = list(astuple(self))
+        values[1] = TRACKS.index(self.track)
+        return RECORD.pack(*values)
+
+    @classmethod
+    def unpack(cls, data: bytes) -> "SegmentRecord":
+        values = list(RECORD.unpack(data))
+        values[1] = TRACKS[values[1]]
+        return cls(*values)
+
+
+class SidecarWriter:
+    """Append records to the sidecar file of a download."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+
+    def append(self, record: SegmentRecord) -> None:
+        with self._lock:
+            with open(self.path, "ab") as f:
+                if f.tell() == 0:
+                    f.write(MAGIC)
+                f.write(record.pack())
+
+
+def read_sidecar(path: Path) -> Dict[Tuple[str, int], SegmentRecord]:
+    """
+    Return records keyed by track and segment number. A segment written more
+    than once (when resuming a download) keeps its last record.
+    """
+    try:
+        data = path.read_bytes()
+    except FileNotFoundError:
+        return {}
+    if not data.startswith(MAGIC):
+        logger.warning(f"Ignoring {path}: not a segment index file.")
+        return {}
+    records = {}
+    # A trailing partial record is ignored, in case the file is being written
+    end = len(MAGIC) + (len(data) - len(MAGIC)) // RECORD.size * RECORD.size
+    for offset in range(len(MAGIC), end, RECORD.size):
+        record = SegmentRecord.unpack(data[offset:offset + RECORD.size])
+        records[(record.track, record.seq)] = record
+    return records
+
+
+class SegmentSidecar:
+    """Read-only view of the sidecar of a download, used while merging."""
+
+    def __init__(self, records: Dict[Tuple[str, int], SegmentRecord]) -> None:
+        self._tracks: Dict[str, Dict[int, SegmentRecord]] = {
+            track: {} for track in TRACKS}
+        for (track, seq), record in sorted(records.items()):
+            self._tracks[track][seq] = record
+
+    @classmethod
+    def load(cls, data_dir: Path) -> Optional["SegmentSidecar"]:
+        if not (records := read_sidecar(data_dir / SIDECAR_NAME)):
+            return None
+        return cls(records)
+
+    def track(self, track: str) -> Dict[int, SegmentRecord]:
+        return self._tracks[track]
+
+    def missing(self, track: str) -> List[int]:
+        """Segment numbers never written within the recorded range."""
+        records = self._tracks[track]
+        if not records:
+            return []
+        return [
+            seq for seq in range(min(records), max(records) + 1)
+            if seq not in records or not records[seq].size
+        ]
+
+    def median_duration(self, track: str) -> Optional[float]:
+        durations = [
+            r.duration for r in self._tracks[track].values() if r.duration > 0]
+        return median(durations) if durations else None
+
+    def total_duration(self, track: str, first: int, last: int) -> Optional[float]:
+        """
+        Sum of segment durations from first to last included, counting the
+        median duration for segments with no known duration, since timestamps
+        keep running over gaps. None if no duration was recorded.
+        """
+        if (default := self.median_duration(track)) is None:
+            return None
+        records = self._tracks[track]
+        return sum(
+            records[seq].duration
+            if seq in records and records[seq].duration > 0 else default
+            for seq in range(first, last + 1)
+        )
+
+    def suspects(self, files: List[Path], track: str) -> List[Path]:
+        """
+        Segments that are more likely to be corrupt than others: their size
+        changed since download, their response was not a plain 200, or they
+        are much smaller than usual. Only file sizes are looked at.
+        """
+        records = self._tracks[track]
+        sizes = [r.size for r in records.values() if r.size]
+        typical = median(sizes) if sizes else 0
+        suspects = []
+        for f in files:
+            record = records.get(int(f.stem[:-6]))
+            if record is None:
+                continue
+            try:
+                size = f.stat().st_size
+            except FileNotFoundError:
+                continue
+            if size != record.size \
+            or record.status != 200 \
+            or size < typical * 0.2:
+                suspects.append(f)
+        return suspects
@@ -0,0 +1,176 @@
+"""
+Keep track of which videos have been downloaded, skipped, or had their hooks
+triggered, in a SQLite database, so that a restarted monitor does not process
+them again, and so that memory use does not grow with uptime.
+"""
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from time import time
+from typing import Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# States of a video
+PROCESSING = "processing"
+PROCESSED = "processed"
+SKIPPED = "skipped"
+FAILED = "failed"
+
+# Number of lookups cached in memory
+CACHE_SIZE = 1024
+# Entries older than that many days are deleted on startup
+RETENTION_DAYS = 90.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS videos (
+    video_id TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    updated REAL NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS hooked (
+    video_id TEXT PRIMARY KEY,
+    updated REAL NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+class StateStore:
+    """
+    State of videos by video Id, persisted to the SQLite database at path,
+    or kept in memory if path is None. The most recent lookups are cached in
+    a bounded LRU in front of the database.
+    A video is claimed while it is being processed, then either processed,
+    skipped, or failed. Claims left over by a previous run that did not exit
+    cleanly, and failures, are released when the store is opened, so that
+    those videos can be resumed or retried.
+    """
+
+    def __init__(
+        self,
+        path: Optional[Path] = None,
+        cache_size: int = CACHE_SIZE,
+        retention_days: float = RETENTION_DAYS
+    ) -> None:
+        self.path = path
+        self.cache_size = cache_size
+        # (table, video_id) -> state, or None if missing from the database
+        self._cache: OrderedDict[Tuple[str, str], Optional[str]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            str(path) if path is not None else ":memory:",
+            check_same_thread=False,
+            isolation_level=None,  # autocommit
+            timeout=10.0
+        )
+        if path is not None:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+        oldest = time() - retention_days * 86400
+        with self._conn:
+            released = self._conn.execute(
+                "DELETE FROM videos WHERE state IN (?, ?)",
+                (PROCESSING, FAILED)).rowcount
+            self._conn.execute("DELETE FROM videos WHERE updated < ?", (oldest,))
+            self._conn.execute("DELETE FROM hooked WHERE updated < ?", (oldest,))
+        if released:
+            logger.info(
+                f"Released {released} videos left unfinished or failed "
+                "by a previous run.")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM videos").fetchone()[0]
+
+    def _cached(self, key: Tuple[str, str]) -> Tuple[bool, Optional[str]]:
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return True, self._cache[key]
+        return False, None
+
+    def _remember(self, key: Tuple[str, str], state: Optional[str]) -> None:
+        self._cache[key] = state
+        self._cache.move_to_end(key)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _get(self, video_id: str) -> Optional[str]:
+        key = ("videos", video_id)
+        hit, state = self._cached(key)
+        if not hit:
+            row = self._conn.execute(
+                "SELECT state FROM videos WHERE video_id = ?", (video_id,)
+            ).fetchone()
+            state = row[0] if row else None
+            self._remember(key, state)
+        return state
+
+    def _set(self, video_id: str, state: str) -> None:
+        self._conn.execute(
+            "INSERT OR REPLACE INTO videos (video_id, state, updated) "
+            "VALUES (?, ?, ?)", (video_id, state, time()))
+        self._remember(("videos", video_id), state)
+
+    def get(self, video_id: str) -> Optional[str]:
+        """State of video_id, or None if it is unknown."""
+        with self._lock:
+            return self._get(video_id)
+
+    def is_processing(self, video_id: str) -> bool:
+        return self.get(video_id) == PROCESSING
+
+    def claim(self, video_id: str) -> bool:
+        """
+        Mark video_id as being processed, unless it has been processed,
+        skipped, or is being processed already. Return whether it was.
+        """
+        with self._lock:
+            if self._get(video_id) is not None:
+                return False
+            self._set(video_id, PROCESSING)
+            return True
+
+    def finish(self, video_id: str, state: str = PROCESSED) -> None:
+        """Mark a claimed video_id as processed, skipped or failed."""
+        if state not in (PROCESSED, SKIPPED, FAILED):
+            raise ValueError(f"Invalid final state \"{state}\".")
+        with self._lock:
+            self._set(video_id, state)
+
+    def release(self, video_id: str) -> None:
+        """Forget about video_id, so that it can be claimed again."""
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM videos WHERE video_id = ?", (video_id,))
+            self._remember(("videos", video_id), None)
+
+    def mark_hooked(self, video_id: str) -> bool:
+        """
+        Record that hooks have been triggered for video_id.
+        Return False if they had been already.
+        """
+        key = ("hooked", video_id)
+        with self._lock:
+            hit, state = self._cached(key)
+            if not hit:
+                row = self._conn.execute(
+                    "SELECT 1 FROM hooked WHERE video_id = ?", (video_id,)
+                ).fetchone()
+                state = "hooked" if row else None
+            if state is not None:
+                self._remember(key, state)
+                return False
+            self._conn.execute(
+                "INSERT OR REPLACE INTO hooked (video_id, updated) "
+                "VALUES (?, ?)", (video_id, time()))
+            self._remember(key, "hooked")
+            return True
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
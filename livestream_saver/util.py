@@ -3,7 +3,7 @@ import re
 from os import makedirs
 from platform import system
 from pathlib import Path
-from typing import Optional, Iterable, Dict
+from typing import Optional, Iterable, Dict, Any, Callable, Union
 from json import loads
 from time import sleep
 from random import uniform
@@ -128,9 +128,48 @@ event_props = [
 UA = get_system_ua()
 
 
+# JSON parsers, from fastest to slowest. The standard library always works.
+JSON_BACKENDS: Dict[str, Callable[[Union[str, bytes]], Any]] = {}
+try:
+    import orjson
+except ImportError:
+    pass
+else:
+    JSON_BACKENDS["orjson"] = orjson.loads
+JSON_BACKENDS["json"] = loads
+
+# Parser used by json_loads()
+json_backend = next(iter(JSON_BACKENDS))
+
+
+def set_json_backend(name: str) -> None:
+    """Parse JSON with that backend from now on."""
+    global json_backend
+    if name not in JSON_BACKENDS:
+        raise ValueError(
+            f"Unavailable JSON backend \"{name}\". "
+            f"Valid values are: {', '.join(JSON_BACKENDS)}.")
+    json_backend = name
+
+
+def json_loads(data: Union[str, bytes]) -> Any:
+    """
+    Parse JSON with the fastest available backend. Some documents are only
+    accepted by the standard library (orjson rejects unpaired surrogates,
+    which truncated titles may contain), so fall back to it on errors.
+    """
+    try:
+        return JSON_BACKENDS[json_backend](data)
+    except ValueError:
+        if json_backend == "json":
+            raise
+        log.debug(f"Falling back to the json module after {json_backend} failed.")
+        return loads(data)
+
+
 def str_as_json(string: str) -> Dict:
     try:
-        j = loads(string)
+        j = json_loads(string)
     except Exception as e:
         log.critical(f"Error loading JSON from string: {e}")
         if log.isEnabledFor(logging.DEBUG):
@@ -1,6 +1,32 @@
-from livestream_saver.merge import sanitize_filename, get_filetype
+from livestream_saver.merge import (
+    sanitize_filename, get_filetype, RollingMerger, run_concurrently,
+    probe_streams, collect, split_ranges, split_merge, get_part_output_path,
+    estimate_space, check_free_space, progressive_merge,
+    merge_chunks, cleanup_chunks,
+    InsufficientSpaceError, SPACE_MARGIN, MergeCheckpoint, NativeConcatFile,
+    compare_tracks, files_signature
+)
+import os
 from pathlib import Path
+from subprocess import CalledProcessError
+from tempfile import TemporaryDirectory
+from time import sleep
+from json import load
 from unittest import TestCase
+from unittest.mock import patch, Mock
+
+from livestream_saver.merge_queue import MergeQueue, MergeJob, batch_merge
+from livestream_saver import ffmpeg_runner
+from livestream_saver.concat import concat_files, available_backends
+from livestream_saver.sidecar import (
+    SidecarWriter, SegmentRecord, SegmentSidecar, SIDECAR_NAME
+)
+from livestream_saver.segment_index import SegmentIndex, combined_signature
+from livestream_saver.live_playlist import LivePlaylist, LIVE_PLAYLIST
+from livestream_saver import mpegts
+from livestream_saver.mpegts import (
+    DurationTable, read_timestamps, TIMESTAMP_WRAP, VIDEO_PROBE_PACKETS
+)
 
 
 class TestSanitizeFilename(TestCase):
@@ -30,3 +56,736 @@ class TestGetFiletype(TestCase):
             Path(__file__).parent / "samples" / "img.jpg") == "jpg"
         assert get_filetype(
             Path(__file__).parent / "samples" / "img.webp") == "webp"
+
+
+class TestRunConcurrently(TestCase):
+    def test_run_concurrently(self):
+        assert run_concurrently(lambda: 1, lambda: "a") == [1, "a"]
+
+        done = []
+        def fail():
+            raise ValueError("fail")
+        def slow():
+            sleep(0.1)
+            done.append(True)
+        with self.assertRaises(ValueError):
+            run_concurrently(fail, slow)
+        # The other call still went through before the exception was raised
+        assert done
+
+
+class TestRollingMerger(TestCase):
+    def test_pending(self):
+        with TemporaryDirectory() as tmp:
+            data_dir = Path(tmp)
+            (data_dir / "vid").mkdir()
+            (data_dir / "aud").mkdir()
+            for i in range(6):
+                (data_dir / "vid" / f"{i:0{10}}_video.ts").touch()
+                # Audio segment 3 is missing
+                if i != 3:
+                    (data_dir / "aud" / f"{i:0{10}}_audio.ts").touch()
+
+            merger = RollingMerger(data_dir, "test")
+            assert merger.next_seq == 0
+
+            video, audio, missing = merger.pending(3)
+            assert [f.name for f in video] == [
+                f"{i:0{10}}_video.ts" for i in range(3)]
+            assert len(audio) == 3
+            assert not missing
+
+            video, audio, missing = merger.pending(6)
+            assert 3 not in [int(f.stem[:-6]) for f in video]
+            assert len(video) == len(audio) == 5
+            assert missing
+
+            merger.chunks.append({"first": 0, "last": 4})
+            assert merger.next_seq == 5
+            video, audio, missing = merger.pending(6)
+            assert len(video) == len(audio) == 1
+            assert not missing
+
+    @patch("livestream_saver.merge.rename_thumbnail")
+    @patch("livestream_saver.merge.mux_tracks")
+    def test_finalize_keeps_sources(self, mux_mock, _):
+        def fake_write_chunk(self, segment_list, first, last, track):
+            chunk = self.chunk_dir / f"{first:0{10}}-{last:0{10}}_{track}.ts"
+            chunk.write_bytes(b"".join(f.read_bytes() for f in segment_list))
+            return chunk, []
+
+        with TemporaryDirectory() as tmp, \
+        patch.object(RollingMerger, "write_chunk", fake_write_chunk):
+            data_dir = Path(tmp)
+            (data_dir / "vid").mkdir()
+            for i in range(6):
+                (data_dir / "vid" / f"{i:0{10}}_video.ts").write_bytes(b"v")
+
+            merger = RollingMerger(data_dir, "abc", delete_source=True)
+            merger.roll(upto=3)
+            # Sources of chunks rolled during the download are deleted
+            assert len(collect(data_dir / "vid")) == 3
+            merger.finalize()
+            # But not those of the last chunk, before the final file exists
+            assert len(collect(data_dir / "vid")) == 3
+            assert len(merger.kept_sources) == 1
+
+            # Final file failed, sources kept
+            merger.chunks = merger.chunks[:1]
+            merger.write_manifest()
+            mux_mock.return_value = None
+            assert merge_chunks(
+                {"id": "abc"}, data_dir, data_dir, delete_source=True) is None
+            assert len(collect(data_dir / "vid")) == 3
+
+            mux_mock.return_value = data_dir / "abc.mp4"
+            assert merge_chunks(
+                {"id": "abc"}, data_dir, data_dir, delete_source=True)
+            assert not (data_dir / "vid").exists()
+
+            # With an incomplete chunk, sources of complete ones still go
+            (data_dir / "vid").mkdir()
+            for i in range(6):
+                (data_dir / "vid" / f"{i:0{10}}_video.ts").write_bytes(b"v")
+            merger = RollingMerger(data_dir, "abc", delete_source=True)
+            merger.chunks = [{"first": 0, "last": 2, "clean": False}]
+            merger.finalize()
+            cleanup_chunks(merger, keep_concat=True, delete_source=True)
+            assert len(collect(data_dir / "vid")) == 3
+
+
+class TestSplitMerge(TestCase):
+    def test_split_ranges(self):
+        assert split_ranges([], 4) == []
+        assert split_ranges([5, 6, 7], 10) == [(5, 5), (6, 6), (7, 7)]
+        # Gaps are covered by the range they fall in
+        assert split_ranges([0, 1, 2, 3, 7, 8, 9, 10], 2) == [(0, 6), (7, 10)]
+        assert split_ranges(list(range(10)), 3) == [(0, 2), (3, 5), (6, 9)]
+
+    def test_part_output_path(self):
+        final = Path("/out") / ("a" * 251 + ".mp4")
+        part = get_part_output_path(final, 3, 12)
+        assert part.name.endswith(" (part 03-12).mp4")
+        assert len(part.name) <= 255
+
+    @patch("livestream_saver.merge.init_merge")
+    @patch("livestream_saver.merge.mux_tracks")
+    def test_split_merge_parts(self, mux_mock, _):
+        mux_mock.side_effect = lambda inputs, info, data_dir, output: output
+
+        def fake_write_chunk(self, segment_list, first, last, track):
+            chunk = self.chunk_dir / f"{first:0{10}}-{last:0{10}}_{track}.ts"
+            chunk.write_bytes(b"".join(f.read_bytes() for f in segment_list))
+            return chunk, []
+
+        with TemporaryDirectory() as tmp, \
+        patch.object(RollingMerger, "write_chunk", fake_write_chunk):
+            data_dir = Path(tmp)
+            (data_dir / "vid").mkdir()
+            for i in range(10, 20):
+                (data_dir / "vid" / f"{i:0{10}}_video.ts").write_bytes(
+                    bytes([i]))
+
+            with patch("livestream_saver.merge.disk_usage") as usage_mock:
+                usage_mock.return_value = Mock(free=SPACE_MARGIN)
+                with self.assertRaises(InsufficientSpaceError):
+                    split_merge({"id": "abc"}, data_dir, parts=3)
+            assert not RollingMerger(data_dir, "abc").chunks
+
+            parts = split_merge(
+                {"id": "abc"}, data_dir, parts=3, join=False, max_workers=2,
+                keep_concat=True)
+            assert [p.name for p in parts] == [
+                "abc (part 1-3).mp4", "abc (part 2-3).mp4", "abc (part 3-3).mp4"]
+
+            merger = RollingMerger(data_dir, "abc")
+            assert [(c["first"], c["last"]) for c in merger.chunks] == [
+                (10, 12), (13, 15), (16, 19)]
+            assert (merger.chunk_dir / merger.chunks[2]["video"]).read_bytes() \
+                == bytes(range(16, 20))
+            assert merger.next_seq == 20
+
+
+class TestFFmpegRunner(TestCase):
+    def test_parse_progress_line(self):
+        progress = ffmpeg_runner.Progress(expected=200.0)
+        for line in ("frame=1200", "fps=N/A", "total_size=1048576",
+                     "out_time_us=50000000", "speed=12.5x"):
+            assert ffmpeg_runner.parse_progress_line(line, progress)
+        assert ffmpeg_runner.parse_progress_line(
+            "[mpegts @ 0x55] Packet corrupt (stream = 0)", progress) is None
+        assert (progress.frame, progress.total_size) == (1200, 1048576)
+        assert progress.out_time == 50.0 and progress.speed == 12.5
+        assert progress.percent == 25.0
+
+    def test_run(self):
+        with TemporaryDirectory() as tmp:
+            fake_ffmpeg = Path(tmp) / "ffmpeg"
+            fake_ffmpeg.write_text(
+                "#!/bin/sh\n"
+                "[ \"$1 $2 $3\" = \"-progress pipe:2 -nostats\" ] || exit 2\n"
+                "i=0\n"
+                "while [ $i -lt 300 ]; do\n"
+                "  echo \"Packet corrupt $i\" >&2\n"
+                "  printf 'out_time_us=%s000000\\nprogress=continue\\n' $i >&2\n"
+                "  i=$((i+1))\n"
+                "done\n"
+                "echo 'progress=end' >&2\n"
+                "exit $4\n")
+            fake_ffmpeg.chmod(0o755)
+
+            reports = []
+            result = ffmpeg_runner.run(
+                [str(fake_ffmpeg), "0"],
+                patterns=["Packet corrupt", "Non-monotonous DTS"],
+                on_progress=lambda p: reports.append(p.out_time),
+                tail_lines=10)
+            assert result.returncode == 0
+            assert result.matches == {"Packet corrupt": 300}
+            assert result.tail[-1] == "Packet corrupt 299"
+            assert len(result.tail) == 10
+            assert result.lines == 300 * 3 + 1
+            assert len(reports) == 301 and reports[-1] == 299.0
+            assert result.progress.done
+
+            with self.assertRaises(CalledProcessError) as cm:
+                ffmpeg_runner.run([str(fake_ffmpeg), "1"], tail_lines=1)
+            assert cm.exception.stderr == "Packet corrupt 299"
+
+
+class TestMergeQueue(TestCase):
+    @patch("livestream_saver.merge_queue.merge")
+    def test_merge_queue(self, merge_mock):
+        with TemporaryDirectory() as tmp:
+            state_path = Path(tmp) / "merge_queue.json"
+            job = MergeJob(data_dir=tmp, info={"id": "abc"})
+            results = []
+
+            merge_mock.return_value = Path(tmp) / "out.mp4"
+            queue = MergeQueue(state_path=state_path)
+            queue.submit(job, callback=lambda j, r: results.append((j, r)))
+            queue.shutdown()
+
+            assert results == [(job, Path(tmp) / "out.mp4")]
+            assert merge_mock.call_args.kwargs["data_dir"] == Path(tmp)
+            # Finished jobs are removed from the persisted queue
+            assert load(open(state_path)) == []
+
+            # Jobs left over by a previous run are resumed
+            with open(state_path, "w") as fp:
+                fp.write(
+                    f'[{{"data_dir": "{tmp}", "info": {{"id": "abc"}}}}]')
+            queue = MergeQueue(
+                state_path=state_path,
+                on_done=lambda j, r: results.append((j, r)))
+            assert queue.resume() == 1
+            queue.shutdown()
+            assert results[-1][0] == job
+
+    @patch("livestream_saver.merge_queue.merge")
+    def test_deferred(self, merge_mock):
+        with TemporaryDirectory() as tmp:
+            state_path = Path(tmp) / "merge_queue.json"
+            job = MergeJob(data_dir=tmp, info={"id": "abc"})
+            done, deferred = [], []
+            merge_mock.side_effect = [
+                InsufficientSpaceError(Path(tmp), 2, 1), Path(tmp) / "out.mp4"]
+            queue = MergeQueue(
+                state_path=state_path,
+                on_done=lambda j, r: done.append(r),
+                on_deferred=lambda j, e: deferred.append(e.needed),
+                retry_delay=60)
+            with patch("livestream_saver.merge_queue.threading.Timer") \
+            as timer_mock:
+                queue.submit(job)
+                # Jobs run in order on the single worker
+                queue._executor.submit(lambda: None).result()
+            assert deferred == [2]
+            assert done == []
+            assert queue.pending == [job]
+            delay, retry = timer_mock.call_args.args
+            assert delay == 60
+            assert retry == queue._retry
+            timer_mock.return_value.start.assert_called_once()
+
+            # Timer fired
+            retry(*timer_mock.call_args.kwargs["args"])
+            queue.shutdown()
+            assert done == [Path(tmp) / "out.mp4"]
+            assert merge_mock.call_count == 2
+            assert queue.pending == []
+
+            # Without a retry delay, deferred jobs are dropped
+            for retry_delay in (None, 0):
+                merge_mock.side_effect = InsufficientSpaceError(
+                    Path(tmp), 2, 1)
+                queue = MergeQueue(
+                    state_path=state_path, retry_delay=retry_delay)
+                queue.submit(job)
+                queue.shutdown()
+                assert queue.pending == []
+                assert load(open(state_path)) == []
+
+
+class TestDiskSpace(TestCase):
+    def test_estimate_space(self):
+        with TemporaryDirectory() as tmp:
+            data_dir = Path(tmp)
+            (data_dir / "vid").mkdir()
+            (data_dir / "vid" / "0000000000_video.ts").write_bytes(bytes(1000))
+            (data_dir / "vid" / "0000000001_video.ts").write_bytes(bytes(500))
+            (data_dir / "metadata.json").write_bytes(bytes(100))
+            output_dir = data_dir / "not_created_yet"
+
+            assert estimate_space(data_dir, output_dir) == {
+                data_dir: 3000 + SPACE_MARGIN}
+            # A single range needs its concat and chunk files at once
+            assert estimate_space(data_dir, output_dir, progressive=True) == {
+                data_dir: 3000 + SPACE_MARGIN}
+            # Everything is on the same filesystem: the final file is the
+            # largest need, chunks replacing sources as they go.
+            with patch("livestream_saver.merge.PROGRESSIVE_RANGE_BYTES", 500):
+                assert estimate_space(
+                    data_dir, output_dir, progressive=True
+                ) == {data_dir: 1500 + SPACE_MARGIN}
+            # Chunks and the final file are on disk at the same time
+            assert estimate_space(data_dir, output_dir, split=True) == {
+                data_dir: 3000 + SPACE_MARGIN}
+
+            with patch("livestream_saver.merge.disk_usage") as usage_mock:
+                usage_mock.return_value = Mock(free=2000 + SPACE_MARGIN)
+                with patch("livestream_saver.merge.PROGRESSIVE_RANGE_BYTES", 500):
+                    check_free_space(data_dir, output_dir, progressive=True)
+                with self.assertRaises(InsufficientSpaceError) as cm:
+                    check_free_space(data_dir, output_dir)
+                assert cm.exception.needed == 3000 + SPACE_MARGIN
+
+    @patch("livestream_saver.merge.PROGRESSIVE_RANGE_BYTES", 200)
+    @patch("livestream_saver.merge.merge_chunks")
+    def test_progressive_merge(self, merge_chunks_mock):
+        deleted_before = []
+
+        def fake_write_chunk(self, segment_list, first, last, track):
+            # Sources of previous ranges are gone by the time a range is written
+            deleted_before.append(len(collect(self.data_dir / "vid")))
+            chunk = self.chunk_dir / f"{first:0{10}}-{last:0{10}}_{track}.ts"
+            chunk.write_bytes(b"".join(f.read_bytes() for f in segment_list))
+            return chunk, []
+
+        with TemporaryDirectory() as tmp, \
+        patch.object(RollingMerger, "write_chunk", fake_write_chunk):
+            data_dir = Path(tmp)
+            (data_dir / "vid").mkdir()
+            for i in range(8):
+                (data_dir / "vid" / f"{i:0{10}}_video.ts").write_bytes(bytes(100))
+
+            progressive_merge({"id": "abc"}, data_dir, data_dir)
+            assert deleted_before == [8, 6, 4, 2]
+            assert collect(data_dir / "vid") == []
+            assert len(RollingMerger(data_dir, "abc").chunks) == 4
+            assert merge_chunks_mock.call_args.kwargs["delete_source"]
+
+
+class TestBatchMerge(TestCase):
+    @patch("livestream_saver.merge_queue.merge")
+    def test_batch_merge(self, merge_mock):
+        with TemporaryDirectory() as tmp:
+            root = Path(tmp)
+            for video_id in ("aaa", "bbb", "ccc"):
+                (root / f"stream_capture_{video_id}").mkdir()
+            (root / "not_a_capture").mkdir()
+            # Already merged, with only the id known from the directory name
+            (root / "stream_capture_aaa" / "aaa.mp4").touch()
+
+            def fake_merge(info, data_dir, **kwargs):
+                if info["id"] == "ccc":
+                    raise Exception("merge failed")
+                return data_dir / f"{info['id']}.mp4"
+            merge_mock.side_effect = fake_merge
+
+            report = batch_merge(root, max_workers=2)
+            assert merge_mock.call_count == 2
+            assert (report["merged"], report["skipped"], report["failed"]) \
+                == (1, 1, 1)
+            statuses = {
+                Path(job["data_dir"]).name: job["status"]
+                for job in report["jobs"]}
+            assert statuses == {
+                "stream_capture_aaa": "skipped",
+                "stream_capture_bbb": "merged",
+                "stream_capture_ccc": "failed",
+            }
+            assert load(open(root / "merge_report.json"))["merged"] == 1
+
+
+class TestConcatFiles(TestCase):
+    def test_concat_backends(self):
+        with TemporaryDirectory() as tmp:
+            tmp = Path(tmp)
+            segments = []
+            for i, size in enumerate((4096, 1000, 4096, 188 * 7, 0, 5000)):
+                segment = tmp / f"{i:0{10}}_video.ts"
+                segment.write_bytes(bytes([i]) * size)
+                segments.append(segment)
+            expected = b"".join(p.read_bytes() for p in segments)
+
+            for backend in [None] + available_backends():
+                dest = tmp / f"concat_{backend}.ts"
+                used = concat_files(segments, dest, backend=backend)
+                assert sum(used.values()) == len(segments)
+                assert dest.read_bytes() == expected, backend
+
+    def test_short_copy(self):
+        calls = []
+
+        def short_copy_file_range(src_fd, dst_fd, count):
+            # Copies part of the segment, then nothing more
+            calls.append(count)
+            if len(calls) > 1:
+                return 0
+            return os.write(dst_fd, os.read(src_fd, min(count, 100)))
+
+        with TemporaryDirectory() as tmp, patch(
+            "livestream_saver.concat.os.copy_file_range",
+            short_copy_file_range, create=True
+        ):
+            tmp = Path(tmp)
+            segments = []
+            for i in range(2):
+                segment = tmp / f"{i:0{10}}_video.ts"
+                segment.write_bytes(bytes([i + 1]) * 1000)
+                segments.append(segment)
+            dest = tmp / "concat.ts"
+            used = concat_files(segments, dest, backend="copy_file_range")
+            assert used == {"copy": 2}
+            assert dest.read_bytes() == b"".join(
+                p.read_bytes() for p in segments)
+
+
+class TestProbeStreams(TestCase):
+    @patch("livestream_saver.merge.subprocess.run")
+    def test_probe_streams(self, run_mock):
+        run_mock.return_value = Mock(stdout=(
+            "[STREAM]\nindex=0\ncodec_name=h264\ncodec_type=video\n"
+            "start_time=1.400000\nduration=3600.033333\n"
+            "DISPOSITION:attached_pic=0\n[/STREAM]\n"
+            "[STREAM]\nindex=1\ncodec_name=aac\ncodec_type=audio\n"
+            "start_time=1.400000\nduration=3599.980000\n"
+            "DISPOSITION:attached_pic=0\n[/STREAM]\n"
+            "[STREAM]\nindex=2\ncodec_name=png\ncodec_type=video\n"
+            "start_time=N/A\nduration=N/A\n"
+            "DISPOSITION:attached_pic=1\n[/STREAM]\n"
+        ))
+        streams = probe_streams(Path("final.mp4"))
+        assert [s["codec_name"] for s in streams] == ["h264", "aac", "png"]
+        assert streams[0]["duration"] == 3600.033333
+        assert streams[1]["codec_type"] == "audio"
+        assert not streams[0]["attached_pic"]
+        assert streams[2]["attached_pic"]
+        assert streams[2]["duration"] == 0.0
+
+
+def make_ts_packet(pid: int, pts=None, pcr=None, stream_id=0xe0) -> bytes:
+    """Build a 188 bytes TS packet, starting a PES if pts is given."""
+    header = bytearray([0x47, (0x40 if pts is not None else 0) | pid >> 8,
+                        pid & 0xff, 0x10])
+    if pcr is not None:
+        header[3] = 0x30
+        header += bytes([7, 0x10, (pcr >> 25) & 0xff, (pcr >> 17) & 0xff,
+                         (pcr >> 9) & 0xff, (pcr >> 1) & 0xff,
+                         (pcr & 1) << 7, 0])
+    payload = b""
+    if pts is not None:
+        payload = bytes([0, 0, 1, stream_id, 0, 0, 0x80, 0x80, 5,
+                         0x21 | ((pts >> 29) & 0x0e), (pts >> 22) & 0xff,
+                         ((pts >> 14) & 0xfe) | 1, (pts >> 7) & 0xff,
+                         ((pts << 1) & 0xfe) | 1])
+    return bytes(header + payload).ljust(188, b"\xff")
+
+
+def write_ts_segment(path: Path, start: int, frames: int = 60) -> None:
+    """Write a MPEG-TS segment of video and audio, 2 seconds by default."""
+    # 30 fps video, with B-frames reordering the first timestamps
+    order = [0, 2, 1] + list(range(3, frames))
+    with open(path, "wb") as f:
+        f.write(make_ts_packet(0))  # PAT-like filler
+        for i in order:
+            pts = (start + i * 3000) % TIMESTAMP_WRAP
+            f.write(make_ts_packet(0x100, pts=pts, pcr=pts))
+            f.write(make_ts_packet(0x100))
+            f.write(make_ts_packet(0x101, pts=pts, stream_id=0xc0))
+
+
+class TestMpegTS(TestCase):
+    def test_duration_table(self):
+        with TemporaryDirectory() as tmp:
+            segments = []
+            for i in range(5):
+                segment = Path(tmp) / f"{i:0{10}}_video.ts"
+                # 2 seconds per segment
+                write_ts_segment(segment, 126000 + i * 180000)
+                segments.append(segment)
+
+            span = read_timestamps(segments[0])
+            assert span.start == 126000
+            assert span.duration == 2.0
+
+            # Segment 3 is missing, but its time still counts in the total
+            del segments[3]
+            table = DurationTable.from_segments(segments, [0, 1, 2, 4])
+            assert table.segment_duration(0) == 2.0
+            assert table.median_duration == 2.0
+            assert table.total_duration(0, 4) == 10.0
+
+    def test_timestamp_wrap(self):
+        with TemporaryDirectory() as tmp:
+            segment = Path(tmp) / "0000000000_video.ts"
+            write_ts_segment(segment, TIMESTAMP_WRAP - 90000)
+            assert read_timestamps(segment).duration == 2.0
+
+    def test_audio_only(self):
+        with TemporaryDirectory() as tmp:
+            segment = Path(tmp) / "0000000000_audio.ts"
+            # 2 seconds of AAC frames of 1920 ticks
+            with open(segment, "wb") as f:
+                for i in range(94):
+                    f.write(make_ts_packet(
+                        0x101, pts=90000 + i * 1920, stream_id=0xc0))
+                    f.write(make_ts_packet(0x101))
+                    f.write(make_ts_packet(0x101))
+            with patch.object(
+                mpegts, "parse_pts", wraps=mpegts.parse_pts
+            ) as parse_mock:
+                span = read_timestamps(segment)
+            assert span.start == 90000
+            assert span.duration == 94 * 1920 / 90000
+            # Only the head and the tail of the segment were read
+            assert parse_mock.call_count <= VIDEO_PROBE_PACKETS + 3 * 8
+
+    def test_not_mpegts(self):
+        with TemporaryDirectory() as tmp:
+            segment = Path(tmp) / "0000000000_video.ts"
+            segment.write_bytes(b"\x00" * 188 * 10)
+            assert read_timestamps(segment) is None
+            assert DurationTable.from_segments([segment], [0]) is None
+
+
+class TestSidecar(TestCase):
+    def test_sidecar(self):
+        with TemporaryDirectory() as tmp:
+            data_dir = Path(tmp)
+            (data_dir / "vid").mkdir()
+            writer = SidecarWriter(data_dir / SIDECAR_NAME)
+            files = []
+            for seq in (0, 1, 2, 4):
+                segment = data_dir / "vid" / f"{seq:0{10}}_video.ts"
+                segment.write_bytes(b"\x47" * 1000)
+                files.append(segment)
+                writer.append(SegmentRecord(
+                    seq=seq, track="video", status=200, size=1000,
+                    duration=2.0, lmt=1690000000000000 + seq))
+            # Resumed download rewrote segment 1, truncated afterwards
+            writer.append(SegmentRecord(
+                seq=1, track="video", status=200, size=1200, duration=2.0))
+            writer.append(SegmentRecord(
+                seq=0, track="audio", status=204, size=0))
+            # Partial record still being written
+            with open(data_dir / SIDECAR_NAME, "ab") as f:
+                f.write(b"\x00" * 10)
+
+            sidecar = SegmentSidecar.load(data_dir)
+            assert sidecar.track("video")[1].size == 1200
+            assert sidecar.track("video")[4].lmt == 1690000000000004
+            assert sidecar.missing("video") == [3]
+            assert sidecar.missing("audio") == [0]
+            # The missing segment counts for the median duration
+            assert sidecar.total_duration("video", 0, 4) == 10.0
+            assert sidecar.total_duration("audio", 0, 0) is None
+            assert sidecar.suspects(files, "video") == [files[1]]
+
+    def test_no_sidecar(self):
+        with TemporaryDirectory() as tmp:
+            assert SegmentSidecar.load(Path(tmp)) is None
+            (Path(tmp) / SIDECAR_NAME).write_bytes(b"garbage")
+            assert SegmentSidecar.load(Path(tmp)) is None
+
+
+class TestExpectedDuration(TestCase):
+    @patch("livestream_saver.merge.run_ffmpeg")
+    @patch("livestream_saver.merge.probe")
+    def test_probed_once(self, probe_mock, run_mock):
+        with TemporaryDirectory() as tmp:
+            data_dir = Path(tmp)
+            segments = []
+            for i in range(4):
+                segments.append(data_dir / f"{i:0{10}}_video.ts")
+                # Neither MPEG-TS nor recorded in a sidecar
+                segments[-1].write_bytes(bytes(100))
+            probe_mock.return_value = {"duration": 8.0}
+            concat = NativeConcatFile(segments, "h264", "abc", data_dir)
+            concat.run_ffmpeg(["ffmpeg"])
+            concat.run_ffmpeg(["ffmpeg"])
+            assert run_mock.call_args.kwargs["expected_duration"] == 8.0
+            assert probe_mock.call_count == 1
+
+            # Computed again once the last segment was dropped as corrupt
+            probe_mock.return_value = {"duration": 6.0}
+            concat.segment_list = segments[:3]
+            assert concat.total_expected_duration == 6.0
+            assert probe_mock.call_count == 2
+
+
+class TestMergeCheckpoint(TestCase):
+    @patch("livestream_saver.merge.probe")
+    def test_checkpoint(self, probe_mock):
+        with TemporaryDirectory() as tmp:
+            data_dir = Path(tmp)
+            inputs = []
+            for i in range(3):
+                inputs.append(data_dir / f"{i:0{10}}_video.ts")
+                inputs[-1].write_bytes(bytes(100))
+            output = data_dir / "out.mp4"
+            output.write_bytes(bytes(300))
+
+            checkpoint = MergeCheckpoint(data_dir)
+            assert checkpoint.done("final", output, inputs) is None
+            checkpoint.record("final", output, inputs, duration=6.0, problem=None)
+
+            # Reloaded from disk by the next run
+            checkpoint = MergeCheckpoint(data_dir)
+            probe_mock.return_value = {"duration": 6.0}
+            assert checkpoint.done("final", output, inputs)["problem"] is None
+            # Output with a different duration
+            probe_mock.return_value = {"duration": 3.0}
+            assert checkpoint.done("final", output, inputs) is None
+            probe_mock.return_value = {"duration": 6.0}
+            # Different inputs
+            assert checkpoint.done("final", output, inputs[:2]) is None
+            # Partially written output
+            output.write_bytes(bytes(200))
+            assert checkpoint.done("final", output, inputs) is None
+
+            checkpoint.record_failure("single_pass", inputs)
+            assert checkpoint.failed("single_pass", inputs)
+            assert not checkpoint.failed("single_pass", inputs[1:])
+            checkpoint.clear()
+            assert not (data_dir / "merge_checkpoint.json").exists()
+            assert MergeCheckpoint(data_dir).stages == {}
+
+    def test_native_concat_resume(self):
+        with TemporaryDirectory() as tmp:
+            data_dir = Path(tmp)
+            segments = []
+            for i in range(3):
+                segments.append(data_dir / f"{i:0{10}}_video.ts")
+                segments[-1].write_bytes(bytes([i]) * 10)
+            checkpoint = MergeCheckpoint(data_dir)
+            track = NativeConcatFile(
+                segments, "h264", "abc", data_dir, checkpoint=checkpoint)
+
+            # Left over by an interrupted run, without checkpoint entry
+            track.temp_concat.write_bytes(b"partial")
+            track.native_concat()
+            assert track.temp_concat.stat().st_size == 30
+
+            with patch("livestream_saver.merge.concat_files") as concat_mock:
+                track.native_concat()
+                concat_mock.assert_not_called()
+
+
+class TestSegmentIndex(TestCase):
+    def test_segment_index(self):
+        with TemporaryDirectory() as tmp:
+            data_dir = Path(tmp)
+            for track, name in (("vid", "video"), ("aud", "audio")):
+                (data_dir / track).mkdir()
+                for i in range(12):
+                    if (track, i) in (("vid", 3), ("aud", 7), ("aud", 8)):
+                        continue
+                    (data_dir / track / f"{i:0{10}}_{name}.ts").write_bytes(
+                        b"\x47" * (i + 1))
+            (data_dir / "vid" / "notes.txt").write_text("not a segment")
+            (data_dir / "vid" / "0000000012_video.ts.part").write_bytes(b"")
+
+            video = SegmentIndex.scan(data_dir / "vid")
+            audio = SegmentIndex.scan(data_dir / "aud")
+            assert list(video) == [i for i in range(12) if i != 3]
+            assert video.missing() == [3]
+            assert audio.missing() == [7, 8]
+            assert video.paths() == collect(data_dir / "vid")
+            assert video.total_size == sum(i + 1 for i in range(12) if i != 3)
+            assert list(video.between(2, 6)) == [2, 4, 5]
+            assert list(video.without({0, 11})) == list(video)[1:-1]
+
+            affected, missing_video, missing_audio = compare_tracks(video, audio)
+            assert affected == [3, 7, 8]
+            assert missing_video == [3]
+            assert missing_audio == [7, 8]
+
+            # Checkpoints made from file lists remain valid
+            assert video.signature() == files_signature(video.paths())
+            assert combined_signature(video, audio) \
+                == files_signature(video.paths() + audio.paths())
+
+            assert not SegmentIndex.scan(data_dir / "missing")
+
+
+class TestLivePlaylist(TestCase):
+    def test_live_playlist(self):
+        with TemporaryDirectory() as tmp:
+            data_dir = Path(tmp)
+            for track in ("vid", "aud"):
+                (data_dir / track).mkdir()
+
+            playlist = LivePlaylist(data_dir)
+            for i in (0, 1, 3):
+                # 60 frames at 30 fps
+                for track, name in (("vid", "video"), ("aud", "audio")):
+                    write_ts_segment(
+                        data_dir / track / f"{i:0{10}}_{name}.ts",
+                        start=i * 180000)
+            for i in range(4):
+                # Segment 2 was never written
+                playlist.commit(i)
+
+            master = (data_dir / LIVE_PLAYLIST).read_text()
+            assert 'URI="aud/index.m3u8"' in master
+            assert master.rstrip().endswith("vid/index.m3u8")
+            media = (data_dir / "vid" / "index.m3u8").read_text()
+            assert "#EXT-X-TARGETDURATION:2" in media
+            assert media.count("#EXTINF:2.000,") == 3
+            assert media.index("#EXT-X-DISCONTINUITY") \
+                > media.index("0000000001_video.ts")
+            assert media.index("#EXT-X-DISCONTINUITY") \
+                < media.index("0000000003_video.ts")
+            playlist.finish()
+            assert (data_dir / "aud" / "index.m3u8").read_text() \
+                .endswith("#EXT-X-ENDLIST\n")
+
+            # Resuming the download makes the playlist live again
+            resumed = LivePlaylist(data_dir)
+            assert resumed.video.last_seq == 3
+            write_ts_segment(
+                data_dir / "vid" / f"{4:0{10}}_video.ts", start=4 * 180000)
+            resumed.video.append(4)
+            media = (data_dir / "vid" / "index.m3u8").read_text()
+            assert "#EXT-X-ENDLIST" not in media
+            assert media.count("#EXT-X-DISCONTINUITY") == 1
+            assert media.endswith("0000000004_video.ts\n")
+
+    def test_not_mpegts(self):
+        with TemporaryDirectory() as tmp:
+            data_dir = Path(tmp)
+            for track in ("vid", "aud"):
+                (data_dir / track).mkdir()
+            # Fragmented MP4, as downloaded from DASH formats
+            for track, name in (("vid", "video"), ("aud", "audio")):
+                (data_dir / track / f"{0:0{10}}_{name}.ts").write_bytes(
+                    b"\x00\x00\x00\x18ftypdash" + bytes(2000))
+            playlist = LivePlaylist(data_dir)
+            with self.assertLogs("livestream_saver.live_playlist", "WARNING"):
+                playlist.commit(0)
+            assert playlist.video.unsupported
+            assert playlist.video.entries == []
+            assert not (data_dir / LIVE_PLAYLIST).exists()
+            assert not (data_dir / "vid" / "index.m3u8").exists()
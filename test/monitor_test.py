@@ -1,22 +1,44 @@
 import unittest
-from unittest.mock import patch, Mock
+from unittest.mock import patch, Mock, PropertyMock
 from pathlib import Path
+from tempfile import TemporaryDirectory
 from json import load
+from time import sleep, time, monotonic
+import threading
 
 # from urllib.request import urlopen
-from urllib.error import URLError
+from urllib.error import URLError, HTTPError
 
 
 from livestream_saver.channel import (
     YoutubeChannel,
     VideoPost,
     DedupedVideoList,
+    ChannelFeed,
+    _get_content_from_any_renderer,
     get_endpoints_from_json,
 )
-from livestream_saver.request import YoutubeUrllibSession
-from livestream_saver.exceptions import MissingVideoId
+from livestream_saver.request import YoutubeUrllibSession, SessionPool
+from livestream_saver.scheduler import (
+    ChannelScheduler, UpcomingPoller, poll_delay, POLL_INTERVAL, RAMP_UP,
+    MAX_POLL_INTERVAL, GIVE_UP_AFTER
+)
+from livestream_saver.extract import (
+    extract_embedded_json, initial_player_response, initial_data
+)
+from livestream_saver.dispatcher import DownloadDispatcher
+from livestream_saver.enricher import MetadataEnricher, RateLimiter
+from livestream_saver.state import (
+    StateStore, PROCESSED, PROCESSING, SKIPPED, FAILED
+)
+from livestream_saver.exceptions import MissingVideoId, TabNotFound
 from livestream_saver.notifier import NotificationDispatcher
-from livestream_saver.livestream_saver import monitor_mode
+from livestream_saver import livestream_saver as ls_main
+from livestream_saver.livestream_saver import (
+    monitor_mode, get_monitor_sections, init_config, download_task,
+    trigger_merge_hooks
+)
+from livestream_saver.merge_queue import MergeJob
 
 
 # API_RESPONSE_SAMPLE = None
@@ -263,6 +285,41 @@ class TestGetVideosFromTabs(unittest.TestCase):
         self.assertEqual(len(videos), 1)
         self.assertEqual(videos[0].videoId, "nested_id")
 
+    def test_renderer_walk_order_pruning_and_limit(self):
+        def renderer(videoId, **extra):
+            return {"videoRenderer": {
+                "videoId": videoId,
+                "title": {"runs": [{"text": videoId}]},
+                "navigationEndpoint": {"commandMetadata": {}},
+                **extra
+            }}
+
+        content = {
+            "sectionListRenderer": {"contents": [
+                renderer("first"),
+                {"menu": renderer("in_menu")},
+                [renderer("second"), renderer("first")],
+                {"shelf": {"items": [renderer("third")]}},
+            ]}
+        }
+        channel = Mock()
+        type(channel).name = name = PropertyMock(
+            return_value="channel name")
+
+        videos = _get_content_from_any_renderer("Home", content, channel)
+        self.assertEqual(
+            [v.videoId for v in videos], ["first", "second", "third"])
+        self.assertEqual(videos[0].channel_name, "channel name")
+        name.assert_called_once()
+
+        videos = _get_content_from_any_renderer(
+            "Home", content, channel, limit=2)
+        self.assertEqual([v.videoId for v in videos], ["first", "second"])
+
+        videos = _get_content_from_any_renderer(
+            "Home", content, channel, pruned_keys=frozenset())
+        self.assertIn("in_menu", [v.videoId for v in videos])
+
     def test_get_videos_from_tab_returns_empty_list_for_empty_home_tab(self):
         """
         An offline channel may still expose a Home tab without any video cards.
@@ -330,6 +387,87 @@ class TestGetVideosFromTabs(unittest.TestCase):
         self.assertEqual(videos[0].videoId, "videos_fixture_1")
         self.assertEqual(videos[0].title, "Videos fixture title")
 
+    @patch("livestream_saver.channel.YoutubeChannel.get_videos_from_tab")
+    @patch("livestream_saver.channel.YoutubeChannel.load_endpoints")
+    @patch("livestream_saver.channel.YoutubeChannel.get_tab_json_from_api")
+    def test_tabs_are_fetched_concurrently(
+        self,
+        get_tab_json_from_api: Mock,
+        load_endpoints: Mock,
+        get_videos_from_tab: Mock,
+    ):
+        """
+        A live video found in the Home tab is reported before slower tabs are
+        fetched, and tabs taking too long are skipped.
+        """
+        videos_released = threading.Event()
+
+        def fetch(tab_name):
+            if tab_name == "Videos":
+                videos_released.wait(5)
+            if tab_name == "Community":
+                raise TabNotFound(tab_name)
+            return {"tab": tab_name}
+
+        get_tab_json_from_api.side_effect = fetch
+        get_videos_from_tab.side_effect = lambda tabtype, tabs: \
+            [self.video_post1] if tabtype == "Home" else [self.video_post2]
+
+        found = []
+
+        def on_found(video):
+            # Videos tab still pending
+            found.append((video.videoId, videos_released.is_set()))
+
+        self.ch.tab_timeout = 0.3
+        videos = self.ch.filter_videos('isLiveNow', on_found=on_found)
+        videos_released.set()
+
+        self.assertEqual(found, [("test_id1", False), ("test_id2", False)])
+        self.assertEqual([v.videoId for v in videos], ["test_id1", "test_id2"])
+        # Home, Membership and Live, Community is missing and Videos too slow
+        self.assertEqual(get_videos_from_tab.call_count, 3)
+        # Endpoints reloaded for the missing Community tab
+        self.assertEqual(load_endpoints.call_count, 2)
+
+    @patch("livestream_saver.channel.YoutubeChannel.get_videos_from_tab")
+    @patch("livestream_saver.channel.YoutubeChannel.load_endpoints")
+    @patch("livestream_saver.channel.YoutubeChannel.get_tab_json_from_api")
+    def test_timed_out_tabs_are_not_requested_again(
+        self,
+        get_tab_json_from_api: Mock,
+        load_endpoints: Mock,
+        get_videos_from_tab: Mock,
+    ):
+        videos_released = threading.Event()
+        requested = []
+
+        def fetch(tab_name):
+            requested.append(tab_name)
+            if tab_name == "Videos":
+                videos_released.wait(5)
+            return {"tab": tab_name}
+
+        get_tab_json_from_api.side_effect = fetch
+        get_videos_from_tab.return_value = []
+        self.ch.tab_timeout = 0.2
+
+        self.ch.filter_videos('isLiveNow')
+        pool = self.ch._tab_pool
+        self.ch.filter_videos('isLiveNow')
+        # Same pool, and the Videos request of the first scan is awaited again
+        self.assertIs(self.ch._tab_pool, pool)
+        self.assertEqual(requested.count("Videos"), 1)
+        self.assertEqual(requested.count("Home"), 2)
+        # The last tab processed is cached, whichever finished last
+        self.assertEqual(self.ch._cached_json_tab, "Live")
+        self.assertEqual(self.ch._cached_json, {"tab": "Live"})
+
+        videos_released.set()
+        self.ch.close()
+        self.assertIsNone(self.ch._tab_pool)
+        pool.shutdown(wait=True)
+
     @patch("livestream_saver.channel.YoutubeChannel.warn_of_new")
     @patch("livestream_saver.channel.YoutubeChannel.get_videos_from_tab")
     @patch("livestream_saver.channel.get_tabs_from_json")
@@ -482,6 +620,630 @@ class TestGetVideosFromTabs(unittest.TestCase):
     #     raise NotImplementedError
 
 
+class TestMonitorAllSections(unittest.TestCase):
+    def test_scheduler(self):
+        scans = []
+        running = set()
+        overlaps = []
+
+        def scan(target):
+            if target in running:
+                overlaps.append(target)
+            running.add(target)
+            scans.append(target)
+            sleep(0.02)
+            running.discard(target)
+            if target == "slow":
+                raise Exception("Scan failed")
+
+        scheduler = ChannelScheduler(scan, max_workers=2)
+        # Every 0.05 second, the other one less often
+        scheduler.add("fast", delay=0.05 / 60)
+        scheduler.add("slow", delay=0.3 / 60, first_in=0.1)
+        thread = threading.Thread(target=scheduler.run)
+        thread.start()
+        sleep(0.5)
+        scheduler.stop()
+        thread.join(timeout=5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(scans[0], "fast")
+        self.assertGreaterEqual(scans.count("fast"), 4)
+        # Failed scans are rescheduled as well
+        self.assertIn(scans.count("slow"), (1, 2))
+        self.assertEqual(overlaps, [])
+
+    @patch("livestream_saver.request.YoutubeUrllibSession._initialize_consent")
+    def test_session_pool(self, _initialize_consent):
+        pool = SessionPool()
+        self.assertIs(pool.get(None), pool.get(None))
+        with patch("livestream_saver.request.get_cookie"):
+            self.assertIsNot(pool.get("a.txt"), pool.get(None))
+        self.assertEqual(len(pool), 2)
+        self.assertEqual(_initialize_consent.call_count, 2)
+
+    def test_monitor_sections(self):
+        config = init_config()
+        config.read_string(
+            "[monitor]\n"
+            "[monitor first]\nURL = https://www.youtube.com/@first\n"
+            "[monitoring]\n"
+            "[monitor second]\nURL = https://www.youtube.com/@second\n")
+        self.assertEqual(get_monitor_sections(config), ["first", "second"])
+
+    @patch.object(ls_main, "NOTIFIER")
+    def test_merge_hooks_of_resumed_jobs(self, notifier: Mock):
+        notifier.get_webhook.return_value = None
+        default_hook, channel_hook = Mock(), Mock()
+        args = {
+            "hooks": {"on_merge_done": default_hook},
+            "channels": [
+                {"channel_id": "UC1", "cookies": "first.txt",
+                 "hooks": {"on_merge_done": channel_hook}},
+            ],
+        }
+        trigger_merge_hooks(
+            MergeJob(data_dir="capture", info={"id": "vid1"},
+                     channel_id="UC1"), args)
+        channel_hook.spawn_subprocess.assert_called_once()
+        metadata = channel_hook.spawn_subprocess.call_args.args[0]
+        self.assertEqual(metadata["cookiefile_path"], "first.txt")
+        default_hook.spawn_subprocess.assert_not_called()
+
+        # Jobs queued by a version that did not record the channel
+        trigger_merge_hooks(
+            MergeJob(data_dir="capture", info={"id": "vid2"}), args)
+        default_hook.spawn_subprocess.assert_called_once()
+
+
+class TestAdaptiveScan(unittest.TestCase):
+    def setUp(self) -> None:
+        self.now = 1_000_000.0
+        self.vid = VideoPost("upcoming")
+        self.vid.upcoming = True
+        self.vid.startTime = str(int(self.now + 3600))
+        self.channel = Mock()
+        self.channel.known_videos.return_value = [self.vid]
+        self.channel.scheduled_videos.return_value = [self.vid]
+        self.scheduler = Mock()
+        self.dispatch = Mock()
+        self.poller = UpcomingPoller(
+            self.scheduler, self.dispatch, clock=lambda: self.now)
+
+    def test_poll_delay(self):
+        self.assertEqual(poll_delay(1000.0, 0.0), 1000.0 - RAMP_UP)
+        self.assertEqual(poll_delay(100.0, 0.0), POLL_INTERVAL)
+        self.assertEqual(poll_delay(0.0, RAMP_UP), POLL_INTERVAL)
+        # Backs off the later it is
+        self.assertEqual(poll_delay(0.0, RAMP_UP * 2), POLL_INTERVAL * 2)
+        self.assertEqual(poll_delay(0.0, GIVE_UP_AFTER), MAX_POLL_INTERVAL)
+        self.assertIsNone(poll_delay(0.0, GIVE_UP_AFTER + 1))
+
+    def test_scheduler_uses_returned_delay(self):
+        polls = []
+
+        def scan(target):
+            polls.append(target)
+            # Poll 3 times, then stop
+            return 0.01 if len(polls) < 3 else None
+
+        scheduler = ChannelScheduler(scan)
+        scheduler.add("video", None)
+        thread = threading.Thread(target=scheduler.run)
+        thread.start()
+        sleep(0.2)
+        scheduler.stop()
+        thread.join(timeout=5)
+        self.assertEqual(polls, ["video"] * 3)
+
+    def test_video_is_polled_until_live(self):
+        self.assertTrue(self.poller.track(self.channel, {}))
+        self.scheduler.add.assert_called_once_with(
+            (self.channel, {}, self.vid), None, 3600 - RAMP_UP)
+        # Already polled
+        self.assertTrue(self.poller.track(self.channel, {}))
+        self.assertEqual(self.scheduler.add.call_count, 1)
+
+        self.now += 3600 - RAMP_UP
+        self.channel.poll_live_status.return_value = "upcoming"
+        self.assertEqual(
+            self.poller.poll(self.channel, {}, self.vid), POLL_INTERVAL)
+
+        self.channel.poll_live_status.return_value = "live"
+        self.assertIsNone(self.poller.poll(self.channel, {}, self.vid))
+        self.dispatch.assert_called_once_with(self.channel, {}, self.vid)
+        self.assertEqual(len(self.poller), 0)
+
+    def test_rescheduled_and_cancelled_videos(self):
+        self.poller.track(self.channel, {})
+        self.now += 3600
+        # Rescheduled one hour later
+        rescheduled = VideoPost("upcoming")
+        rescheduled.upcoming = True
+        rescheduled.startTime = str(int(self.now + 3600))
+        self.channel.scheduled_videos.return_value = [rescheduled]
+        self.poller.track(self.channel, {})
+        self.assertEqual(self.vid.startTime, rescheduled.startTime)
+        self.assertEqual(
+            self.poller.poll(self.channel, {}, self.vid), 3600 - RAMP_UP)
+        self.channel.poll_live_status.assert_not_called()
+
+        self.now += 3600
+        self.channel.poll_live_status.return_value = "gone"
+        self.assertIsNone(self.poller.poll(self.channel, {}, self.vid))
+        self.assertEqual(len(self.poller), 0)
+        self.dispatch.assert_not_called()
+
+    def test_video_found_live_by_scan_is_no_longer_polled(self):
+        self.poller.track(self.channel, {})
+        self.vid.isLiveNow = True
+        self.channel.scheduled_videos.return_value = []
+        self.assertFalse(self.poller.track(self.channel, {}))
+        self.assertIsNone(self.poller.poll(self.channel, {}, self.vid))
+        self.channel.poll_live_status.assert_not_called()
+
+    @patch("livestream_saver.channel.YoutubeChannel.fetch_video_metadata")
+    def test_poll_live_status(self, fetch_video_metadata: Mock):
+        channel = YoutubeChannel(
+            URL="",
+            channel_id="",
+            session=YoutubeUrllibSession(),
+            notifier=NotificationDispatcher()
+        )
+        fetch_video_metadata.return_value = {
+            "videoDetails": {"isUpcoming": True},
+            "playabilityStatus": {
+                "status": "LIVE_STREAM_OFFLINE",
+                "liveStreamability": {"liveStreamabilityRenderer": {
+                    "offlineSlate": {"liveStreamOfflineSlateRenderer": {
+                        "scheduledStartTime": "1234"
+                    }}
+                }}
+            }
+        }
+        self.assertEqual(channel.poll_live_status(self.vid), "upcoming")
+        self.assertEqual(self.vid.startTime, "1234")
+
+        fetch_video_metadata.return_value = {
+            "videoDetails": {"isLive": True},
+            "playabilityStatus": {"status": "OK"}
+        }
+        self.assertEqual(channel.poll_live_status(self.vid), "live")
+        self.assertTrue(self.vid.isLiveNow)
+
+        fetch_video_metadata.return_value = {
+            "playabilityStatus": {"status": "UNPLAYABLE"}
+        }
+        self.assertEqual(channel.poll_live_status(self.vid), "gone")
+        fetch_video_metadata.return_value = None
+        self.assertIsNone(channel.poll_live_status(self.vid))
+
+
+class TestExtractEmbeddedJson(unittest.TestCase):
+    HTML = (
+        '<html><script nonce="a">var ytInitialData = {"contents": '
+        '{"text": "}; var ytInitialPlayerResponse = {};"}};'
+        '</script><script nonce="b">var ytInitialPlayerResponse = '
+        '{"videoDetails": {"videoId": "abc"}};var meta = '
+        "document.createElement('meta');</script>"
+        '<script>window["ytInitialData"] = {"ignored": true};</script>'
+        '</html>'
+    )
+
+    def test_both_objects_in_one_pass(self):
+        found = extract_embedded_json(self.HTML)
+        self.assertEqual(
+            found["ytInitialData"],
+            {"contents": {"text": "}; var ytInitialPlayerResponse = {};"}})
+        self.assertEqual(
+            found["ytInitialPlayerResponse"],
+            {"videoDetails": {"videoId": "abc"}})
+
+    def test_player_response_is_preferred(self):
+        self.assertEqual(
+            initial_player_response(self.HTML)["videoDetails"]["videoId"], "abc")
+        self.assertIn("contents", initial_data(self.HTML))
+
+    def test_other_layouts(self):
+        html = '<script>window["ytInitialData"] = {"a": 1};</script>'
+        self.assertEqual(initial_player_response(html), {"a": 1})
+        # Truncated object, then a valid one
+        html = 'ytInitialData = {"a": ; ytInitialData = {"b": 2}'
+        self.assertEqual(initial_data(html), {"b": 2})
+        with self.assertRaises(Exception):
+            initial_player_response("<html>ytInitialData</html>")
+        with self.assertRaises(ValueError):
+            initial_data("")
+
+
+class TestMetadataEnricher(unittest.TestCase):
+    def test_dedupe_cache_and_failures(self):
+        now = [0.0]
+        calls = []
+
+        def fetch(video):
+            calls.append(video.videoId)
+            if video.videoId == "broken":
+                raise URLError("failed")
+            return {"id": video.videoId}
+
+        enricher = MetadataEnricher(
+            fetch, rate=0, ttl=60.0, max_entries=2, clock=lambda: now[0])
+        videos = [VideoPost("a"), VideoPost("b"), VideoPost("a"),
+                  VideoPost("broken")]
+        self.assertEqual(
+            enricher.get_many(videos),
+            {"a": {"id": "a"}, "b": {"id": "b"}, "broken": None})
+        self.assertEqual(sorted(calls), ["a", "b", "broken"])
+
+        # Cached, except failures
+        calls.clear()
+        self.assertEqual(enricher.get(VideoPost("a")), {"id": "a"})
+        enricher.get(VideoPost("broken"))
+        self.assertEqual(calls, ["broken"])
+
+        # Expired
+        now[0] = 61.0
+        enricher.get(VideoPost("a"))
+        self.assertEqual(calls, ["broken", "a"])
+        self.assertLessEqual(len(enricher._cache), 2)
+
+    def test_fetched_concurrently(self):
+        running = []
+        peak = []
+        lock = threading.Lock()
+
+        def fetch(video):
+            with lock:
+                running.append(video.videoId)
+                peak.append(len(running))
+            sleep(0.05)
+            with lock:
+                running.remove(video.videoId)
+            return {}
+
+        enricher = MetadataEnricher(fetch, max_workers=4, rate=0)
+        enricher.get_many([VideoPost(f"v{i}") for i in range(8)])
+        self.assertGreater(max(peak), 1)
+        self.assertLessEqual(max(peak), 4)
+
+    def test_rate_limiter(self):
+        now = [0.0]
+        slept = []
+
+        def fake_sleep(seconds):
+            slept.append(seconds)
+
+        limiter = RateLimiter(4.0, clock=lambda: now[0], sleep=fake_sleep)
+        for _ in range(3):
+            limiter.wait()
+        self.assertEqual(slept, [0.25, 0.5])
+        now[0] = 10.0
+        limiter.wait()
+        self.assertEqual(slept, [0.25, 0.5])
+
+    @patch("livestream_saver.channel.YoutubeChannel.fetch_video_metadata")
+    def test_hooks_triggered_after_metadata_fetched(
+        self, fetch_video_metadata: Mock
+    ):
+        channel = YoutubeChannel(
+            URL="",
+            channel_id="",
+            session=YoutubeUrllibSession(),
+            notifier=NotificationDispatcher()
+        )
+        fetched = []
+        spawned = []
+
+        def fetch(vid):
+            fetched.append(vid.videoId)
+            return {"videoDetails": {
+                "shortDescription": f"about {vid.videoId}",
+                "author": "someone"}}
+
+        fetch_video_metadata.side_effect = fetch
+        hook = Mock()
+        hook.spawn_subprocess.side_effect = lambda vid: spawned.append(
+            (vid.videoId, vid.description, len(fetched)))
+        channel.hooks = {"on_video_detected": hook}
+
+        videos = [VideoPost("v1"), VideoPost("v2"), VideoPost("v1")]
+        for vid in videos:
+            vid.url = f"/watch?v={vid.videoId}"
+        channel.warn_of_new(videos, "test")
+
+        self.assertEqual(sorted(fetched), ["v1", "v2"])
+        # Hooks only once everything was fetched, and once per video
+        self.assertEqual(
+            spawned, [("v1", "about v1", 2), ("v2", "about v2", 2)])
+        self.assertEqual(videos[0].get("author"), "someone")
+        self.assertEqual(videos[0].get("liveStatus", "N/A"), "N/A")
+
+
+class TestDownloadDispatcher(unittest.TestCase):
+    def test_claims(self):
+        release = threading.Event()
+        started = []
+        dispatcher = DownloadDispatcher(
+            max_workers=2, is_known=lambda key: key == "done")
+
+        def task(key):
+            started.append(key)
+            release.wait(5)
+
+        self.assertTrue(dispatcher.submit("a", task, "a"))
+        # Claimed until its task returns
+        self.assertFalse(dispatcher.submit("a", task, "a"))
+        self.assertFalse(dispatcher.submit("done", task, "done"))
+        self.assertIn("a", dispatcher)
+        release.set()
+        dispatcher.shutdown(wait=True)
+        self.assertEqual(started, ["a"])
+        self.assertNotIn("a", dispatcher)
+        stats = dispatcher.stats()
+        self.assertEqual(stats["submitted"], 1)
+        self.assertEqual(stats["duplicates"], 2)
+        self.assertEqual(stats["finished"], 1)
+        # Closed
+        self.assertFalse(dispatcher.submit("b", task, "b"))
+
+    def test_released_after_failure(self):
+        dispatcher = DownloadDispatcher(max_workers=1)
+
+        def task():
+            raise ValueError("failed")
+
+        with self.assertLogs("livestream_saver.dispatcher", "ERROR"):
+            self.assertTrue(dispatcher.submit("a", task))
+            dispatcher.shutdown(wait=True)
+        self.assertEqual(dispatcher.stats()["failed"], 1)
+        self.assertEqual(len(dispatcher), 0)
+
+    def test_burst_dispatched_immediately(self):
+        count = 4
+        barrier = threading.Barrier(count + 1)
+        dispatcher = DownloadDispatcher(max_workers=count)
+        start = monotonic()
+        for i in range(count):
+            dispatcher.submit(f"v{i}", barrier.wait, 5)
+        # Every task runs at once, without waiting between submissions
+        barrier.wait(5)
+        self.assertLess(monotonic() - start, 1.0)
+        dispatcher.shutdown(wait=True)
+        self.assertEqual(dispatcher.stats()["finished"], count)
+
+    def test_backpressure_and_shutdown(self):
+        release = threading.Event()
+        running = threading.Event()
+        dispatcher = DownloadDispatcher(max_workers=1)
+
+        def task():
+            running.set()
+            release.wait(5)
+
+        dispatcher.submit("a", task)
+        running.wait(5)
+        with self.assertLogs("livestream_saver.dispatcher", "WARNING"):
+            dispatcher.submit("b", task)
+            dispatcher.submit("c", task)
+        stats = dispatcher.stats()
+        self.assertEqual(stats["running"], 1)
+        self.assertEqual(stats["waiting"], 2)
+        self.assertEqual(stats["max_waiting"], 2)
+
+        # Waiting videos are dropped, the running one is waited for
+        threading.Timer(0.1, release.set).start()
+        dispatcher.shutdown(wait=True)
+        stats = dispatcher.stats()
+        self.assertEqual(stats["finished"], 1)
+        self.assertEqual(stats["cancelled"], 2)
+        self.assertEqual(len(dispatcher), 0)
+
+
+FEED_SAMPLE = """<?xml version="1.0" encoding="UTF-8"?>
+<feed xmlns:yt="http://www.youtube.com/xml/schemas/2015" xmlns="http://www.w3.org/2005/Atom">
+ <title>Channel</title>
+ <entry>
+  <id>yt:video:{first}</id>
+  <yt:videoId>{first}</yt:videoId>
+  <updated>{updated}</updated>
+ </entry>
+ <entry>
+  <id>yt:video:older</id>
+  <yt:videoId>older</yt:videoId>
+  <updated>2024-01-01T00:00:00+00:00</updated>
+ </entry>
+</feed>"""
+
+
+class TestRSSPrecheck(unittest.TestCase):
+    def setUp(self) -> None:
+        self.session = Mock()
+        self.ch = YoutubeChannel(
+            URL="",
+            channel_id="UCtest",
+            session=self.session,
+            notifier=NotificationDispatcher(),
+            rss_precheck=True
+        )
+        self.ch.feed = ChannelFeed("feed_url", self.session)
+
+    def feed(self, first="newer", updated="2024-01-02T00:00:00+00:00"):
+        return (FEED_SAMPLE.format(first=first, updated=updated), "etag", None)
+
+    def test_changed_video_ids(self):
+        self.session.make_conditional_request.side_effect = [
+            self.feed(),
+            (None, "etag", None),
+            self.feed(updated="2024-01-03T00:00:00+00:00"),
+            self.feed(first="newest"),
+        ]
+        feed = self.ch.feed
+        self.assertEqual(feed.changed_video_ids(), ["newer", "older"])
+        # Not modified
+        self.assertEqual(feed.changed_video_ids(), [])
+        self.session.make_conditional_request.assert_called_with(
+            "feed_url", "etag", None)
+        # Updated entry
+        self.assertEqual(feed.changed_video_ids(), ["newer"])
+        self.assertEqual(feed.changed_video_ids(), ["newest"])
+
+    @patch("livestream_saver.request.urlopen")
+    def test_not_modified_response(self, urlopen: Mock):
+        urlopen.side_effect = HTTPError(
+            "https://example.com/feed", 304, "Not Modified", {"ETag": "new"}, None)
+        content, etag, last_modified = YoutubeUrllibSession()\
+            .make_conditional_request("https://example.com/feed", "old", "yesterday")
+        self.assertIsNone(content)
+        self.assertEqual((etag, last_modified), ("new", "yesterday"))
+        headers = urlopen.call_args.args[0].headers
+        self.assertEqual(headers["If-none-match"], "old")
+        self.assertEqual(headers["If-modified-since"], "yesterday")
+
+    def test_needs_full_scan(self):
+        self.session.make_conditional_request.side_effect = [
+            self.feed(),
+            (None, "etag", None),
+            self.feed(first="newest"),
+            (None, "etag", None),
+            (None, "etag", None),
+            (None, "etag", None),
+            OSError("network is down"),
+        ]
+        # The first scan is always a full scan
+        self.assertTrue(self.ch.needs_full_scan())
+        self.ch._last_full_scan = monotonic()
+        # Feed not modified
+        self.assertFalse(self.ch.needs_full_scan())
+        # New video in the feed
+        self.assertTrue(self.ch.needs_full_scan())
+
+        upcoming = VideoPost("upcoming")
+        upcoming.upcoming = True
+        upcoming.startTime = str(int(time()) + 600)
+        self.ch._public_streams = [upcoming]
+        # Not modified, but a video is about to start
+        self.assertTrue(self.ch.needs_full_scan())
+        # Too far in the future
+        upcoming.startTime = str(int(time()) + 7200)
+        self.assertFalse(self.ch.needs_full_scan())
+        # The full scan delay has elapsed
+        self.ch._last_full_scan -= self.ch.full_scan_delay * 60
+        self.assertTrue(self.ch.needs_full_scan())
+        # Errors fall back to a full scan
+        self.assertTrue(self.ch.needs_full_scan())
+
+    @patch("livestream_saver.channel.YoutubeChannel.get_json_and_cache")
+    def test_tabs_are_not_fetched_if_feed_unchanged(
+        self, get_json_and_cache: Mock
+    ):
+        self.session.make_conditional_request.return_value = (None, "etag", None)
+        self.ch._last_full_scan = monotonic()
+        self.assertEqual(self.ch.filter_videos('isLiveNow'), [])
+        get_json_and_cache.assert_not_called()
+
+
+class TestStateStore(unittest.TestCase):
+    def test_claim_and_finish(self):
+        store = StateStore()
+        self.assertTrue(store.claim("vid1"))
+        self.assertFalse(store.claim("vid1"))
+        self.assertTrue(store.is_processing("vid1"))
+        store.finish("vid1")
+        self.assertEqual(store.get("vid1"), PROCESSED)
+        self.assertFalse(store.claim("vid1"))
+        store.release("vid1")
+        self.assertTrue(store.claim("vid1"))
+        with self.assertRaises(ValueError):
+            store.finish("vid1", PROCESSING)
+
+    def test_state_persists_across_restarts(self):
+        with TemporaryDirectory() as tmp:
+            path = Path(tmp) / "state.db"
+            store = StateStore(path)
+            store.claim("done")
+            store.finish("done")
+            store.claim("skipped")
+            store.finish("skipped", SKIPPED)
+            store.claim("interrupted")
+            store.claim("failed")
+            store.finish("failed", FAILED)
+            self.assertTrue(store.mark_hooked("done"))
+            store.close()
+
+            store = StateStore(path)
+            self.assertEqual(store.get("done"), PROCESSED)
+            self.assertEqual(store.get("skipped"), SKIPPED)
+            # Left unfinished by the previous run, can be resumed
+            self.assertIsNone(store.get("interrupted"))
+            self.assertTrue(store.claim("interrupted"))
+            # Failed during the previous run, can be retried
+            self.assertIsNone(store.get("failed"))
+            self.assertFalse(store.mark_hooked("done"))
+            store.close()
+
+            # Old entries are dropped
+            store = StateStore(path, retention_days=-1)
+            self.assertEqual(len(store), 0)
+            self.assertTrue(store.mark_hooked("done"))
+            store.close()
+
+    def test_cache_is_bounded(self):
+        store = StateStore(cache_size=10)
+        for i in range(100):
+            store.claim(f"vid{i}")
+            self.assertTrue(store.mark_hooked(f"vid{i}"))
+        self.assertEqual(len(store._cache), 10)
+        self.assertEqual(len(store), 100)
+        # Evicted entries are read back from the database
+        self.assertTrue(store.is_processing("vid0"))
+        self.assertFalse(store.mark_hooked("vid0"))
+
+    @patch.object(ls_main, "NOTIFIER")
+    @patch.object(ls_main, "YoutubeLiveStream")
+    def test_failed_download(self, live_stream_mock: Mock, _):
+        config = init_config()
+        args = {"hooks": {}, "filters": {}, "ytdlp_config": {},
+                "output_dir": None}
+        live_video = live_stream_mock.return_value
+        live_video.skip_download = False
+        live_video.pre_download_checks.return_value = True
+
+        with patch.object(ls_main, "video_state", StateStore()) as store:
+            # Error reported by the download
+            live_video.error = "Stream went away"
+            live_video.done = False
+            download_task(VideoPost("vid1"), config, args, Mock())
+            self.assertEqual(store.get("vid1"), FAILED)
+            # Not retried until the next run
+            self.assertFalse(store.claim("vid1"))
+
+            # Exception raised by the download
+            live_video.error = None
+            live_video.download.side_effect = ValueError("failed")
+            with self.assertLogs("livestream_saver", "ERROR"):
+                download_task(VideoPost("vid2"), config, args, Mock())
+            self.assertEqual(store.get("vid2"), FAILED)
+
+            live_video.download.side_effect = None
+            live_video.done = True
+            video = VideoPost("vid3")
+            video.channel_name = "channel"
+            with patch.object(ls_main, "merge_queue", None):
+                download_task(video, config, args, Mock())
+            self.assertEqual(store.get("vid3"), PROCESSED)
+
+    def test_hooks_are_triggered_once(self):
+        channel = YoutubeChannel(
+            URL="",
+            channel_id="",
+            session=YoutubeUrllibSession(),
+            notifier=NotificationDispatcher()
+        )
+        self.assertFalse(channel.is_hooked_video("vid"))
+        self.assertTrue(channel.is_hooked_video("vid"))
+        self.assertTrue(channel.is_hooked_video(None))
+
+
 class TestDownload(unittest.TestCase):
     def setUp(self) -> None:
         # TODO a lof of methods to patch here; we might need
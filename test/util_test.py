@@ -1,7 +1,10 @@
 import unittest
 import re
 
-from livestream_saver.util import none_filtered_out
+from livestream_saver import util
+from livestream_saver.util import (
+    none_filtered_out, json_loads, set_json_backend, JSON_BACKENDS
+)
 
 # Run with pytest -vv -s --maxfail=10 test/unit_tests.py
 
@@ -41,4 +44,34 @@ class test_regex_in_config(unittest.TestCase):
             (None, None), None, blocked) is True
         
         assert none_filtered_out(
-            (None, None), blocked, blocked) is True
\ No newline at end of file
+            (None, None), blocked, blocked) is True
+
+class test_json_backends(unittest.TestCase):
+    def tearDown(self) -> None:
+        set_json_backend(next(iter(JSON_BACKENDS)))
+
+    def test_backends_agree(self):
+        doc = '{"a": [1, 2.5, null, true], "b": "\\u3042 \\ud83d\\ude00"}'
+        results = []
+        for backend in JSON_BACKENDS:
+            set_json_backend(backend)
+            results.append(json_loads(doc))
+            results.append(json_loads(doc.encode()))
+        assert all(r == results[0] for r in results)
+        assert results[0]["b"] == "\u3042 \U0001f600"
+
+    def test_unpaired_surrogate_falls_back(self):
+        for backend in JSON_BACKENDS:
+            set_json_backend(backend)
+            assert json_loads('{"title": "\\ud800"}') == {"title": "\ud800"}
+
+    def test_invalid_json_raises(self):
+        for backend in JSON_BACKENDS:
+            set_json_backend(backend)
+            with self.assertRaises(ValueError):
+                json_loads("{")
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            set_json_backend("nope")
+        assert util.json_backend in JSON_BACKENDS